@@ -1,92 +1,119 @@
 #!/bin/bash
 
+#####
+# Startup timing
+#
+# Each step is timed, the report is printed before uWSGI starts and appended
+# to $STARTUP_TIMING_LOG, one JSON line per boot, to spot slow startups.
+#####
+STARTUP_TIMING_LOG=${STARTUP_TIMING_LOG:-/var/log/startup-timing.log}
+BOOT_START=$(date +%s%3N)
+TIMINGS=""
+
+# Usage: timed <step name> <command> [arguments...]
+timed() {
+    local name=$1; shift
+    local start=$(date +%s%3N)
+    "$@"
+    local status=$?
+    TIMINGS="$TIMINGS\"$name\": $(( $(date +%s%3N) - start )), "
+    return $status
+}
+
+report_timing() {
+    local report="{\"date\": \"$(date -Iseconds)\", ${TIMINGS}\"total\": $(( $(date +%s%3N) - BOOT_START ))}"
+    echo "==> Startup timing (ms): $report"
+    echo "$report" >> "$STARTUP_TIMING_LOG"
+}
+
 #####
 # Postgres: wait until container is created
 #####
-until python3 /srv/code/config/database-check.py; do
-    sleep 5; echo "*** Waiting for postgres container ..."
-done
+wait_for_database() {
+    until python3 /srv/code/config/database-check.py; do
+        sleep 5; echo "*** Waiting for postgres container ..."
+    done
+}
+timed database wait_for_database
 
 echo "*** Postgres container is up, launching Django..."
 
 #####
 # Django setup
 #####
-if [ "$PRODUCTION" == "true" ]; then
-    # Django: migrate
-    #
-    # Django will see that the tables for the initial migrations already exist
-    # and mark them as applied without running them. (Django won’t check that the
-    # table schema match your models, just that the right table names exist).
-    echo "==> Django setup, executing: migrate"
-    python3 /srv/code/manage.py migrate --fake-initial
-
-    # Django: collectstatic
-    #
-    # Only if you want to upload the files to Amazone S3 :
-    # STATICFILES_STORAGE = 'storages.backends.s3boto.S3BotoStorage'
-    echo "==> Django setup, executing: collectstatic"
-    python3 /srv/code/manage.py collectstatic --noinput -v 3
-else
-    # Django: reset database
-    # https://docs.djangoproject.com/en/1.9/ref/django-admin/#flush
-    #
-    # This will give some errors when there is no database to be flushed, but
-    # you can ignore these messages.
-    # echo "==> Django setup, executing: flush"
-    # python3 /srv/code/manage.py flush --noinput
-    ## If our app structure will rely on db content, we may not want
-    ## to flush the db each time docker is started once dev starts. 
-    ## (Un)comment as needed.
-
-    # Django: migrate
-    #
-    # Django will see that the tables for the initial migrations already exist
-    # and mark them as applied without running them. (Django won’t check that the
-    # table schema match your models, just that the right table names exist).
-    echo "==> Django setup, executing: migrate"
-    python3 /srv/code/manage.py migrate --fake-initial
 
-    # Django: collectstatic
-    echo "==> Django setup, executing: collectstatic"
-    python3 /srv/code/manage.py collectstatic --noinput -v 3
-
-fi
-
-chown -R django:django /srv
+# Django: migrate, only when there are unapplied migrations
+#
+# Django will see that the tables for the initial migrations already exist
+# and mark them as applied without running them. (Django won’t check that the
+# table schema match your models, just that the right table names exist).
+migrate_if_needed() {
+    if python3 /srv/code/manage.py showmigrations --plan | grep -q '^\[ \]'; then
+        echo "==> Django setup, executing: migrate"
+        python3 /srv/code/manage.py migrate --fake-initial
+    else
+        echo "==> Django setup, no pending migrations"
+    fi
+}
+
+# Django: static files
+#
+# collectstatic runs when the image is built (see Dockerfile.app), in
+# /srv/static-build. They are copied to the static-files volume only when the
+# manifest changed. Old hashed files are kept for the pages cached with them.
+# After changing static files in development, run "manage.py collectstatic".
+sync_static() {
+    if [ ! -f /srv/static-build/staticfiles.json ]; then
+        echo "==> Django setup, executing: collectstatic"
+        python3 /srv/code/manage.py collectstatic --noinput
+    elif ! cmp -s /srv/static-build/staticfiles.json /srv/static/staticfiles.json; then
+        echo "==> Django setup, copying the static files of the image"
+        cp -a /srv/static-build/. /srv/static/
+    else
+        echo "==> Django setup, static files are up to date"
+    fi
+}
+
+# Django: reset database, in development
+# https://docs.djangoproject.com/en/1.9/ref/django-admin/#flush
+#
+# This will give some errors when there is no database to be flushed, but
+# you can ignore these messages.
+# if [ "$PRODUCTION" != "true" ]; then
+#     echo "==> Django setup, executing: flush"
+#     python3 /srv/code/manage.py flush --noinput
+# fi
+## If our app structure will rely on db content, we may not want
+## to flush the db each time docker is started once dev starts.
+## (Un)comment as needed.
+
+# Django: connection budget
+#
+# Refuse to start more uWSGI processes and threads than Postgres accepts
+# connections, e.g. on a host with more cores (see project/db.py)
+timed budget python3 /srv/code/manage.py check_connection_budget || exit 1
+
+timed migrate migrate_if_needed
+timed static sync_static
+
+# Ownership: uWSGI runs as django and writes the uploaded media. Only the
+# top of the volume is checked, the tree is walked on its first boot only.
+fix_ownership() {
+    if [ "$(stat -c %U /srv/media)" != "django" ]; then
+        chown -R django:django /srv/media
+    fi
+}
+timed ownership fix_ownership
 
 #####
-# Launch Cron for Django backups
+# Scheduled commands (backups, WikidataClass tables) run in the scheduler
+# container, see SCHEDULE in the settings and docker-compose.yml
 #####
 
-echo "==> Launching Cron for Django backups"
-
-apt-get install cron -y
-
-# Grant execution rights
-chmod +x /srv/code/config/dj_backup_rotated.sh
-
-# Create the log file
-echo "Creating log file"
-touch /var/log/cron.log
-
-# Add the cron job
-echo "Running add to Crontab command"
-(crontab -l ; echo "0 3 * * * root /srv/code/config/dj_backup_rotated.sh > /var/log/cron.log 2>&1")| crontab -
-
-crontab -l
-
-echo "Django backups settled"
+report_timing
 
 #####
 # Start uWSGI
 #####
 echo "==> Starting uWSGI ..."
 /usr/local/bin/uwsgi --emperor /etc/uwsgi/django-uwsgi.ini
-
-
-
-
-
-
-
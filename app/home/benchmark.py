@@ -0,0 +1,449 @@
+'''
+Benchmark of the pages and endpoints of the site, run by "manage.py benchmark".
+
+A synthetic tree is seeded on its own Wagtail site (BENCHMARK_HOST), with a
+fixed random seed so that two runs render the same pages:
+- a HomePage with categories, a tag index, articles, WikidataClass and
+  ItemPages
+- images and documents in a "Benchmark" collection
+- article bodies and item notes with every block type
+The data Wikidata, SPARQL endpoints and oEmbed providers would give is
+stored beforehand (WikidataEntity, WikidataClassTable, SPARQL cache, Embed),
+so that no request leaves the process.
+
+Requests are then replayed, in a mix drawn with the same seed, against the
+WSGI application of this process, without a server. The report gives, for
+each kind of request and in total, the throughput, latency percentiles and
+mean number of SQL queries, plus the peak RSS of the process while
+replaying them (not seeding them: the peak is reset first, on Linux), as JSON.
+Compared with a baseline report, the regressions beyond a tolerance make the
+command fail.
+'''
+
+import io
+import json
+import random
+import resource
+import sys
+import time
+from collections import OrderedDict, defaultdict
+from datetime import date, datetime, timedelta
+from wsgiref.util import setup_testing_defaults
+
+import django
+import wagtail
+from PIL import Image as PILImage
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.images import ImageFile
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from wagtail.core.models import Collection, Page, Site
+from wagtail.documents.models import get_document_model
+from wagtail.embeds.models import Embed
+from wagtail.images import get_image_model
+
+from home import materialize, sparql
+from home.models import (
+    ArticleCategory, ArticlePage, ArticlePageTag, ArticleTagIndexPage, HomePage,
+    ItemPage, WikidataClass, WikidataClassTable, WikidataEntity
+)
+from home.tags import update_tag_counts
+from search.indexing import enqueue_update, flush
+
+BENCHMARK_HOST = 'benchmark.localhost'
+COLLECTION_NAME = 'Benchmark'
+
+DEFAULT_SIZES = OrderedDict([
+    ('articles', 200),
+    ('categories', 8),
+    ('tags', 30),
+    ('images', 20),
+    ('classes', 5),
+    ('class_rows', 2000),
+    ('items', 100),
+])
+
+## Kinds of requests with their share of the mix. ArticleCategory pages have
+## no template, they are only rendered in the listings of the others.
+DEFAULT_MIX = OrderedDict([
+    ('home', 10),
+    ('article', 35),
+    ('tag_index', 5),
+    ('wikidata_class', 10),
+    ('item', 15),
+    ('search', 10),
+    ('api_list', 10),
+    ('api_detail', 5),
+])
+
+WORDS = (
+    'river', 'mountain', 'forest', 'city', 'language', 'painting', 'protein',
+    'galaxy', 'library', 'bridge', 'island', 'music', 'theorem', 'volcano',
+)
+
+PIDS = ['P17', 'P31', 'P571', 'P1082']
+
+## Qids of the items and classes, far beyond the ids of Wikidata so that the
+## entities and pages of the site are never overwritten nor duplicated
+ITEM_QIDS = 9000000000
+CLASS_QIDS = 9100000000
+
+EMBED_URL = 'https://www.youtube.com/watch?v=benchmark'
+
+WIKIDATA_QUERY = 'SELECT ?item ?itemLabel WHERE { ?item wdt:P31 wd:Q5 } LIMIT 20'
+
+
+## Synthetic tree
+
+def sentence(rng, words=8):
+    return ' '.join(rng.choice(WORDS) for i in range(words)).capitalize()
+
+
+def make_image(rng, title, collection):
+    content = io.BytesIO()
+    color = tuple(rng.randrange(256) for i in range(3))
+    PILImage.new('RGB', (rng.randrange(600, 1600), rng.randrange(400, 1200)), color).save(content, 'JPEG')
+    return get_image_model().objects.create(
+        title=title, collection=collection, file=ImageFile(content, name='%s.jpg' % title)
+    )
+
+
+def make_stream(rng, images, documents, pages, blocks=12):
+    ''' Raw StreamField value using every block type '''
+    def paragraph():
+        return '<p>%s <a linktype="page" id="%d">%s</a>.</p><embed alt="" embedtype="image" format="left" id="%d"/>' % (
+            sentence(rng, 30), rng.choice(pages).pk, sentence(rng, 2), rng.choice(images).pk
+        )
+
+    kinds = OrderedDict([
+        ('heading', lambda: sentence(rng, 4)),
+        ('paragraph', paragraph),
+        ('image', lambda: rng.choice(images).pk),
+        ('quote', lambda: sentence(rng, 15)),
+        ('page', lambda: rng.choice(pages).pk),
+        ('document', lambda: rng.choice(documents).pk),
+        ('embed', lambda: EMBED_URL),
+        ('wikidata_query', lambda: {'query_intro': paragraph(), 'query_sparql': WIKIDATA_QUERY}),
+    ])
+    # Every type once, then mostly text as in real articles
+    types = list(kinds) + rng.choices(['heading', 'paragraph', 'paragraph', 'image', 'quote'], k=max(0, blocks - len(kinds)))
+    return json.dumps([{'type': kind, 'value': kinds[kind]()} for kind in types])
+
+
+def fake_entity(rng, qid):
+    ''' Fields of a WikidataEntity as home.wikidata would store them '''
+    references = ['Q%d' % rng.randrange(1, 100000) for i in range(8)]
+    claims = [
+        {'property': pid, 'values': [
+            {'type': 'entity', 'id': reference, 'qualifiers': []}
+            for reference in rng.sample(references, 2)
+        ]}
+        for pid in PIDS
+    ]
+    label = sentence(rng, 2)
+    return {
+        'revision_id': 1,
+        'label': label,
+        'description': sentence(rng, 10),
+        'aliases': [sentence(rng, 2)],
+        'data': {
+            'claims': claims,
+            'labels': dict([(pid, sentence(rng, 2)) for pid in PIDS] + [(ref, sentence(rng, 2)) for ref in references]),
+            'wikipedia': {
+                'title': label,
+                'url': 'https://en.wikipedia.org/wiki/%s' % label.replace(' ', '_'),
+                'intro': sentence(rng, 80),
+            },
+        },
+        'fetched_at': timezone.now(),
+    }
+
+
+def fake_table(rng, page, rows):
+    data = OrderedDict([(materialize.ITEM, []), (materialize.LABEL, [])] + [(pid, []) for pid in page.featured_Pids])
+    for i in range(rows):
+        data[materialize.ITEM].append('Q%d' % (100000 + i))
+        data[materialize.LABEL].append(sentence(rng, 2))
+        for pid in page.featured_Pids:
+            data[pid].append(str(rng.randrange(10000)) if pid == 'P1082' else sentence(rng, 1))
+    return WikidataClassTable(
+        page=page, class_Qid=page.class_Qid, columns=list(data),
+        column_labels=['Item', 'Label'] + page.featured_Pids, data=data, row_count=rows,
+        status=WikidataClassTable.READY, built_at=timezone.now(),
+    )
+
+
+def delete_tree():
+    ''' Remove the benchmark site, its pages, entities, images and documents '''
+    for site in Site.objects.filter(hostname=BENCHMARK_HOST):
+        root_page = site.root_page
+        qids = list(ItemPage.objects.descendant_of(root_page).values_list('item_Qid', flat=True))
+        site.delete()
+        root_page.delete()
+        WikidataEntity.objects.filter(entity_id__in=qids).delete()
+    for collection in Collection.objects.filter(name=COLLECTION_NAME):
+        get_image_model().objects.filter(collection=collection).delete()
+        get_document_model().objects.filter(collection=collection).delete()
+        collection.delete()
+
+
+def seed_tree(sizes, seed=0):
+    ''' Create the benchmark tree, replacing a previous one '''
+    rng = random.Random(seed)
+    delete_tree()
+
+    collection = Collection.get_first_root_node().add_child(name=COLLECTION_NAME)
+    images = [make_image(rng, 'benchmark-%d' % i, collection) for i in range(sizes['images'])]
+    documents = [
+        get_document_model().objects.create(
+            title='benchmark-%d' % i, collection=collection,
+            file=ContentFile(sentence(rng, 200).encode(), name='benchmark-%d.txt' % i)
+        )
+        for i in range(3)
+    ]
+    Embed.objects.get_or_create(url=EMBED_URL, max_width=None, defaults={
+        'type': 'video', 'title': 'Benchmark', 'provider_name': 'YouTube',
+        'html': '<iframe width="480" height="270" src="https://www.youtube.com/embed/benchmark"></iframe>',
+    })
+
+    home = Page.get_first_root_node().add_child(instance=HomePage(
+        title='Benchmark', slug='benchmark-%d' % seed, intro='<p>%s</p>' % sentence(rng, 40),
+        intro_image=rng.choice(images), feed_image=rng.choice(images),
+    ))
+    Site.objects.create(hostname=BENCHMARK_HOST, port=80, root_page=home, site_name='Benchmark')
+
+    categories = [
+        home.add_child(instance=ArticleCategory(
+            title='Category %d' % i, intro='<p>%s</p>' % sentence(rng, 20),
+            icon_image=rng.choice(images), feed_image=rng.choice(images),
+        ))
+        for i in range(sizes['categories'])
+    ]
+    home.add_child(instance=ArticleTagIndexPage(title='Tags', slug='tags'))
+
+    tags = ['%s-%d' % (rng.choice(WORDS), i) for i in range(sizes['tags'])]
+    articles = []
+    for i in range(sizes['articles']):
+        article = ArticlePage(
+            title='%s %d' % (sentence(rng, 3), i), date=date(2019, 1, 1) + timedelta(days=i),
+            # Set by publishing in the admin, the listings are ordered by it
+            first_published_at=datetime(2019, 1, 1, tzinfo=timezone.utc) + timedelta(days=i),
+            feed_image=rng.choice(images), intro_image=rng.choice(images),
+            body=make_stream(rng, images, documents, categories + articles[-20:] or [home]),
+        )
+        article.categories = rng.sample(categories, min(2, len(categories)))
+        article.tags.add(*rng.sample(tags, min(3, len(tags))))
+        articles.append(home.add_child(instance=article))
+
+    classes = []
+    for i in range(sizes['classes']):
+        page = home.add_child(instance=WikidataClass(
+            title='Class %d' % i, class_Qid='Q%d' % (CLASS_QIDS + i), featured_Pids=PIDS,
+        ))
+        fake_table(rng, page, sizes['class_rows']).save()
+        classes.append(page)
+
+    items = []
+    for i in range(sizes['items']):
+        qid = 'Q%d' % (ITEM_QIDS + i)
+        WikidataEntity.objects.update_or_create(entity_id=qid, defaults=fake_entity(rng, qid))
+        items.append(home.add_child(instance=ItemPage(
+            title='Item %d' % i, item_Qid=qid, featured_Pids=PIDS[:2], feed_image=rng.choice(images),
+            notes=make_stream(rng, images, documents, articles or [home], blocks=6),
+        )))
+
+    update_tag_counts(ArticlePageTag.objects.filter(content_object__in=articles).values_list('tag_id', flat=True))
+    for page in [home] + categories + articles + classes + items:
+        enqueue_update(page)
+    flush()
+    return home
+
+
+def prime_caches():
+    '''
+    Make the data of the tree fresh again, so that a run started long after
+    seeding does not refresh it from Wikidata in the background
+    '''
+    WikidataEntity.objects.filter(entity_id__in=ItemPage.objects.filter(
+        path__startswith=get_root().path
+    ).values('item_Qid')).update(fetched_at=timezone.now())
+    WikidataClassTable.objects.filter(page__path__startswith=get_root().path).update(built_at=timezone.now())
+    cache.set(sparql.query_key(WIKIDATA_QUERY), {
+        'columns': ['item', 'itemLabel'],
+        'rows': [['http://www.wikidata.org/entity/Q%d' % i, 'Person %d' % i] for i in range(20)],
+        'error': None,
+        'fetched_at': time.time(),
+    }, None)
+
+
+def get_root():
+    site = Site.objects.filter(hostname=BENCHMARK_HOST).select_related('root_page').first()
+    return site.root_page if site is not None else None
+
+
+## Requests
+
+def get_paths(root):
+    ''' Paths of each kind of request, on the benchmark site '''
+    def paths(model):
+        return [page.url_path[len(root.url_path) - 1:] for page in model.objects.descendant_of(root).live()]
+
+    articles = ArticlePage.objects.descendant_of(root).live()
+    return {
+        'home': ['/', '/?page=2'],
+        'article': paths(ArticlePage),
+        'tag_index': [
+            '%s?tag=%s' % (path, tag)
+            for path in paths(ArticleTagIndexPage)
+            for tag in ArticlePageTag.objects.filter(content_object__in=articles).values_list('tag__name', flat=True).distinct()[:20]
+        ],
+        'wikidata_class': [
+            path + query for path in paths(WikidataClass)
+            for query in ('', '?sort=P1082&order=desc', '?q=river', '?page=3')
+        ],
+        'item': paths(ItemPage),
+        'search': ['/search/?query=%s' % word for word in WORDS],
+        'api_list': [
+            '/api/v2/pages/?type=home.ArticlePage&fields=date,feed_image,categories&limit=20&offset=%d' % offset
+            for offset in range(0, 100, 20)
+        ],
+        'api_detail': ['/api/v2/pages/%d/' % pk for pk in articles.values_list('pk', flat=True)[:50]],
+    }
+
+
+def draw_requests(paths, mix, count, seed=0):
+    ''' [(kind, path)] drawn with the weights of the mix '''
+    rng = random.Random(seed)
+    kinds = [kind for kind in mix if paths.get(kind)]
+    drawn = rng.choices(kinds, weights=[mix[kind] for kind in kinds], k=count)
+    return [(kind, rng.choice(paths[kind])) for kind in drawn]
+
+
+class QueryCounter:
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def call(application, path):
+    ''' Status and number of SQL queries of a GET request served in process '''
+    path, _, query_string = path.partition('?')
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query_string,
+        'HTTP_HOST': BENCHMARK_HOST, 'SERVER_NAME': BENCHMARK_HOST, 'SERVER_PORT': '80',
+        'wsgi.input': io.BytesIO(),
+    }
+    setup_testing_defaults(environ)
+    status = []
+    counter = QueryCounter()
+    with connection.execute_wrapper(counter):
+        response = application(environ, lambda status_line, headers, exc_info=None: status.append(status_line))
+        try:
+            for chunk in response:
+                pass
+        finally:
+            if hasattr(response, 'close'):
+                response.close()
+    return int(status[0].split()[0]), counter.count
+
+
+## Report
+
+def percentile(values, rank):
+    ''' Nearest rank percentile of sorted values '''
+    if not values:
+        return 0
+    return values[min(len(values) - 1, max(0, int(round(rank / 100 * len(values))) - 1))]
+
+
+def summarize(timings):
+    ''' Statistics of a list of (seconds, SQL queries, status) '''
+    durations = sorted(seconds for seconds, queries, status in timings)
+    total = sum(durations)
+    return OrderedDict([
+        ('requests', len(timings)),
+        ('errors', sum(1 for seconds, queries, status in timings if status >= 400)),
+        ('throughput', round(len(timings) / total, 2) if total else 0),
+        ('mean_ms', round(total / len(timings) * 1000, 2) if timings else 0),
+        ('p50_ms', round(percentile(durations, 50) * 1000, 2)),
+        ('p90_ms', round(percentile(durations, 90) * 1000, 2)),
+        ('p99_ms', round(percentile(durations, 99) * 1000, 2)),
+        ('max_ms', round(durations[-1] * 1000, 2) if durations else 0),
+        ('sql_mean', round(sum(queries for seconds, queries, status in timings) / len(timings), 2) if timings else 0),
+    ])
+
+
+def reset_peak_rss():
+    ''' Forget the peak RSS of the process so far, False if it cannot be done (Linux only) '''
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        return False
+    return True
+
+
+def run(requests, warmup=0, cold=False):
+    '''
+    Replay the requests, the first warmup ones not being measured, and return the report.
+    peak_rss_mb is None when the peak of the seeding could not be forgotten.
+    '''
+    application = get_wsgi_application()
+    timings = defaultdict(list)
+    rss_reset = reset_peak_rss()
+    with override_settings(ALLOWED_HOSTS=[BENCHMARK_HOST]):
+        for i, (kind, path) in enumerate(requests):
+            if cold:
+                cache.clear()
+                prime_caches()
+            start = time.perf_counter()
+            status, queries = call(application, path)
+            seconds = time.perf_counter() - start
+            if i >= warmup:
+                timings[kind].append((seconds, queries, status))
+
+    report = OrderedDict([
+        ('python', sys.version.split()[0]),
+        ('django', django.get_version()),
+        ('wagtail', wagtail.__version__),
+        ('cold', cold),
+        ('total', summarize([timing for kind_timings in timings.values() for timing in kind_timings])),
+        ('kinds', OrderedDict((kind, summarize(timings[kind])) for kind in sorted(timings))),
+        # Kilobytes on Linux
+        ('peak_rss_mb', round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1) if rss_reset else None),
+    ])
+    return report
+
+
+def compare(report, baseline, tolerance=0.2):
+    '''
+    Regressions of a report from a baseline, as messages: slower median
+    or 90th percentile, lower throughput or higher peak RSS beyond the
+    tolerance, more SQL queries or new errors.
+    '''
+    regressions = []
+    kinds = dict(baseline.get('kinds', {}), total=baseline.get('total', {}))
+    for kind, stats in dict(report['kinds'], total=report['total']).items():
+        before = kinds.get(kind)
+        if not before:
+            continue
+        for name in ('p50_ms', 'p90_ms'):
+            if stats[name] > before[name] * (1 + tolerance):
+                regressions.append('%s: %s %.1f > %.1f' % (kind, name, stats[name], before[name]))
+        if stats['throughput'] < before['throughput'] * (1 - tolerance):
+            regressions.append('%s: throughput %.1f < %.1f' % (kind, stats['throughput'], before['throughput']))
+        if stats['sql_mean'] > before['sql_mean'] + 0.5:
+            regressions.append('%s: sql_mean %.1f > %.1f' % (kind, stats['sql_mean'], before['sql_mean']))
+        if stats['errors'] > before['errors']:
+            regressions.append('%s: errors %d > %d' % (kind, stats['errors'], before['errors']))
+    if report['peak_rss_mb'] and report['peak_rss_mb'] > (baseline.get('peak_rss_mb') or float('inf')) * (1 + tolerance):
+        regressions.append('peak_rss_mb %.1f > %.1f' % (report['peak_rss_mb'], baseline['peak_rss_mb']))
+    return regressions
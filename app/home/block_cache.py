@@ -0,0 +1,173 @@
+'''
+Render cache of the blocks of StreamFields (ArticlePage.body, ItemPage.notes).
+
+{% include_cached_stream page.body %} renders like {% include_block %}, but
+each block is read from the cache when it can be:
+- the key of a block is its id, a hash of its content, and the generations
+  of the pages, images and documents it refers to (chooser blocks, links
+  and images of rich text). Editing a block changes its hash, publishing a
+  referenced page (see home/page_cache.py) or saving a referenced image or
+  document bumps their generation: only the blocks showing them are
+  rendered again
+- the cached blocks are found with three cache calls whatever their number
+- the other blocks are rendered with the objects they refer to loaded in
+  bulk: one query per block type, one for the renditions of their images,
+  and a few for the links and images of their rich texts (see
+  home/rich_text.py)
+
+Wikidata query blocks are always rendered: their results have their own
+cache, with its own lifetime (see home/sparql.py).
+'''
+
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.html import format_html_join
+
+from wagtail.core.blocks import ListBlock, PageChooserBlock, RichTextBlock, StructBlock
+from wagtail.documents.blocks import DocumentChooserBlock
+from wagtail.images.blocks import ImageChooserBlock
+
+from home import page_cache, rich_text
+from home.custom_blocks import WdQueryBlock
+from home.listings import get_renditions
+
+UNCACHED_BLOCKS = (WdQueryBlock,)
+
+
+## Dependencies
+
+def dependency_key(kind, pk):
+    return 'block-dependency:%s:%d' % (kind, pk)
+
+
+def invalidate(kind, pk):
+    ''' Render again the blocks showing this image or document '''
+    key = dependency_key(kind, pk)
+    cache.set(key, cache.get(key, 0) + 1, None)
+
+
+def get_leaves(block, value):
+    ''' (block, raw value) of the blocks without children of a raw block value '''
+    if value is None:
+        return []
+    if isinstance(block, StructBlock):
+        return [
+            leaf for name, child_block in block.child_blocks.items()
+            for leaf in get_leaves(child_block, value.get(name))
+        ]
+    if isinstance(block, ListBlock):
+        return [leaf for item in value for leaf in get_leaves(block.child_block, item)]
+    return [(block, value)]
+
+
+def get_references(block, value):
+    ''' (kind, pk) of the pages, images and documents a raw block value refers to '''
+    kinds = ((PageChooserBlock, 'page'), (ImageChooserBlock, 'image'), (DocumentChooserBlock, 'document'))
+    references = []
+    for leaf_block, leaf_value in get_leaves(block, value):
+        if isinstance(leaf_block, RichTextBlock):
+            references.extend(rich_text.get_references(leaf_value))
+        for chooser_block, kind in kinds:
+            if isinstance(leaf_block, chooser_block):
+                references.append((kind, int(leaf_value)))
+    return references
+
+
+def get_generations(references):
+    ''' Generations of the references, pages' ones being their page cache generation '''
+    page_ids = {pk for kind, pk in references if kind == 'page'}
+    generations = {('page', pk): generation for pk, generation in page_cache.get_generations(page_ids).items()}
+
+    keys = {dependency_key(kind, pk): (kind, pk) for kind, pk in references if kind != 'page'}
+    values = cache.get_many(keys)
+    for key, reference in keys.items():
+        generations[reference] = values.get(key, 0)
+    return generations
+
+
+## Rendering
+
+def block_key(raw, references, generations, host):
+    content = json.dumps([raw['type'], raw['value']], sort_keys=True, cls=DjangoJSONEncoder)
+    dependencies = ','.join('%s%d:%d' % (kind[0], pk, generations[kind, pk]) for kind, pk in references)
+    digest = hashlib.md5('|'.join([content, dependencies, host]).encode('utf-8')).hexdigest()
+    return 'block:%s:%s' % (raw.get('id') or '-', digest)
+
+
+def is_cacheable(value):
+    ''' Only streams read from the database, rendered block by block, are cached '''
+    return (
+        getattr(value, 'is_lazy', False)
+        and not getattr(value.stream_block.meta, 'template', None)
+        and all(isinstance(raw, dict) for raw in value.stream_data)
+    )
+
+
+def render_blocks(value, indexes, context):
+    ''' HTML of some blocks of a stream, rendering their images and rich texts in bulk '''
+    children = {i: value[i] for i in indexes}
+    sources = [
+        leaf_value
+        for i in indexes
+        for leaf_block, leaf_value in get_leaves(children[i].block, value.stream_data[i]['value'])
+        if isinstance(leaf_block, RichTextBlock)
+    ]
+
+    images = [
+        child.value for child in children.values()
+        if type(child.block) is ImageChooserBlock and not getattr(child.block.meta, 'template', None) and child.value
+    ]
+    renditions = get_renditions(images, 'original')
+
+    html = {}
+    with rich_text.prefetched(sources):
+        for i, child in children.items():
+            if type(child.block) is ImageChooserBlock and child.value and child.value.pk in renditions:
+                html[i] = renditions[child.value.pk].img_tag()
+            else:
+                html[i] = child.render(context=context)
+    return html
+
+
+def render_stream(value, context=None):
+    ''' HTML of a StreamField value, as StreamBlock.render_basic, with its blocks cached '''
+    if not value:
+        return ''
+    if not is_cacheable(value):
+        return value.render_as_block(context=context)
+
+    request = (context or {}).get('request')
+    host = request.get_host() if request is not None else ''
+    child_blocks = value.stream_block.child_blocks
+
+    references = {}
+    for i, raw in enumerate(value.stream_data):
+        block = child_blocks[raw['type']]
+        if not isinstance(block, UNCACHED_BLOCKS):
+            references[i] = get_references(block, raw['value'])
+    generations = get_generations({reference for refs in references.values() for reference in refs})
+
+    keys = {
+        i: block_key(value.stream_data[i], refs, generations, host)
+        for i, refs in references.items()
+    }
+    html = cache.get_many(keys.values())
+    html = {i: html[key] for i, key in keys.items() if key in html}
+
+    missing = [i for i in range(len(value.stream_data)) if i not in html]
+    if missing:
+        rendered = render_blocks(value, missing, context)
+        cache.set_many(
+            {keys[i]: rendered[i] for i in missing if i in keys},
+            settings.BLOCK_CACHE_TIMEOUT
+        )
+        html.update(rendered)
+
+    return format_html_join(
+        '\n', '<div class="block-{1}">{0}</div>',
+        [(html[i], raw['type']) for i, raw in enumerate(value.stream_data)]
+    )
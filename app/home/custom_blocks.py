@@ -1,9 +1,34 @@
+from django.urls import reverse
 from wagtail.core import blocks
 
+from home import page_cache, query_tables, sparql
+
 class WdQueryBlock(blocks.StructBlock):
     query_intro = blocks.RichTextBlock(required=False)
     query_sparql = blocks.TextBlock(help_text='Past here a Wikidata SPARQL request. You can test it before at query.wikidata.org.')
 
+    def get_context(self, value, parent_context=None):
+        # Run the query (or get it from the cache) when the page is rendered
+        context = super().get_context(value, parent_context=parent_context)
+        query = value['query_sparql']
+        context['table_id'] = query_tables.table_id(query)
+        context['results'] = query_tables.get_table(query)
+        context['query_url'] = sparql.query_service_url(query)
+        request = (parent_context or {}).get('request')
+        if context['results'] is None or context['results'].error:
+            # The page asks to be reloaded, it must not be served from the cache
+            page_cache.mark_uncacheable(request)
+
+        # The rows of live pages are loaded page by page (see home/query_tables.py),
+        # previews of drafts still get them all in the page
+        page = (parent_context or {}).get('page')
+        if page is not None and page.live and not getattr(request, 'is_preview', False):
+            args = (page.pk, context['table_id'])
+            context['rows_url'] = reverse('wdquery_rows', args=args)
+            context['csv_url'] = reverse('wdquery_download', args=args + ('csv',))
+            context['ndjson_url'] = reverse('wdquery_download', args=args + ('ndjson',))
+        return context
+
     class Meta:
         icon = 'db'
-        template = 'home/wd_query_block.html'
\ No newline at end of file
+        template = 'home/wd_query_block.html'
@@ -0,0 +1,415 @@
+'''
+Graph of the links between Wikidata items, for the nearby items of ItemPages.
+
+The nearby items were a SPARQL query taking up to a minute on popular items.
+The links between the entities of the store (see home/wikidata.py) are now
+kept in a compact index answering in milliseconds:
+- links are statements whose value is an item. They are stored as numpy
+  arrays in GRAPH_DIR: the item ids of the nodes (sorted), their links in
+  CSR form (indptr, indices, weights: the number of statements linking two
+  items, in both directions) and their labels
+- the files are memory-mapped: the workers share them through the page
+  cache, and loading them costs nothing whatever their size
+- "manage.py build_item_graph" adds the entities fetched since the previous
+  build, replacing their links. Each build is written in a new directory,
+  then current.json is switched to it, so that readers never see a partial
+  build and pick the new one on their next query
+
+Queries work on the neighbourhood of an item: the nodes reached in a few hops,
+at most GRAPH_MAX_FRONTIER per hop, the most linked first, so that hubs
+like "human" do not pull the whole graph. Nearby items are ranked by a
+personalized PageRank in this neighbourhood (random walks restarting from
+the item), and shortest paths are found by a breadth-first search from both
+ends.
+
+numpy is needed. Without it, or before the first build, the graph is not
+available and the nearby items are queried from Wikidata (see home/tasks.py).
+'''
+
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from home.wikidata import entity_url, is_entity_id
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+CURRENT_FILE = 'current.json'
+ARRAYS = ('nodes', 'indptr', 'indices', 'weights', 'label_offsets', 'sources', 'targets', 'counts')
+
+## Restart probability of the random walks, and iterations of the PageRank
+RESTART = 0.15
+ITERATIONS = 30
+
+_graph = None
+_graph_lock = threading.Lock()
+
+
+def qid_number(qid):
+    return int(qid[1:])
+
+
+def is_available():
+    return np is not None and os.path.exists(os.path.join(settings.GRAPH_DIR, CURRENT_FILE))
+
+
+## Index
+
+class Graph:
+    '''
+    Nodes are indexes in the sorted array of item numbers. The links of
+    node i are indices[indptr[i]:indptr[i + 1]], with their weights.
+    '''
+
+    def __init__(self, path, meta):
+        self.path = path
+        self.meta = meta
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, name + '.npy'), mmap_mode='r'))
+        labels = os.path.join(path, 'labels.bin')
+        self.labels = np.memmap(labels, dtype=np.uint8, mode='r') if os.path.getsize(labels) else np.zeros(0, np.uint8)
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, 'meta.json')) as meta:
+            return cls(path, json.load(meta))
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def index(self, qid):
+        ''' Node of an item, None if it has no links '''
+        if not is_entity_id(qid) or not qid.startswith('Q'):
+            return None
+        number = qid_number(qid)
+        i = int(np.searchsorted(self.nodes, number))
+        return i if i < len(self.nodes) and self.nodes[i] == number else None
+
+    def qid(self, i):
+        return 'Q%d' % self.nodes[i]
+
+    def label(self, i, default=None):
+        label = self.labels[self.label_offsets[i]:self.label_offsets[i + 1]].tobytes().decode('utf-8')
+        return label or (self.qid(i) if default is None else default)
+
+    def degree(self, i):
+        return int(self.indptr[i + 1] - self.indptr[i])
+
+    def links(self, nodes):
+        ''' (source, target, weight) arrays of all the links of the nodes '''
+        nodes = np.asarray(nodes, dtype=np.int64)
+        starts, ends = self.indptr[nodes], self.indptr[nodes + 1]
+        lengths = ends - starts
+        if not lengths.sum():
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, np.zeros(0, dtype=np.float32)
+        # Positions of the links of all the nodes, without a Python loop
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        return np.repeat(nodes, lengths), self.indices[positions].astype(np.int64), self.weights[positions]
+
+    def expand(self, frontier, seen):
+        '''
+        Nodes linked to the frontier and not seen yet, at most
+        GRAPH_MAX_FRONTIER, the most strongly linked first, with the node
+        they were reached from.
+        '''
+        sources, targets, weights = self.links(frontier)
+        new = ~np.isin(targets, seen)
+        sources, targets, weights = sources[new], targets[new], weights[new]
+        order = np.argsort(-weights, kind='stable')
+        targets, first = np.unique(targets[order], return_index=True)
+        parents = sources[order][first]
+        if len(targets) > settings.GRAPH_MAX_FRONTIER:
+            strongest = np.sort(np.argsort(first, kind='stable')[:settings.GRAPH_MAX_FRONTIER])
+            targets, parents = targets[strongest], parents[strongest]
+        return targets, parents
+
+    def neighbourhood(self, i, hops):
+        ''' Nodes within hops of node i (sorted), with their distance '''
+        nodes, distances = np.array([i]), np.array([0])
+        frontier = nodes
+        for hop in range(1, hops + 1):
+            frontier, parents = self.expand(frontier, nodes)
+            if not len(frontier):
+                break
+            nodes = np.concatenate([nodes, frontier])
+            distances = np.concatenate([distances, np.full(len(frontier), hop)])
+        order = np.argsort(nodes)
+        return nodes[order], distances[order]
+
+    def proximity(self, i, hops):
+        '''
+        Personalized PageRank of the neighbourhood of node i: the share of
+        the time a random walk restarting from i spends on each node.
+        Returns (nodes, distances, scores, (sources, targets, weights)) in
+        local indexes.
+        '''
+        nodes, distances = self.neighbourhood(i, hops)
+        sources, targets, weights = self.links(nodes)
+        inside = np.isin(targets, nodes)
+        sources = np.searchsorted(nodes, sources[inside])
+        targets = np.searchsorted(nodes, targets[inside])
+        weights = weights[inside].astype(np.float64)
+
+        out_weights = np.bincount(sources, weights=weights, minlength=len(nodes))
+        transitions = weights / out_weights[sources]
+        restart = np.zeros(len(nodes))
+        restart[np.searchsorted(nodes, i)] = 1
+        scores = restart.copy()
+        for iteration in range(ITERATIONS):
+            walked = np.bincount(targets, weights=scores[sources] * transitions, minlength=len(nodes))
+            # Walks stuck on nodes without links restart
+            stuck = scores[out_weights == 0].sum()
+            scores = (1 - RESTART) * walked + (RESTART + (1 - RESTART) * stuck) * restart
+        return nodes, distances, scores, (sources, targets, weights)
+
+    def shortest_path(self, i, j, max_length):
+        ''' Nodes of a shortest path from i to j, None if there is none within max_length links '''
+        if i == j:
+            return [i]
+        parents = [{i: None}, {j: None}]
+        frontiers = [np.array([i]), np.array([j])]
+        seen = [np.array([i]), np.array([j])]
+        for length in range(max_length):
+            # Expand the smallest side
+            side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+            targets, sources = self.expand(frontiers[side], seen[side])
+            if not len(targets):
+                return None
+            parents[side].update(zip(targets.tolist(), sources.tolist()))
+            frontiers[side] = targets
+            seen[side] = np.union1d(seen[side], targets)
+            met = np.intersect1d(targets, seen[1 - side])
+            if len(met):
+                middle = int(met[0])
+                path = []
+                node = middle
+                while node is not None:
+                    path.append(node)
+                    node = parents[0][node]
+                path.reverse()
+                node = parents[1][middle]
+                while node is not None:
+                    path.append(node)
+                    node = parents[1][node]
+                return path
+        return None
+
+
+def get_graph():
+    ''' The current build, loaded once per process and reloaded when a new one is switched to '''
+    global _graph
+    if not is_available():
+        return None
+    with open(os.path.join(settings.GRAPH_DIR, CURRENT_FILE)) as current:
+        path = os.path.join(settings.GRAPH_DIR, json.load(current)['build'])
+    with _graph_lock:
+        if _graph is None or _graph.path != path:
+            _graph = Graph.load(path)
+        return _graph
+
+
+## Queries, as JSON for the pages
+
+def node_json(graph, i, **fields):
+    qid = graph.qid(i)
+    return dict({'qid': qid, 'label': graph.label(i), 'url': entity_url(qid)}, **fields)
+
+
+def nearby(qid, hops=2, limit=50):
+    '''
+    The items closest to an item, with the links between them, for a graph
+    visualisation. None if the item is not in the graph.
+    {'item': node, 'nodes': [node, ...], 'links': [[source, target, weight], ...]}
+    with nodes as {'qid', 'label', 'url', 'hops', 'score', 'links'}, and links
+    as indexes in nodes, the item being the first node.
+    '''
+    graph = get_graph()
+    i = graph.index(qid) if graph is not None else None
+    if i is None:
+        return None
+
+    nodes, distances, scores, (sources, targets, weights) = graph.proximity(i, hops)
+    center = int(np.searchsorted(nodes, i))
+    ranked = [int(local) for local in np.argsort(-scores, kind='stable') if local != center][:limit]
+    selected = [center] + ranked
+    positions = {local: position for position, local in enumerate(selected)}
+
+    kept = np.isin(sources, selected) & np.isin(targets, selected) & (sources < targets)
+    links = [
+        [positions[source], positions[target], int(weight)]
+        for source, target, weight in zip(sources[kept].tolist(), targets[kept].tolist(), weights[kept].tolist())
+    ]
+    degrees = np.bincount(np.array([end for link in links for end in link[:2]], dtype=np.int64), minlength=len(selected))
+
+    highest = scores[ranked[0]] if ranked else 1
+    result = [
+        node_json(
+            graph, int(nodes[local]), hops=int(distances[local]),
+            score=round(float(scores[local] / highest), 4), links=int(degrees[position]),
+        )
+        for position, local in enumerate(selected)
+    ]
+    return {'item': result[0], 'nodes': result, 'links': links}
+
+
+def shortest_path(source_qid, target_qid, max_length=None):
+    '''
+    A shortest path between two items, as a list of nodes {'qid', 'label', 'url'}.
+    [] if there is none within max_length links, None if an item is not in the graph.
+    '''
+    graph = get_graph()
+    if graph is None:
+        return None
+    i, j = graph.index(source_qid), graph.index(target_qid)
+    if i is None or j is None:
+        return None
+    path = graph.shortest_path(i, j, max_length or settings.GRAPH_MAX_PATH_LENGTH)
+    return [node_json(graph, node) for node in path or []]
+
+
+## Build
+
+def entity_links(entity_id, data):
+    ''' (target number, count) of the statements of an entity whose value is an item '''
+    counts = {}
+    for claim in data.get('claims', []):
+        for value in claim['values']:
+            if value['type'] == 'entity' and value['id'].startswith('Q') and value['id'] != entity_id:
+                target = qid_number(value['id'])
+                counts[target] = counts.get(target, 0) + 1
+    return counts.items()
+
+
+def read_entities(since=None):
+    '''
+    Links and labels of the entities fetched after since:
+    (entity numbers, source numbers, target numbers, counts, {number: label}, last fetched_at)
+    '''
+    from home.models import WikidataEntity
+
+    entities = WikidataEntity.objects.filter(entity_id__startswith='Q')
+    if since is not None:
+        entities = entities.filter(fetched_at__gt=since)
+
+    numbers, sources, targets, counts, labels = [], [], [], [], {}
+    fetched_until = since
+    for entity_id, label, data, fetched_at in entities.values_list(
+            'entity_id', 'label', 'data', 'fetched_at').iterator(chunk_size=1000):
+        number = qid_number(entity_id)
+        numbers.append(number)
+        labels[number] = label
+        for reference, reference_label in data.get('labels', {}).items():
+            if reference.startswith('Q'):
+                labels.setdefault(qid_number(reference), reference_label)
+        for target, count in entity_links(entity_id, data):
+            sources.append(number)
+            targets.append(target)
+            counts.append(count)
+        fetched_until = max(fetched_until, fetched_at) if fetched_until else fetched_at
+    return (
+        np.array(numbers, dtype=np.int64), np.array(sources, dtype=np.int64), np.array(targets, dtype=np.int64), np.array(counts, dtype=np.int32),
+        labels, fetched_until
+    )
+
+
+def build_csr(sources, targets, counts):
+    ''' Sorted node numbers and the links between them in both directions, as CSR arrays '''
+    nodes = np.unique(np.concatenate([sources, targets]))
+    rows = np.concatenate([np.searchsorted(nodes, sources), np.searchsorted(nodes, targets)])
+    columns = np.concatenate([np.searchsorted(nodes, targets), np.searchsorted(nodes, sources)])
+    weights = np.concatenate([counts, counts]).astype(np.float32)
+
+    # Items linking each other are one link, weighing both statements
+    order = np.lexsort((columns, rows))
+    rows, columns, weights = rows[order], columns[order], weights[order]
+    first = np.ones(len(rows), dtype=bool)
+    first[1:] = (rows[1:] != rows[:-1]) | (columns[1:] != columns[:-1])
+    starts = np.flatnonzero(first)
+    weights = np.add.reduceat(weights, starts) if len(starts) else weights
+    rows, columns = rows[starts], columns[starts]
+
+    indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(nodes)), out=indptr[1:])
+    return nodes, indptr, columns.astype(np.int32), weights
+
+
+def encode_labels(nodes, labels):
+    encoded = [labels.get(int(number), '').encode('utf-8') for number in nodes]
+    offsets = np.zeros(len(nodes) + 1, dtype=np.int64)
+    np.cumsum([len(label) for label in encoded], out=offsets[1:])
+    return offsets, b''.join(encoded)
+
+
+def build(full=False):
+    '''
+    Write a new build of the graph and switch to it. Unless full, the
+    previous build is updated with the entities fetched since.
+    Returns the meta data of the build.
+    '''
+    start = time.time()
+    previous = None if full else get_graph()
+    since = parse_datetime(previous.meta['fetched_until']) if previous and previous.meta['fetched_until'] else None
+    numbers, sources, targets, counts, labels, fetched_until = read_entities(since)
+
+    if previous is not None:
+        # The links of the updated entities replace their previous ones
+        kept = ~np.isin(previous.sources, numbers)
+        sources = np.concatenate([previous.sources[kept], sources])
+        targets = np.concatenate([previous.targets[kept], targets])
+        counts = np.concatenate([previous.counts[kept], counts])
+        # Their labels too, the others keep theirs over the labels read in references
+        updated = set(numbers.tolist())
+        for i, number in enumerate(previous.nodes.tolist()):
+            if number not in updated:
+                label = previous.label(i, default='')
+                if label or number not in labels:
+                    labels[number] = label
+        fetched_until = fetched_until or since
+
+    nodes, indptr, indices, weights = build_csr(sources, targets, counts)
+    label_offsets, label_bytes = encode_labels(nodes, labels)
+
+    name = 'build-%s' % timezone.now().strftime('%Y%m%d%H%M%S%f')
+    path = os.path.join(settings.GRAPH_DIR, name)
+    os.makedirs(path)
+    arrays = {
+        'nodes': nodes, 'indptr': indptr, 'indices': indices, 'weights': weights, 'label_offsets': label_offsets,
+        'sources': sources, 'targets': targets, 'counts': counts,
+    }
+    for array_name, array in arrays.items():
+        np.save(os.path.join(path, array_name + '.npy'), array)
+    with open(os.path.join(path, 'labels.bin'), 'wb') as labels_file:
+        labels_file.write(label_bytes)
+    meta = {
+        'built_at': timezone.now().isoformat(),
+        'fetched_until': fetched_until.isoformat() if fetched_until else None,
+        'nodes': len(nodes),
+        'links': int(len(indices) // 2),
+        'seconds': round(time.time() - start, 1),
+    }
+    with open(os.path.join(path, 'meta.json'), 'w') as meta_file:
+        json.dump(meta, meta_file)
+
+    # Switch the readers to the new build, then remove the older ones: the
+    # processes still reading them keep their files until they reload
+    current = os.path.join(settings.GRAPH_DIR, CURRENT_FILE)
+    with open(current + '.tmp', 'w') as current_file:
+        json.dump({'build': name}, current_file)
+    os.replace(current + '.tmp', current)
+    for other in os.listdir(settings.GRAPH_DIR):
+        if other.startswith('build-') and other != name:
+            shutil.rmtree(os.path.join(settings.GRAPH_DIR, other), ignore_errors=True)
+    return meta
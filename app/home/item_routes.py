@@ -0,0 +1,94 @@
+'''
+Pages about an item, for the ItemPages rendering any item.
+
+/item?qid=Q123 renders Q123 with the default ItemPage, merged with the
+ItemPage whose item_Qid is Q123 if there is one: its notes and its featured
+Pids. Without featured Pids of its own, an item shows the ones of the
+WikidataClass page of one of its classes (P31), else its first statements.
+
+Both lookups use indexes (the unique item_Qid, class_Qid) and their results
+are kept by each process in a LRU of ROUTES_IN_MEMORY entries. Saving or
+deleting an ItemPage or a WikidataClass bumps a generation stored in the
+cache, which empties the LRUs of every process on their next lookup: a
+request costs one cache read instead of two queries.
+'''
+
+import threading
+from collections import OrderedDict
+
+from django.core.cache import cache
+
+ROUTES_IN_MEMORY = 10000
+
+GENERATION_KEY = 'item-routes-generation'
+
+_item_pages = OrderedDict()
+_class_pids = OrderedDict()
+_generation = None
+_lock = threading.Lock()
+
+
+def invalidate():
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, 1, None)
+
+
+def _check_generation():
+    global _generation
+    generation = cache.get(GENERATION_KEY, 0)
+    with _lock:
+        if generation != _generation:
+            _item_pages.clear()
+            _class_pids.clear()
+            _generation = generation
+
+
+def _lookup(lru, key, load):
+    with _lock:
+        if key in lru:
+            lru.move_to_end(key)
+            return lru[key]
+    value = load(key)
+    with _lock:
+        lru[key] = value
+        while len(lru) > ROUTES_IN_MEMORY:
+            lru.popitem(last=False)
+    return value
+
+
+def load_item_page_id(qid):
+    from home.models import ItemPage
+
+    return ItemPage.objects.live().filter(item_Qid=qid).values_list('pk', flat=True).first()
+
+
+def load_class_pids(class_qid):
+    from home.models import WikidataClass
+
+    pids = WikidataClass.objects.live().filter(class_Qid=class_qid).order_by('path').values_list(
+        'featured_Pids', flat=True
+    ).first()
+    return tuple(pid for pid in pids or () if pid)
+
+
+def get_item_page(qid):
+    ''' The live ItemPage about an item, None if there is none '''
+    from home.models import ItemPage
+
+    _check_generation()
+    page_id = _lookup(_item_pages, qid, load_item_page_id)
+    if page_id is None:
+        return None
+    return ItemPage.objects.live().filter(pk=page_id).first()
+
+
+def get_class_pids(class_qids):
+    ''' Featured Pids of the first of these classes having a live WikidataClass page '''
+    _check_generation()
+    for class_qid in class_qids:
+        pids = _lookup(_class_pids, class_qid, load_class_pids)
+        if pids:
+            return list(pids)
+    return []
@@ -0,0 +1,221 @@
+'''
+Paginated listings of pages, e.g. the articles of a HomePage.
+
+Iterating over page.get_children.specific in a template and resolving
+post.feed_image with a rendition costs several queries per card.
+get_listing returns a page of specific pages where:
+- feed_image is already loaded, for all the pages in one query
+- feed_rendition is the rendition used by the cards, also loaded in one query
+- feed_srcset adds its 2x rendition for high density screens, when it was
+  generated already (see home/renditions.py)
+So a listing takes a constant number of queries, whatever its length.
+
+get_cursor_listing does the same with cursor based pagination: the next page
+starts after the last page shown, instead of counting and skipping rows.
+'''
+
+import re
+
+from django.core.paginator import Paginator
+from django.db.models import F, Q
+from django.utils.dateparse import parse_datetime
+
+from wagtail.core.models import Page
+from wagtail.images import get_image_model
+from wagtail.images.models import Filter
+
+PER_PAGE = 12
+
+FEED_RENDITION = 'fill-400x324'
+
+SIZED_SPEC = re.compile(r'^(fill|max|min|width|height)-(\d+)(?:x(\d+))?(.*)$')
+
+
+def scaled_spec(spec, factor):
+    ''' The filter spec of a rendition factor times larger: fill-400x324 -> fill-800x648 '''
+    match = SIZED_SPEC.match(spec)
+    if match is None:
+        return spec
+    method, width, height, options = match.groups()
+    size = str(int(width) * factor)
+    if height:
+        size += 'x%d' % (int(height) * factor)
+    return '%s-%s%s' % (method, size, options)
+
+
+def get_renditions(images, spec, generate=True):
+    '''
+    Renditions of the given images for a filter spec, as a dict by image id.
+    Existing renditions are loaded in one query, missing ones are generated,
+    or left out with generate=False.
+    '''
+    if not images:
+        return {}
+
+    image_filter = Filter(spec=spec)
+    Rendition = get_image_model().get_rendition_model()
+    existing = {
+        (rendition.image_id, rendition.focal_point_key): rendition
+        for rendition in Rendition.objects.filter(image__in=images, filter_spec=spec)
+    }
+
+    renditions = {}
+    for image in images:
+        rendition = existing.get((image.pk, image_filter.get_cache_key(image)))
+        if rendition is None:
+            if not generate:
+                continue
+            rendition = image.get_rendition(image_filter)
+        rendition.image = image
+        renditions[image.pk] = rendition
+    return renditions
+
+
+def get_srcset(rendition, rendition_2x):
+    if rendition is None:
+        return ''
+    srcset = '%s 1x' % rendition.url
+    # Small originals give a 2x rendition no larger than the 1x one
+    if rendition_2x is not None and rendition_2x.width > rendition.width:
+        srcset += ', %s 2x' % rendition_2x.url
+    return srcset
+
+
+def attach_feed_images(pages, spec=FEED_RENDITION):
+    '''
+    Load feed_image of the pages in bulk and add feed_rendition and
+    feed_srcset attributes.
+    Pages without a feed_image field or value get feed_rendition = None.
+    Missing 2x renditions are left out of the srcset, they are generated by
+    the jobs queued when the image is saved or by warm_renditions.
+    '''
+    image_ids = {getattr(page, 'feed_image_id', None) for page in pages} - {None}
+    images = get_image_model().objects.in_bulk(image_ids)
+    renditions = get_renditions(list(images.values()), spec)
+    renditions_2x = get_renditions(list(images.values()), scaled_spec(spec, 2), generate=False)
+
+    for page in pages:
+        image_id = getattr(page, 'feed_image_id', None)
+        if image_id in images:
+            page.feed_image = images[image_id]
+        page.feed_rendition = renditions.get(image_id)
+        page.feed_srcset = get_srcset(page.feed_rendition, renditions_2x.get(image_id))
+    return pages
+
+
+def attach_categories(articlepages):
+    '''
+    Load the categories of articles in one query, as a category_list attribute.
+    ParentalManyToManyField does not support prefetch_related.
+    '''
+    from home.models import ArticlePage
+
+    Through = ArticlePage.categories.through
+    categories = {}
+    links = Through.objects.filter(
+        articlepage_id__in=[page.pk for page in articlepages]
+    ).select_related('articlecategory').order_by('articlecategory__title')
+    for link in links:
+        categories.setdefault(link.articlepage_id, []).append(link.articlecategory)
+
+    for page in articlepages:
+        page.category_list = categories.get(page.pk, [])
+    return articlepages
+
+
+def get_listing(pages, request, per_page=PER_PAGE, spec=FEED_RENDITION):
+    '''
+    Paginate a queryset of pages with the "page" query string.
+    The object list of the returned page holds specific pages with their
+    feed image and rendition.
+    '''
+    paginator = Paginator(pages, per_page)
+    listing = paginator.get_page(request.GET.get('page'))
+
+    object_list = listing.object_list
+    if object_list.model is Page:
+        object_list = object_list.specific()
+    listing.object_list = attach_feed_images(list(object_list), spec)
+    return listing
+
+
+## Cursor based pagination
+
+class CursorListing:
+    '''
+    A page of results ordered by -first_published_at, -pk, the pages never
+    published last (pages added by code or imported have no first_published_at).
+    The cursor of the next page is "<first_published_at>|<pk>" of the last
+    result, "|<pk>" if it was never published.
+    '''
+
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def encode_cursor(page):
+    published_at = page.first_published_at.isoformat() if page.first_published_at else ''
+    return '%s|%d' % (published_at, page.pk)
+
+
+def decode_cursor(cursor):
+    '''
+    Returns (first_published_at, pk), first_published_at being None after a
+    page never published, or None if the cursor is not valid
+    '''
+    try:
+        published_at, pk = cursor.rsplit('|', 1)
+        pk = int(pk)
+        if published_at:
+            published_at = parse_datetime(published_at)
+            if published_at is None:
+                return None
+        else:
+            published_at = None
+    except (AttributeError, ValueError):
+        return None
+    return published_at, pk
+
+
+def get_cursor_listing(pages, request, per_page=PER_PAGE, spec=FEED_RENDITION):
+    '''
+    Paginate a queryset of live pages with the "after" query string.
+    '''
+    # Postgres puts NULLs first in descending order
+    pages = pages.order_by(F('first_published_at').desc(nulls_last=True), '-pk')
+
+    cursor = decode_cursor(request.GET.get('after'))
+    if cursor is not None:
+        published_at, pk = cursor
+        if published_at is None:
+            pages = pages.filter(first_published_at__isnull=True, pk__lt=pk)
+        else:
+            pages = pages.filter(
+                Q(first_published_at__lt=published_at)
+                | Q(first_published_at=published_at, pk__lt=pk)
+                | Q(first_published_at__isnull=True)
+            )
+
+    # One more page is fetched to know if there is a next page
+    object_list = pages[:per_page + 1]
+    if object_list.model is Page:
+        object_list = object_list.specific()
+    object_list = list(object_list)
+
+    next_cursor = None
+    if len(object_list) > per_page:
+        object_list = object_list[:per_page]
+        next_cursor = encode_cursor(object_list[-1])
+
+    return CursorListing(attach_feed_images(object_list, spec), next_cursor)
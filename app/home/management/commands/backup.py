@@ -0,0 +1,38 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from project import backup
+
+
+class Command(BaseCommand):
+    help = 'Back up the database as compressed NDJSON files and rotate the backups (see config/dj_backup.config).'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--kind', action='store', dest='kind', choices=[backup.DAILY, backup.WEEKLY, backup.MONTHLY],
+            help="Kind of backup to take, by default the one planned today")
+        parser.add_argument(
+            '--config', action='store', dest='config', default=None,
+            help="Path of the backup config file")
+        parser.add_argument(
+            '--workers', action='store', dest='workers', type=int, default=None,
+            help="Number of compression processes, one per CPU by default")
+
+    def handle(self, **options):
+        try:
+            config = backup.read_config(options['config'])
+        except OSError as e:
+            raise CommandError('Could not read the backup config: %s' % e)
+
+        today = date.today()
+        kind = options['kind'] or backup.backup_kind(config, today)
+        if kind is None:
+            self.stdout.write('No backup planned today')
+            return
+
+        start = time.time()
+        path = backup.backup(config['BACKUP_DIR'], kind, today, options['workers'], log=self.stdout.write)
+        backup.rotate(config['BACKUP_DIR'], config, today, log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS('Backup %s done in %.1fs' % (path, time.time() - start)))
@@ -0,0 +1,81 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from home import benchmark
+
+
+class Command(BaseCommand):
+    help = 'Seed a synthetic tree and replay a mix of requests in process, reporting latency, SQL queries and memory as JSON.'
+
+    def add_arguments(self, parser):
+        for name, default in benchmark.DEFAULT_SIZES.items():
+            parser.add_argument(
+                '--%s' % name.replace('_', '-'), action='store', dest=name, type=int, default=default,
+                help="Number of %s of the tree (default %d)" % (name.replace('_', ' '), default))
+        parser.add_argument(
+            '--reuse', action='store_true', dest='reuse',
+            help="Benchmark the tree of a previous run instead of seeding it again")
+        parser.add_argument(
+            '--delete', action='store_true', dest='delete',
+            help="Delete the benchmark tree and exit")
+        parser.add_argument(
+            '--seed', action='store', dest='seed', type=int, default=0,
+            help="Random seed of the tree and of the requests")
+        parser.add_argument(
+            '--requests', action='store', dest='requests', type=int, default=1000,
+            help="Number of measured requests")
+        parser.add_argument(
+            '--warmup', action='store', dest='warmup', type=int, default=200,
+            help="Number of requests run before measuring")
+        parser.add_argument(
+            '--cold', action='store_true', dest='cold',
+            help="Clear the cache before each request (the whole cache: use a development Redis)")
+        parser.add_argument(
+            '--output', action='store', dest='output', default=None,
+            help="File to write the JSON report to")
+        parser.add_argument(
+            '--baseline', action='store', dest='baseline', default=None,
+            help="JSON report to compare with, the command fails on regressions")
+        parser.add_argument(
+            '--tolerance', action='store', dest='tolerance', type=float, default=0.2,
+            help="Relative slowdown allowed before a regression is reported (default 0.2)")
+
+    def handle(self, **options):
+        if options['delete']:
+            benchmark.delete_tree()
+            self.stdout.write(self.style.SUCCESS('Deleted the benchmark tree'))
+            return
+
+        sizes = {name: options[name] for name in benchmark.DEFAULT_SIZES}
+        start = time.time()
+        root = benchmark.get_root() if options['reuse'] else None
+        if root is None:
+            root = benchmark.seed_tree(sizes, options['seed'])
+            self.stdout.write('Seeded %s in %.1fs' % (
+                ', '.join('%d %s' % (count, name) for name, count in sizes.items()), time.time() - start
+            ))
+        benchmark.prime_caches()
+
+        requests = benchmark.draw_requests(
+            benchmark.get_paths(root), benchmark.DEFAULT_MIX, options['warmup'] + options['requests'], options['seed']
+        )
+        report = benchmark.run(requests, options['warmup'], options['cold'])
+        report['sizes'] = sizes
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as report_file:
+                report_file.write(output + '\n')
+        self.stdout.write(output)
+
+        if options['baseline']:
+            with open(options['baseline']) as baseline_file:
+                baseline = json.load(baseline_file)
+            if baseline.get('sizes') != sizes or baseline.get('cold') != report['cold']:
+                raise CommandError('The baseline was run with other sizes or cache mode, it cannot be compared')
+            regressions = benchmark.compare(report, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError('Regressions from %s:\n%s' % (options['baseline'], '\n'.join(regressions)))
+            self.stdout.write(self.style.SUCCESS('No regression from %s' % options['baseline']))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from home import graph
+
+
+class Command(BaseCommand):
+    help = 'Add the entities fetched since the last build to the graph of the items (nearby items, paths).'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true', dest='full',
+            help="Build the graph from all the stored entities")
+
+    def handle(self, **options):
+        if graph.np is None:
+            raise CommandError('numpy is not installed')
+        meta = graph.build(full=options['full'])
+        self.stdout.write(self.style.SUCCESS('Built the graph of %(nodes)d items and %(links)d links in %(seconds)ss' % meta))
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from home.materialize import build_table, stale_tables
+from home.models import WikidataClass
+
+
+class Command(BaseCommand):
+    help = 'Build the tables of the WikidataClass pages, by chunks of SPARQL results.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--stale', action='store_true', dest='stale',
+            help="Only build the tables older than WIKIDATA_CLASS_TTL, or never built")
+        parser.add_argument(
+            'class_qids', nargs='*',
+            help="Only build the tables of these class Qids")
+
+    def handle(self, **options):
+        pages = stale_tables() if options['stale'] else WikidataClass.objects.live()
+        if options['class_qids']:
+            pages = pages.filter(class_Qid__in=options['class_qids'])
+
+        for page in pages.order_by('pk'):
+            start = time.time()
+            table = build_table(page)
+            elapsed = time.time() - start
+            if table.status == table.READY:
+                self.stdout.write(self.style.SUCCESS('%s: %d rows in %.1fs' % (page.class_Qid, table.row_count, elapsed)))
+            else:
+                self.stdout.write(self.style.ERROR('%s: %s' % (page.class_Qid, table.error)))
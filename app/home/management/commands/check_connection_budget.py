@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from project import db
+
+
+class Command(BaseCommand):
+    help = 'Check that the uWSGI workers and the other processes can not open more database connections than allowed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--uwsgi-ini', action='store', dest='uwsgi_ini', default=None,
+            help="Path of the uWSGI config, config/django-uwsgi.ini by default")
+
+    def handle(self, **options):
+        budget = db.get_connection_budget(options['uwsgi_ini'])
+        self.stdout.write('%(processes)d processes x %(threads)d threads: up to %(total)d connections' % budget)
+
+        if connection.vendor != 'postgresql':
+            self.stdout.write('Not using Postgres, nothing to check')
+            return
+
+        if settings.DATABASE_POOL == 'pgbouncer':
+            # pgbouncer opens at most its pool size on Postgres, whatever the number of clients
+            if budget['total'] > settings.PGBOUNCER_MAX_CLIENT_CONN:
+                raise CommandError('%d connections needed, pgbouncer accepts %d clients (PGBOUNCER_MAX_CLIENT_CONN)' % (
+                    budget['total'], settings.PGBOUNCER_MAX_CLIENT_CONN
+                ))
+            needed = settings.PGBOUNCER_POOL_SIZE
+        else:
+            needed = budget['total']
+
+        max_connections = db.get_max_connections(connection)
+        if needed > max_connections:
+            raise CommandError(
+                '%d connections needed, Postgres accepts %d (max_connections - superuser_reserved_connections)' % (
+                    needed, max_connections
+                ))
+        self.stdout.write(self.style.SUCCESS('%d of the %d connections of Postgres used' % (needed, max_connections)))
@@ -0,0 +1,56 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import reset_queries
+from django.utils import timezone
+
+from project import export
+
+
+class Command(BaseCommand):
+    help = 'Export the live pages as NDJSON, one page per line, like /api/export/.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--type', action='store', dest='type', default=None,
+            help="Comma separated page types, by default %s" % export.DEFAULT_TYPES)
+        parser.add_argument(
+            '--since', action='store', dest='since', default=None,
+            help="Only the pages published since this ISO 8601 timestamp, after the ones removed since then")
+        parser.add_argument(
+            '--after', action='store', dest='after', default=None,
+            help="Path of the last exported page, to resume an export")
+        parser.add_argument(
+            '--output', action='store', dest='output', default=None,
+            help="File to write, the standard output by default")
+        parser.add_argument(
+            '--batch-size', action='store', dest='batch_size', type=int, default=export.BATCH_SIZE,
+            help="Number of pages loaded per batch")
+
+    def handle(self, **options):
+        started_at = timezone.now()
+        try:
+            page_models, since = export.parse_export_parameters(options['type'], options['since'])
+        except ValueError as e:
+            raise CommandError(e)
+
+        pages = export.get_pages(page_models, since, options['after'])
+        removed_pages = export.get_removed_pages(page_models, since) if since is not None and not options['after'] else None
+        output = open(options['output'], 'w', encoding='utf-8') if options['output'] else sys.stdout
+        start = time.time()
+        count = 0
+        try:
+            for line in export.export_lines(pages, options['batch_size'], removed_pages):
+                output.write(line)
+                count += 1
+                if count % options['batch_size'] == 0:
+                    # Query logging would keep every batch in memory with DEBUG = True
+                    reset_queries()
+        finally:
+            if output is not sys.stdout:
+                output.close()
+
+        self.stderr.write('Exported %d pages in %.1fs, next sync: --since %s' % (
+            count, time.time() - start, started_at.isoformat()
+        ))
@@ -0,0 +1,212 @@
+import json
+import os
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import reset_queries, transaction
+from django.db.models import F
+from django.utils.text import slugify
+
+from wagtail.core.models import Page
+
+from home import page_cache, sparql
+from home.models import ItemPage
+from home.wikidata import get_text, is_item_id
+from search.indexing import enqueue_update
+
+DEFAULT_CHUNK_SIZE = 500
+
+
+## Sources, yielding (qid, label)
+
+def read_dump(path):
+    '''
+    Items of a JSON file, one object per line: a Wikidata JSON dump
+    ("[", one entity per line followed by a comma, "]") or newline delimited
+    JSON. Objects are entities or {"qid": .., "label": ..}.
+    The file is streamed, it is never loaded at once.
+    '''
+    with open(path, encoding='utf-8') as dump:
+        for line in dump:
+            line = line.strip().rstrip(',')
+            if line in ('', '[', ']'):
+                continue
+            item = json.loads(line)
+            if 'id' in item:
+                yield item['id'], get_text(item.get('labels'), item['id'])
+            else:
+                yield item['qid'], item.get('label') or item['qid']
+
+
+def read_sparql(query):
+    '''
+    Items of a SPARQL result: the first column is the item, an "itemLabel"
+    column gives the labels. The query needs an ORDER BY to be resumed.
+    '''
+    result = sparql.fetch(query, timeout=settings.WIKIDATA_JOB_TIMEOUT)
+    columns = result['columns']
+    label_index = columns.index('itemLabel') if 'itemLabel' in columns else None
+    for row in result['rows']:
+        qid = row[0].rsplit('/', 1)[-1]
+        yield qid, row[label_index] if label_index is not None else qid
+
+
+## Checkpoints, to resume an interrupted import
+
+def read_checkpoint(path):
+    if path and os.path.exists(path):
+        with open(path) as checkpoint:
+            return json.load(checkpoint)
+    return {'position': 0, 'created': 0, 'updated': 0}
+
+
+def write_checkpoint(path, checkpoint):
+    if not path:
+        return
+    with open(path + '.tmp', 'w') as temporary:
+        json.dump(checkpoint, temporary)
+    os.replace(path + '.tmp', path)
+
+
+## Bulk insert of pages
+
+def insert_pages(pages):
+    '''
+    Insert new pages of a Page subclass, path and parent counters included,
+    with one query per table. bulk_create does not handle multi-table
+    inheritance: the Page rows are created first, then the rows of the
+    subclass with their ids.
+    '''
+    if not pages:
+        return
+    model = type(pages[0])
+    Page.objects.bulk_create([
+        Page(**{field.attname: getattr(page, field.attname) for field in Page._meta.concrete_fields})
+        for page in pages
+    ])
+    # Postgres returns the ids of the inserted rows, the other databases do not
+    ids = dict(Page.objects.filter(path__in=[page.path for page in pages]).values_list('path', 'pk'))
+    for page in pages:
+        page.pk = page.page_ptr_id = page.id = ids[page.path]
+    model._base_manager.get_queryset()._batched_insert(pages, model._meta.local_concrete_fields, None)
+
+
+class Command(BaseCommand):
+    help = 'Create or update ItemPages under a parent page from a JSON dump or a SPARQL query, in chunks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'parent_id', type=int,
+            help="Id of the parent page of the ItemPages")
+        source = parser.add_mutually_exclusive_group(required=True)
+        source.add_argument(
+            '--file', action='store', dest='file',
+            help="Wikidata JSON dump, or newline delimited JSON")
+        source.add_argument(
+            '--sparql', action='store', dest='sparql',
+            help="File with a SPARQL query selecting ?item and ?itemLabel")
+        parser.add_argument(
+            '--chunk-size', action='store', dest='chunk_size', type=int, default=DEFAULT_CHUNK_SIZE,
+            help="Number of items saved per transaction")
+        parser.add_argument(
+            '--checkpoint', action='store', dest='checkpoint', default=None,
+            help="File recording the progress, the import resumes from it when it exists")
+
+    def handle(self, **options):
+        try:
+            parent = Page.objects.get(pk=options['parent_id'])
+        except Page.DoesNotExist:
+            raise CommandError('Page %s does not exist' % options['parent_id'])
+
+        if options['file']:
+            items = read_dump(options['file'])
+        else:
+            with open(options['sparql'], encoding='utf-8') as query:
+                items = read_sparql(query.read())
+
+        checkpoint = read_checkpoint(options['checkpoint'])
+        if checkpoint['position']:
+            self.stdout.write('Resuming after %d items' % checkpoint['position'])
+        items = islice(items, checkpoint['position'], None)
+
+        start = time.time()
+        count = 0
+        while True:
+            chunk = list(islice(items, options['chunk_size']))
+            if not chunk:
+                break
+            items_chunk = [(qid.strip().upper(), label) for qid, label in chunk]
+            created, updated = self.import_chunk(parent, [(qid, label) for qid, label in items_chunk if is_item_id(qid)])
+            # Query logging would keep every chunk in memory with DEBUG = True
+            reset_queries()
+
+            count += len(chunk)
+            checkpoint['position'] += len(chunk)
+            checkpoint['created'] += created
+            checkpoint['updated'] += updated
+            write_checkpoint(options['checkpoint'], checkpoint)
+
+            elapsed = time.time() - start
+            self.stdout.write('%d items (%d created, %d updated), %.0f items/s' % (
+                checkpoint['position'], checkpoint['created'], checkpoint['updated'], count / elapsed if elapsed else 0
+            ))
+
+        page_cache.invalidate(parent)
+        self.stdout.write(self.style.SUCCESS('Imported %d items in %.1fs' % (count, time.time() - start)))
+
+    @transaction.atomic
+    def import_chunk(self, parent, chunk):
+        '''
+        Create or update the ItemPages of a chunk, returns (created, updated).
+        An item has one ItemPage in the whole tree (item_Qid is unique): the
+        items having a page under another parent get that page updated.
+        Paths of the new pages follow the last child of the parent, instead
+        of looking it up for each page as add_child does, and their rows are
+        inserted in bulk: a few queries per chunk, whatever its size.
+        '''
+        # Lock the parent, so that concurrent imports do not allocate the same paths
+        parent = Page.objects.select_for_update().get(pk=parent.pk)
+        labels = dict(chunk)
+
+        existing = {page.item_Qid: page for page in ItemPage.objects.filter(item_Qid__in=labels)}
+        updated = []
+        for qid, page in existing.items():
+            title = labels[qid][:255]
+            if page.title != title:
+                page.title = page.draft_title = title
+                updated.append(page)
+        Page.objects.bulk_update(updated, ['title', 'draft_title'])
+
+        last_child = parent.get_last_child()
+        position = last_child._get_lastpos_in_path() if last_child else 0
+        depth = parent.depth + 1
+
+        content_type = ContentType.objects.get_for_model(ItemPage)
+
+        created = []
+        for qid, label in labels.items():
+            if qid in existing:
+                continue
+            position += 1
+            slug = slugify('%s %s' % (label[:200], qid))
+            created.append(ItemPage(
+                title=label[:255],
+                draft_title=label[:255],
+                slug=slug,
+                url_path=parent.url_path + slug + '/',
+                content_type=content_type,
+                item_Qid=qid,
+                path=Page._get_path(parent.path, depth, position),
+                depth=depth,
+                numchild=0,
+            ))
+        insert_pages(created)
+
+        Page.objects.filter(pk=parent.pk).update(numchild=F('numchild') + len(created))
+
+        # Index the pages once they are committed
+        transaction.on_commit(lambda: [enqueue_update(page) for page in created + updated])
+        return len(created), len(updated)
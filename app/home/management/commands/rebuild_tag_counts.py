@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from home.tags import rebuild_tag_counts
+
+
+class Command(BaseCommand):
+    help = 'Count the live articles of every tag again, for the tag cloud.'
+
+    def handle(self, **options):
+        rebuild_tag_counts()
+        self.stdout.write(self.style.SUCCESS('Tag counts rebuilt'))
@@ -0,0 +1,31 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from project import backup
+
+
+class Command(BaseCommand):
+    help = 'Replace the content of the database, or of some apps and models, with a backup made by the backup command.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            help="Backup directory, e.g. /srv/app-backups/2019-06-01-monthly")
+        parser.add_argument(
+            '--only', action='append', dest='only', default=[],
+            help="Only restore this app_label or app_label.model_name, can be repeated")
+        parser.add_argument(
+            '--exclude', action='append', dest='exclude', default=[],
+            help="Do not restore this app_label or app_label.model_name, can be repeated")
+        parser.add_argument(
+            '--safe', action='store_true', dest='safe',
+            help="Leave out the permissions and content types, which migrate creates")
+
+    def handle(self, **options):
+        if not os.path.exists(os.path.join(options['path'], backup.MANIFEST)):
+            raise CommandError('%s is not a complete backup' % options['path'])
+
+        exclude = options['exclude'] + (backup.SAFE_EXCLUDE if options['safe'] else [])
+        restored = backup.restore(options['path'], options['only'], exclude, log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS('Restored %d tables' % len(restored)))
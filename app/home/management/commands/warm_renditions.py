@@ -0,0 +1,39 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from home import renditions
+
+
+class Command(BaseCommand):
+    help = 'Generate the missing renditions of the images used by pages, with a pool of processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', action='store', dest='workers', type=int, default=None,
+            help="Number of processes, one per CPU by default")
+
+    def handle(self, **options):
+        start = time.time()
+        image_specs = renditions.get_image_specs()
+        self.stdout.write('%d images used by pages' % len(image_specs))
+
+        # The processes open their own connections, they must not share this one
+        connections.close_all()
+
+        image_ids = sorted(image_specs)
+        generated = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            results = pool.map(
+                renditions.warm, image_ids, [image_specs[image_id] for image_id in image_ids], chunksize=20
+            )
+            for count, image_id in enumerate(image_ids, 1):
+                generated += next(results)
+                if count % 100 == 0:
+                    self.stdout.write('%d images, %d renditions generated' % (count, generated))
+
+        self.stdout.write(self.style.SUCCESS('Generated %d renditions of %d images in %.1fs' % (
+            generated, len(image_ids), time.time() - start
+        )))
@@ -0,0 +1,238 @@
+'''
+Materialized tables of WikidataClass pages.
+
+A WikidataClass page renders its items as rows and its featured Pids as
+columns. Running this as one live SPARQL query for a large class would take
+longer than uWSGI's harakiri, so the table is built beforehand:
+- the items of the class are queried in chunks of WIKIDATA_CLASS_CHUNK_SIZE
+- the result is stored column by column in WikidataClassTable
+- it is rebuilt when the page is published, and by the
+  build_wikidata_class_tables command for tables older than WIKIDATA_CLASS_TTL
+
+The page then sorts, filters and paginates the stored columns. Decoded
+tables and their sort orders are kept in memory by each worker.
+'''
+
+import logging
+import math
+from collections import OrderedDict
+from datetime import timedelta
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.utils import timezone
+
+from home import sparql, wikidata
+from project import db
+
+logger = logging.getLogger(__name__)
+
+ITEM = 'item'
+LABEL = 'label'
+
+
+## Build
+
+def table_pids(page):
+    return [pid for pid in page.featured_Pids if wikidata.is_entity_id(pid)]
+
+
+def chunk_query(class_qid, pids, limit, offset):
+    '''
+    Items of a class with the labels of their values for the given Pids.
+    The subquery pages over the items, so each chunk has all rows of its items.
+    '''
+    variables = ' '.join('?%sLabel' % pid for pid in pids)
+    optionals = '\n'.join('  OPTIONAL { ?item wdt:%s ?%s . }' % (pid, pid) for pid in pids)
+    return '''SELECT ?item ?itemLabel %(variables)s WHERE {
+  { SELECT ?item WHERE { ?item wdt:P31 wd:%(class_qid)s . } ORDER BY ?item LIMIT %(limit)d OFFSET %(offset)d }
+%(optionals)s
+  SERVICE wikibase:label { bd:serviceParam wikibase:language "%(language)s". }
+}''' % {
+        'variables': variables,
+        'optionals': optionals,
+        'class_qid': class_qid,
+        'limit': limit,
+        'offset': offset,
+        'language': settings.WIKIDATA_LANGUAGE,
+    }
+
+
+def fetch_chunk(class_qid, pids, limit, offset):
+    '''
+    One chunk of rows as an ordered dict by item Qid: {qid: [label, values...]}.
+    Items with several values for a Pid get them joined with ", ".
+    '''
+    result = sparql.fetch(chunk_query(class_qid, pids, limit, offset), timeout=settings.WIKIDATA_CLASS_TIMEOUT)
+    index = {column: i for i, column in enumerate(result['columns'])}
+
+    items = OrderedDict()
+    for row in result['rows']:
+        qid = row[index['item']].rsplit('/', 1)[-1]
+        if qid not in items:
+            items[qid] = [row[index['itemLabel']]] + [[] for pid in pids]
+        for i, pid in enumerate(pids, start=1):
+            value = row[index['%sLabel' % pid]]
+            if value and value not in items[qid][i]:
+                items[qid][i].append(value)
+
+    for values in items.values():
+        values[1:] = [', '.join(value) for value in values[1:]]
+    return items
+
+
+def build_table(page):
+    ''' Build the table of a WikidataClass page, chunk by chunk '''
+    from home.models import WikidataClassTable
+
+    table, created = WikidataClassTable.objects.get_or_create(page=page)
+    table.status = WikidataClassTable.BUILDING
+    table.save(update_fields=['status'])
+
+    pids = table_pids(page)
+    chunk_size = settings.WIKIDATA_CLASS_CHUNK_SIZE
+    data = OrderedDict((column, []) for column in [ITEM, LABEL] + pids)
+
+    try:
+        offset = 0
+        while offset < settings.WIKIDATA_CLASS_MAX_ROWS:
+            items = fetch_chunk(page.class_Qid, pids, chunk_size, offset)
+            for qid, values in items.items():
+                data[ITEM].append(qid)
+                for column, value in zip(list(data)[1:], values):
+                    data[column].append(value)
+            logger.info('%s: %d items', page.class_Qid, len(data[ITEM]))
+            if len(items) < chunk_size:
+                break
+            offset += chunk_size
+        labels = wikidata.get_labels(pids) if pids else {}
+    except (sparql.SparqlError, wikidata.WikidataError) as e:
+        logger.warning('Build of the %s table failed: %s', page.class_Qid, e)
+        table.status = WikidataClassTable.FAILED
+        table.error = str(e)
+        table.save(update_fields=['status', 'error'])
+        return table
+
+    table.class_Qid = page.class_Qid
+    table.columns = list(data)
+    table.column_labels = ['Item', 'Label'] + [labels.get(pid, pid) for pid in pids]
+    table.data = data
+    table.row_count = len(data[ITEM])
+    table.status = WikidataClassTable.READY
+    table.error = ''
+    table.built_at = timezone.now()
+    table.save()
+    return table
+
+
+def build_in_background(page):
+    ''' Build a table in a thread of the current worker, once at a time per page '''
+    lock_key = 'wdclass-build:%d' % page.pk
+    if not cache.add(lock_key, 1, 60 * 60):
+        return
+
+    def build():
+        try:
+            build_table(page)
+        except Exception:
+            logger.exception('Build of the %s table failed', page.class_Qid)
+        finally:
+            cache.delete(lock_key)
+
+    db.run_in_background(build)
+
+
+def stale_tables():
+    from home.models import WikidataClass
+
+    limit = timezone.now() - timedelta(seconds=settings.WIKIDATA_CLASS_TTL)
+    return WikidataClass.objects.live().exclude(table__built_at__gte=limit)
+
+
+## Query
+
+class LoadedTable:
+    ''' Decoded columns of a table, with the sort orders computed so far '''
+
+    def __init__(self, columns, data):
+        self.columns = columns
+        self.data = data
+        self.row_count = len(data[ITEM]) if data else 0
+        self._orders = {}
+
+    def order(self, column):
+        ''' Row indexes sorted by a column, numbers before text '''
+        if column not in self._orders:
+            values = self.data[column]
+
+            def key(i):
+                try:
+                    number = float(values[i])
+                except ValueError:
+                    number = None
+                # nan has no order and would shuffle the pages: nan and inf sort as text
+                if number is not None and math.isfinite(number):
+                    return (0, number, '')
+                return (1, 0, values[i].lower())
+
+            self._orders[column] = sorted(range(self.row_count), key=key)
+        return self._orders[column]
+
+    def query(self, search='', sort=LABEL, descending=False):
+        ''' Row indexes matching the search, in the sort order '''
+        indexes = self.order(sort if sort in self.data else LABEL)
+        if descending:
+            indexes = indexes[::-1]
+        search = search.strip().lower()
+        if search:
+            columns = [self.data[column] for column in self.columns]
+            indexes = [i for i in indexes if any(search in values[i].lower() for values in columns)]
+        return indexes
+
+    def rows(self, indexes):
+        return [[self.data[column][i] for column in self.columns] for i in indexes]
+
+
+@lru_cache(maxsize=8)
+def _load(table_pk, built_at):
+    from home.models import WikidataClassTable
+
+    table = WikidataClassTable.objects.only('columns', 'data').get(pk=table_pk)
+    return LoadedTable(table.columns, table.data)
+
+
+def load_table(table):
+    '''
+    The decoded table, from the memory of the worker if this build was
+    already loaded. table can be loaded with defer('data').
+    '''
+    return _load(table.pk, table.built_at)
+
+
+def query_table(table, request, per_page=None):
+    '''
+    A page of rows of a built table, from the query string:
+    - q: only the rows with a value containing it
+    - sort: column to sort by, order: "asc" or "desc"
+    - page: page number
+    '''
+    loaded = load_table(table)
+    search = request.GET.get('q', '')
+    sort = request.GET.get('sort', LABEL)
+    if sort not in loaded.data:
+        sort = LABEL
+    order = 'desc' if request.GET.get('order') == 'desc' else 'asc'
+
+    indexes = loaded.query(search, sort, order == 'desc')
+    rows = Paginator(indexes, per_page or settings.WIKIDATA_CLASS_PER_PAGE).get_page(request.GET.get('page'))
+    rows.object_list = loaded.rows(rows.object_list)
+
+    return {
+        'columns': list(zip(table.columns, table.column_labels)),
+        'rows': rows,
+        'search': search,
+        'sort': sort,
+        'order': order,
+    }
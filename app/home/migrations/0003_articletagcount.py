@@ -0,0 +1,36 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def count_tags(apps, schema_editor):
+    ArticlePageTag = apps.get_model('home', 'ArticlePageTag')
+    ArticleTagCount = apps.get_model('home', 'ArticleTagCount')
+
+    counts = (
+        ArticlePageTag.objects
+        .filter(content_object__live=True)
+        .values('tag_id')
+        .annotate(count=models.Count('content_object_id', distinct=True))
+    )
+    ArticleTagCount.objects.bulk_create([
+        ArticleTagCount(tag_id=row['tag_id'], count=row['count']) for row in counts
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('taggit', '0002_auto_20150616_2121'),
+        ('home', '0002_auto_20190727_1805'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArticleTagCount',
+            fields=[
+                ('tag', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to='taggit.Tag')),
+                ('count', models.PositiveIntegerField(db_index=True, default=0)),
+            ],
+        ),
+        migrations.RunPython(count_tags, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 2.2.28 on 2026-10-18 08:04
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+import wagtail.core.blocks
+import wagtail.core.fields
+import wagtail.documents.blocks
+import wagtail.embeds.blocks
+import wagtail.images.blocks
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailimages', '0001_squashed_0021'),
+        ('wagtailcore', '0041_group_collection_permissions_verbose_name_plural'),
+        ('home', '0003_articletagcount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WikidataEntity',
+            fields=[
+                ('entity_id', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('revision_id', models.PositiveIntegerField(default=0)),
+                ('label', models.CharField(blank=True, max_length=255)),
+                ('description', models.TextField(blank=True)),
+                ('aliases', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=255), blank=True, default=list, size=None)),
+                ('data', django.contrib.postgres.fields.jsonb.JSONField(default=dict)),
+                ('fetched_at', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Wikidata entities',
+            },
+        ),
+        migrations.CreateModel(
+            name='ItemPage',
+            fields=[
+                ('page_ptr', models.OneToOneField(auto_created=True, on_delete=django.db.models.deletion.CASCADE, parent_link=True, primary_key=True, serialize=False, to='wagtailcore.Page')),
+                ('item_Qid', models.CharField(max_length=255)),
+                ('notes', wagtail.core.fields.StreamField([('heading', wagtail.core.blocks.CharBlock(classname='full title')), ('paragraph', wagtail.core.blocks.RichTextBlock()), ('image', wagtail.images.blocks.ImageChooserBlock()), ('quote', wagtail.core.blocks.BlockQuoteBlock()), ('page', wagtail.core.blocks.PageChooserBlock()), ('document', wagtail.documents.blocks.DocumentChooserBlock()), ('embed', wagtail.embeds.blocks.EmbedBlock()), ('wikidata_query', wagtail.core.blocks.StructBlock([('query_intro', wagtail.core.blocks.RichTextBlock(required=False)), ('query_sparql', wagtail.core.blocks.TextBlock(help_text='Past here a Wikidata SPARQL request. You can test it before at query.wikidata.org.'))]))], blank=True)),
+                ('featured_Pids', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(blank=True, max_length=255), blank=True, default=list, size=None)),
+                ('feed_image', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='wagtailimages.Image')),
+            ],
+            options={
+                'abstract': False,
+            },
+            bases=('wagtailcore.page',),
+        ),
+    ]
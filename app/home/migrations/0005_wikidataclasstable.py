@@ -0,0 +1,31 @@
+# Generated by Django 2.2.28 on 2026-10-18 08:08
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0004_itempage_wikidataentity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WikidataClassTable',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('class_Qid', models.CharField(blank=True, max_length=255)),
+                ('columns', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=255), default=list, size=None)),
+                ('column_labels', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=255), default=list, size=None)),
+                ('data', django.contrib.postgres.fields.jsonb.JSONField(default=dict)),
+                ('row_count', models.PositiveIntegerField(default=0)),
+                ('status', models.CharField(choices=[('empty', 'Empty'), ('building', 'Building'), ('ready', 'Ready'), ('failed', 'Failed')], default='empty', max_length=16)),
+                ('error', models.TextField(blank=True)),
+                ('built_at', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('page', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='table', to='home.WikidataClass')),
+            ],
+        ),
+    ]
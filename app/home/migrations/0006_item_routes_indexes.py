@@ -0,0 +1,55 @@
+# Generated by Django 2.2.28 on 2026-10-18 08:46
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+def normalize_item_qids(apps, schema_editor):
+    '''
+    Upper-case the Qids of the ItemPages and keep one page per Qid before
+    they become unique: the live one, else the first in the tree. The
+    others lose their Qid, they render the item given in the URL instead.
+    '''
+    ItemPage = apps.get_model('home', 'ItemPage')
+    seen = set()
+    for page in ItemPage.objects.exclude(item_Qid='').order_by('-live', 'path').only('item_Qid'):
+        qid = page.item_Qid.strip().upper()
+        if qid in seen:
+            qid = ''
+        else:
+            seen.add(qid)
+        if qid != page.item_Qid:
+            ItemPage.objects.filter(pk=page.pk).update(item_Qid=qid)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0005_wikidataclasstable'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='itempage',
+            name='item_Qid',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='wikidataclass',
+            name='class_Qid',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='itempage',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['featured_Pids'], name='home_itempage_pids_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='wikidataclass',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['featured_Pids'], name='home_wdclass_pids_gin'),
+        ),
+        migrations.RunPython(normalize_item_qids, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='itempage',
+            constraint=models.UniqueConstraint(condition=models.Q(_negated=True, item_Qid=''), fields=('item_Qid',), name='home_itempage_unique_qid'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('home', '0006_item_routes_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RemovedPage',
+            fields=[
+                ('page_id', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('path', models.CharField(max_length=255)),
+                ('url_path', models.TextField(blank=True)),
+                ('removed_at', models.DateTimeField(db_index=True)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contenttypes.ContentType')),
+            ],
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0007_removedpage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangedPage',
+            fields=[
+                ('page_id', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('changed_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
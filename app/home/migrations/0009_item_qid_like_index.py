@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0008_changedpage'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='itempage',
+            index=models.Index(fields=['item_Qid'], name='home_itempage_qid_like', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
@@ -1,6 +1,9 @@
 # Core Django
 from django import forms
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models import Q
+from django.urls import reverse
 
 # Tags
 from modelcluster.fields import ParentalKey, ParentalManyToManyField
@@ -10,7 +13,8 @@ from taggit.models import TaggedItemBase
 # Classical fields
 from wagtail.core.models import Page, Orderable
 from wagtail.core.fields import RichTextField
-from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.fields import ArrayField, JSONField
+from django.contrib.postgres.indexes import GinIndex
 from wagtail.admin.edit_handlers import FieldPanel, MultiFieldPanel, InlinePanel, StreamFieldPanel
 from wagtail.images.edit_handlers import ImageChooserPanel
 from wagtail.search import index
@@ -28,17 +32,29 @@ from wagtail.embeds.blocks import EmbedBlock
 # Custom streamfield
 from home.custom_blocks import WdQueryBlock
 
+# Cache
+from home.page_cache import CachedPageMixin
+
+# Listings
+from home.listings import get_listing, get_cursor_listing, attach_categories
+from home.tags import parse_tags, filter_by_tags, tag_cloud
+
+# Wikidata
+from home import item_routes, materialize, page_cache, wikidata
+
 #API
 from wagtail.api import APIField
 from wagtail.images.api.fields import ImageRenditionField
 
-class HomePage(Page):
+class HomePage(CachedPageMixin, Page):
 
     '''
     These are homepages explore.ac and for sub-sites such as chronic-pain.reviews
     These also store the data relative to the focus.
     '''
 
+    cached_parameters = ('page',)
+
     # Database fields
     
     ## Text for the logo like mysite.com
@@ -104,7 +120,7 @@ class HomePage(Page):
     def get_context(self, request):
         context = super().get_context(request)
         articlepages = self.get_children().live().order_by('-first_published_at')
-        context['articlepages'] = articlepages
+        context['articlepages'] = get_listing(articlepages, request)
         return context
 
 class ArticlePageTag(TaggedItemBase):
@@ -119,23 +135,45 @@ class ArticlePageTag(TaggedItemBase):
     )
 
 
+class ArticleTagCount(models.Model):
+    '''
+    Number of live ArticlePages per tag, for the tag cloud.
+    Kept up to date by home.signals when articles are published or unpublished,
+    so the tag cloud does not need a GROUP BY on every request.
+    '''
+    tag = models.OneToOneField(
+        'taggit.Tag',
+        primary_key=True,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    count = models.PositiveIntegerField(default=0, db_index=True)
+
+
 class ArticleTagIndexPage(Page):
     '''
     Adding a page type to display a list of tags
+    Articles can be filtered by several tags, like ?tag=a&tag=b&operator=or
     '''
 
     def get_context(self, request):
 
-        # Filter by tag
-        tag = request.GET.get('tag')
-        articlepages = ArticlePage.objects.filter(tags__name=tag)
+        # Filter by tags, all of them by default
+        tags = parse_tags(request)
+        operator = 'or' if request.GET.get('operator') == 'or' else 'and'
 
         # Update template context
         context = super().get_context(request)
-        context['articlepages'] = articlepages
+        context['tags'] = tags
+        context['operator'] = operator
+        context['tag_cloud'] = tag_cloud()
+        if tags:
+            articlepages = filter_by_tags(ArticlePage.objects.live(), tags, operator)
+            context['articlepages'] = get_cursor_listing(articlepages, request)
+            attach_categories(context['articlepages'].object_list)
         return context
 
-class ArticlePage(Page):
+class ArticlePage(CachedPageMixin, Page):
 
     '''
     Articles pages handle both hand written articles and Wikidata query results.
@@ -228,7 +266,7 @@ class WikidataClass(Page):
 
     # Database fields
 
-    class_Qid = models.CharField(max_length=255)
+    class_Qid = models.CharField(max_length=255, db_index=True)
     featured_Pids = ArrayField(
             models.CharField(max_length=255, blank=True)
         )
@@ -253,6 +291,7 @@ class WikidataClass(Page):
 
     search_fields = Page.search_fields + [
         index.SearchField('class_Qid'),
+        index.AutocompleteField('class_Qid'),
         index.SearchField('featured_Pids'),
     ]
 
@@ -277,10 +316,306 @@ class WikidataClass(Page):
         APIField('feed_image'),
     ]
 
+    class Meta:
+        indexes = [
+            GinIndex(fields=['featured_Pids'], name='home_wdclass_pids_gin'),
+        ]
+
+    def get_context(self, request):
+        context = super().get_context(request)
+        # The columns are loaded only when this worker has not decoded this build yet
+        table = WikidataClassTable.objects.defer('data').filter(page=self).first()
+        context['table'] = table
+        if table is not None and table.built_at is not None:
+            context.update(materialize.query_table(table, request))
+        else:
+            # Shows that the table is being built
+            page_cache.mark_uncacheable(request)
+        return context
+
+
+class WikidataClassTable(models.Model):
+
+    '''
+    Materialized table of a WikidataClass page, built by home.materialize.
+    data holds one list of values per column: {'item': [..], 'label': [..], 'P17': [..]}
+    '''
+
+    EMPTY = 'empty'
+    BUILDING = 'building'
+    READY = 'ready'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (EMPTY, 'Empty'),
+        (BUILDING, 'Building'),
+        (READY, 'Ready'),
+        (FAILED, 'Failed'),
+    )
+
+    page = models.OneToOneField(
+        'home.WikidataClass',
+        on_delete=models.CASCADE,
+        related_name='table'
+    )
+    class_Qid = models.CharField(max_length=255, blank=True)
+    columns = ArrayField(
+            models.CharField(max_length=255),
+            default=list
+        )
+    column_labels = ArrayField(
+            models.CharField(max_length=255),
+            default=list
+        )
+    data = JSONField(default=dict)
+    row_count = models.PositiveIntegerField(default=0)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=EMPTY)
+    error = models.TextField(blank=True)
+    built_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    def __str__(self):
+        return '%s (%d rows)' % (self.page_id, self.row_count)
+
+    def matches(self, page):
+        ''' True if the table was built for the current class and Pids of the page '''
+        return self.class_Qid == page.class_Qid and self.columns[2:] == materialize.table_pids(page)
+
+
+class WikidataEntity(models.Model):
+
+    '''
+    Local copy of a Wikidata item or property, as rendered by ItemPages.
+    Filled and refreshed by home.wikidata.
+    data holds the statements, the labels of the entities they reference and
+    the Wikipedia intro.
+    '''
+
+    entity_id = models.CharField(max_length=32, primary_key=True)
+    revision_id = models.PositiveIntegerField(default=0)
+    label = models.CharField(max_length=255, blank=True)
+    description = models.TextField(blank=True)
+    aliases = ArrayField(
+            models.CharField(max_length=255),
+            blank=True,
+            default=list
+        )
+    data = JSONField(default=dict)
+    fetched_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        verbose_name_plural = 'Wikidata entities'
+
+    def __str__(self):
+        return '%s (%s)' % (self.label, self.entity_id)
+
+    @property
+    def url(self):
+        return wikidata.entity_url(self.entity_id)
+
+    @property
+    def class_qids(self):
+        ''' Qids of the classes of the entity (instance of) '''
+        for claim in self.data.get('claims', []):
+            if claim['property'] == 'P31':
+                return [value['id'] for value in claim['values'] if value['type'] == 'entity']
+        return []
+
+    @property
+    def wikipedia(self):
+        return self.data.get('wikipedia')
+
+    def get_statements(self, pids=None, limit=10):
+        '''
+        Statements with the labels of their properties and values,
+        for the given Pids or else the first ones.
+        '''
+        labels = self.data.get('labels', {})
+        claims = self.data.get('claims', [])
+        if pids:
+            by_pid = {claim['property']: claim for claim in claims}
+            claims = [by_pid[pid] for pid in pids if pid in by_pid]
+        else:
+            claims = claims[:limit]
+
+        def label_values(values):
+            for value in values:
+                value = dict(value)
+                if value['type'] == 'entity':
+                    value['label'] = labels.get(value['id'], value['id'])
+                    value['url'] = wikidata.entity_url(value['id'])
+                elif value['type'] == 'quantity':
+                    value['label'] = '%s %s' % (value['value'], labels.get(value['unit'], ''))
+                else:
+                    value['label'] = value['value']
+                yield value
+
+        statements = []
+        for claim in claims:
+            values = []
+            for value in label_values(claim['values']):
+                value['qualifiers'] = [
+                    {
+                        'property': qualifier['property'],
+                        'label': labels.get(qualifier['property'], qualifier['property']),
+                        'values': list(label_values(qualifier['values'])),
+                    }
+                    for qualifier in value.get('qualifiers', [])
+                ]
+                values.append(value)
+            statements.append({
+                'property': claim['property'],
+                'label': labels.get(claim['property'], claim['property']),
+                'url': wikidata.entity_url(claim['property']),
+                'values': values,
+            })
+        return statements
+
+
+class ItemPage(Page):
+    
+    '''
+    This pages get a Wikidata's item Qid as an URL parameter.
+    It display :
+    - The Item name as a printed title
+    - The item description as a subheading
+    - The item alias
+    - The intro from the related Wikipedia article if it exists, 
+        - with a "read more on wikipedia" link
+        - and links to other articles gathered from Wikidata's external Qids
+    - The list of Wikidata's properties + values + qualifiers
+        - This list has a "Display more" that hides long content
+        - It can be troncated for specific "Instance of" class Qids according to a list of Pids
+        - else, it displays the 10 first Pids.
+        - It also displays a link "edit on Wikidata"
+    - A list of scholarly articles gathered on Wikidata
+        - Each article dislays title + date + DOI
+        - This list has a "Display more" that hides long content
+        - Only the first 10 more recent articles are loaded by the SPARQL in order to avoid very long load times
+        - At the end on the list there is a link "see articles from" linking to scholarly articles databases prefilled search
+    - A tag cloud / graph of nearby items can be generated on demand (long load time)
+        - Links to other visual insights sites are provided
+        - Other visual tools & graph algortyhms could be further added
+    The Wikidata content is read from WikidataEntity, see home.wikidata.
+    '''
+
+    template = 'home/wd_item_page.html'
+
+    # Database fields
+
+    ## The user click on a link like https://explore.ac/item?qid="Q123"
+    ## It renders the "default" item page
+    ## But if there is a page with the Qid from the query string qid="Q123" :
+    ##     the notes will be added to the page
+    ## if there is no "qid" query string in the url, the qid from this field is rendered
+    ## One page per Qid, see home.item_routes. Copies of a page start without one.
+    item_Qid = models.CharField(max_length=255, blank=True)
+
+    ## This lets the site contributors add notes to some items internally
+    notes = StreamField([
+        ('heading', blocks.CharBlock(classname="full title")),
+        ('paragraph', blocks.RichTextBlock()),
+        ('image', ImageChooserBlock()),
+        ('quote', blocks.BlockQuoteBlock()),
+        ('page', blocks.PageChooserBlock()),
+        ('document', DocumentChooserBlock()),
+        ('embed', EmbedBlock()),
+        ('wikidata_query', WdQueryBlock()),
+    ], blank=True)
+
+    ## The image is used for the index of pages that have notes
+    feed_image = models.ForeignKey(
+        'wagtailimages.Image',
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='+'
+    )
+
+    ## This override the Pids gathered from WdClass for this item specifically
+    featured_Pids = ArrayField(
+            models.CharField(max_length=255, blank=True),
+            blank=True,
+            default=list
+        )
+
+    # Search index configuration
+
+    search_fields = Page.search_fields + [
+        index.SearchField('item_Qid'),
+        index.AutocompleteField('item_Qid'),
+        index.SearchField('notes'),
+        index.SearchField('featured_Pids'),
+    ]
+
+    # Editor panels configuration
+
+    content_panels = Page.content_panels + [
+        FieldPanel('item_Qid'),
+        StreamFieldPanel('notes', classname="full"),
+        FieldPanel('featured_Pids'),
+    ]
+
+    promote_panels = [
+        MultiFieldPanel(Page.promote_panels, "Common page configuration"),
+        ImageChooserPanel('feed_image'),
+    ]
+
+    # Export fields over the API
+    api_fields = [
+        APIField('item_Qid'),
+        APIField('notes'),
+        APIField('featured_Pids'),
+        APIField('feed_image'),
+    ]
+
+    exclude_fields_in_copy = ['item_Qid']
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['item_Qid'], condition=~Q(item_Qid=''), name='home_itempage_unique_qid'),
+        ]
+        indexes = [
+            GinIndex(fields=['featured_Pids'], name='home_itempage_pids_gin'),
+            # Qid prefixes of the autocomplete, LIKE 'Q4%' cannot use the unique index under a non-C collation
+            models.Index(fields=['item_Qid'], name='home_itempage_qid_like', opclasses=['varchar_pattern_ops']),
+        ]
+
+    def clean(self):
+        super().clean()
+        self.item_Qid = self.item_Qid.strip().upper()
+        if self.item_Qid and ItemPage.objects.filter(item_Qid=self.item_Qid).exclude(pk=self.pk).exists():
+            raise ValidationError({'item_Qid': 'There is already a page about %s' % self.item_Qid})
+
+    def get_qid(self, request):
+        qid = request.GET.get('qid', '').strip('"\' ').upper()
+        return qid if wikidata.is_entity_id(qid) else self.item_Qid
+
+    def get_item_page(self, qid):
+        ''' The page with the notes about the item: this one or the one about the Qid '''
+        if qid == self.item_Qid:
+            return self
+        return item_routes.get_item_page(qid)
+
+    def get_context(self, request):
+        context = super().get_context(request)
+        entity = wikidata.get_entity(self.get_qid(request))
+        context['entity'] = entity
+        if entity is not None:
+            item_page = self.get_item_page(entity.entity_id)
+            context['item_page'] = item_page
+            pids = item_page.featured_Pids if item_page is not None else None
+            context['statements'] = entity.get_statements(pids or item_routes.get_class_pids(entity.class_qids))
+            # Slow parts of the page, loaded by the page from the job queue
+            if entity.entity_id.startswith('Q'):
+                context['job_urls'] = {
+                    kind: reverse('job_status', args=[kind, entity.entity_id])
+                    for kind in ('scholarly_articles', 'nearby_items')
+                }
+        return context
+
 
 ## Categories
 
-class ArticleCategory(Page):
+class ArticleCategory(CachedPageMixin, Page):
 
     '''
     Articles' categories.
@@ -345,3 +680,38 @@ class ArticleCategory(Page):
     class Meta:
         verbose_name_plural = 'Article categories'
 
+
+
+## Export
+
+class RemovedPage(models.Model):
+
+    '''
+    A page unpublished, deleted or made private, so that the exports for the
+    mirrors (see project/export.py) tell them to remove it.
+    Written by home.signals, forgotten when the page is published again.
+    '''
+
+    page_id = models.PositiveIntegerField(primary_key=True)
+    content_type = models.ForeignKey('contenttypes.ContentType', on_delete=models.CASCADE, related_name='+')
+    path = models.CharField(max_length=255)
+    url_path = models.TextField(blank=True)
+    removed_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return '%s (%s)' % (self.url_path, self.removed_at)
+
+
+class ChangedPage(models.Model):
+
+    '''
+    A live page changed without being published again, so that the exports
+    for the mirrors (see project/export.py) send it again: moved (its URL
+    changed), or made public again. Written by home.signals & home.wagtail_hooks.
+    '''
+
+    page_id = models.PositiveIntegerField(primary_key=True)
+    changed_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return '%d (%s)' % (self.page_id, self.changed_at)
@@ -0,0 +1,171 @@
+'''
+Full response cache of pages for anonymous visitors.
+
+Each page has a generation number stored in the cache. It is part of the
+keys of its cached responses and template fragments, so bumping it on
+publish / unpublish / move invalidates every cached variant of the page
+(its pages of results included) without having to know their keys.
+
+Responses are keyed on the path and the query string parameters the page
+reads (cached_parameters): ?utm_source and the like do not store another
+copy. Previews of drafts never read nor write the template fragments of
+the live page.
+
+The same pages are purged from the cache of nginx, by URL (see
+project/frontend_cache.py). Pages showing something temporary are marked
+with mark_uncacheable while they render: neither this cache nor nginx keep
+them.
+'''
+
+import hashlib
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import add_never_cache_headers
+from django.utils.http import urlencode
+from wagtail.contrib.frontend_cache.utils import purge_urls_from_cache
+
+
+def generation_key(page_id):
+    return 'page-generation:%d' % page_id
+
+
+def get_generation(page):
+    return cache.get(generation_key(page.pk), 0)
+
+
+def get_generations(page_ids):
+    ''' Generations of several pages in one cache call, as a dict by page id '''
+    generations = cache.get_many([generation_key(page_id) for page_id in page_ids])
+    return {page_id: generations.get(generation_key(page_id), 0) for page_id in page_ids}
+
+
+def bump_generations(page_ids):
+    keys = [generation_key(page_id) for page_id in page_ids]
+    generations = cache.get_many(keys)
+    cache.set_many({key: generations.get(key, 0) + 1 for key in keys}, None)
+
+
+def affected_pages(page):
+    '''
+    Pages that render something from the given page:
+    the page itself, its parent listing and, for categories, their articles.
+    '''
+    from home.models import ArticleCategory, ArticlePage
+
+    pages = [page]
+    parent = page.get_parent()
+    if parent is not None:
+        pages.append(parent)
+    if isinstance(page, ArticleCategory):
+        pages.extend(ArticlePage.objects.filter(categories=page))
+    return pages
+
+
+def get_cached_urls(pages):
+    ''' URLs of the pages in the frontend cache '''
+    urls = []
+    for page in pages:
+        url = page.full_url
+        if url is not None:
+            urls.extend(url + path.lstrip('/') for path in page.get_cached_paths())
+    return urls
+
+
+def purge_urls(urls):
+    ''' Purge URLs from the frontend cache once the changes are committed '''
+    urls = list(OrderedDict.fromkeys(urls))
+    if urls:
+        transaction.on_commit(lambda: purge_urls_from_cache(urls))
+
+
+def invalidate(page):
+    pages = affected_pages(page)
+    bump_generations([p.pk for p in pages])
+    purge_urls(get_cached_urls(pages))
+
+
+def is_cacheable(request):
+    return (
+        request.method in ('GET', 'HEAD')
+        and not request.user.is_authenticated
+        and not getattr(request, 'is_preview', False)
+    )
+
+
+def mark_uncacheable(request):
+    ''' The response shows something temporary, like results still being computed: it is not cached '''
+    if request is not None:
+        request.page_cache_skip = True
+
+
+def is_marked_uncacheable(request):
+    return getattr(request, 'page_cache_skip', False)
+
+
+class UncacheableResponseMiddleware:
+    '''
+    Responses of the requests marked uncacheable tell nginx and the browsers
+    not to keep them either
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if is_marked_uncacheable(request):
+            add_never_cache_headers(response)
+        return response
+
+
+def response_key(page, request):
+    parameters = urlencode([
+        (name, value)
+        for name in page.cached_parameters
+        for value in request.GET.getlist(name)
+    ])
+    path = hashlib.md5((request.path + '?' + parameters).encode('utf-8')).hexdigest()
+    return 'page-response:%d:%d:%s' % (page.pk, get_generation(page), path)
+
+
+class CachedPageMixin:
+    '''
+    Serve the page from the cache for anonymous visitors.
+    Also adds the page generation to the context, for {% cache %} fragments,
+    and cache_fragments, false in previews: the fragments of a draft must
+    not replace those of the live page.
+    '''
+
+    # Query string parameters changing the response, the others are ignored
+    cached_parameters = ()
+
+    def get_context(self, request, *args, **kwargs):
+        context = super().get_context(request, *args, **kwargs)
+        context['cache_generation'] = get_generation(self)
+        context['cache_fragments'] = not getattr(request, 'is_preview', False)
+        return context
+
+    def serve(self, request, *args, **kwargs):
+        if not is_cacheable(request):
+            return super().serve(request, *args, **kwargs)
+
+        key = response_key(self, request)
+        response = cache.get(key)
+        if response is not None:
+            return response
+
+        def store(response):
+            # Checked once rendered, the blocks mark the request while rendering
+            if not is_marked_uncacheable(request):
+                cache.set(key, response, settings.PAGE_CACHE_TIMEOUT)
+
+        response = super().serve(request, *args, **kwargs)
+        if response.status_code == 200:
+            if hasattr(response, 'add_post_render_callback'):
+                response.add_post_render_callback(store)
+            else:
+                store(response)
+        return response
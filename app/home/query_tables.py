@@ -0,0 +1,270 @@
+'''
+Result tables of WdQueryBlocks, served page by page.
+
+The block used to render every row of its result in the page for DataTables
+to page it in the browser, so a query of 50k rows made pages of megabytes.
+The block now renders an empty table and DataTables asks
+/wdquery/<page id>/<table id>/ for the rows it shows (the DataTables
+server-side protocol: paging, ordering, global and column search). The full
+result can be downloaded as CSV or NDJSON, streamed row by row.
+
+The endpoints only serve the queries of a WdQueryBlock of a live public
+page, found by the hash of the query, so they cannot run arbitrary queries.
+Results come from home.sparql (the Django cache). Each process keeps the
+TABLES_IN_MEMORY last tables it served along with their sort orders, for as
+long as the result is fresh, so a request does not load the whole result
+from Redis nor sort it again.
+'''
+
+import csv
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from wagtail.core.fields import StreamField
+from wagtail.core.models import Page
+
+from home import sparql
+
+TABLES_IN_MEMORY = 8
+
+## Longest page DataTables can ask for
+MAX_LENGTH = 1000
+
+_tables = OrderedDict()
+_tables_lock = threading.Lock()
+
+
+def table_id(query):
+    return sparql.query_key(query)[-12:]
+
+
+def parse_number(value):
+    ''' float of a cell, ValueError for text and for "nan" or "inf", which cannot be ordered with the others '''
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(value)
+    return number
+
+
+class Table:
+
+    def __init__(self, entry):
+        self.columns = entry['columns']
+        self.rows = entry['rows']
+        self.fetched_at = entry['fetched_at']
+        self.error = entry['error']
+        self._texts = None
+        self._orders = {}
+
+    def is_fresh(self):
+        return time.time() - self.fetched_at < settings.WDQUERY_CACHE_TTL
+
+    @property
+    def texts(self):
+        ''' Lowercase cells, for the searches '''
+        if self._texts is None:
+            self._texts = [[cell.lower() for cell in row] for row in self.rows]
+        return self._texts
+
+    def sort_key(self, column):
+        ''' Numbers if all the values of the column are finite numbers, text otherwise '''
+        values = [row[column] for row in self.rows]
+        try:
+            numbers = [parse_number(value) if value else float('-inf') for value in values]
+            return numbers.__getitem__
+        except ValueError:
+            texts = [value.lower() for value in values]
+            return texts.__getitem__
+
+    def order(self, column):
+        ''' Indexes of the rows in the ascending order of a column '''
+        if column not in self._orders:
+            self._orders[column] = sorted(range(len(self.rows)), key=self.sort_key(column))
+        return self._orders[column]
+
+    def filter(self, search='', column_searches=()):
+        '''
+        Indexes of the rows containing every word of search in any column,
+        and each (column, value) of column_searches in that column.
+        None if nothing is filtered.
+        '''
+        words = search.lower().split()
+        column_searches = [(column, value.lower()) for column, value in column_searches if value]
+        if not words and not column_searches:
+            return None
+        return [
+            i for i, cells in enumerate(self.texts)
+            if all(value in cells[column] for column, value in column_searches)
+            and all(any(word in cell for cell in cells) for word in words)
+        ]
+
+    def select(self, search='', column_searches=(), ordering=()):
+        ''' Indexes of the rows filtered and sorted by [(column, descending), ...] '''
+        selected = self.filter(search, column_searches)
+        if not ordering:
+            return list(range(len(self.rows))) if selected is None else selected
+
+        if len(ordering) == 1:
+            column, descending = ordering[0]
+            order = self.order(column)
+            if selected is not None:
+                kept = bytearray(len(self.rows))
+                for i in selected:
+                    kept[i] = 1
+                order = [i for i in order if kept[i]]
+            return order[::-1] if descending else order
+
+        # Stable sorts from the last key to the first
+        selected = list(range(len(self.rows))) if selected is None else selected
+        for column, descending in reversed(ordering):
+            selected.sort(key=self.sort_key(column), reverse=descending)
+        return selected
+
+
+def get_table(query):
+    '''
+    Table of the results of a query, None while it is being computed.
+    Kept in the process while the result is fresh.
+    '''
+    key = sparql.query_key(query)
+    with _tables_lock:
+        table = _tables.get(key)
+        if table is not None:
+            _tables.move_to_end(key)
+    if table is not None and table.is_fresh():
+        return table
+
+    entry = sparql.get_results(query)
+    if entry is None:
+        return None
+    if table is None or table.fetched_at != entry['fetched_at']:
+        table = Table(entry)
+    if table.error:
+        return table
+    with _tables_lock:
+        _tables[key] = table
+        _tables.move_to_end(key)
+        while len(_tables) > TABLES_IN_MEMORY:
+            _tables.popitem(last=False)
+    return table
+
+
+## Blocks of the pages
+
+def query_block_fields(model):
+    ''' {StreamField name: names of its WdQueryBlocks} of a page model '''
+    from home.custom_blocks import WdQueryBlock
+
+    fields = {}
+    for field in model._meta.get_fields():
+        if isinstance(field, StreamField):
+            names = {name for name, block in field.stream_block.child_blocks.items() if isinstance(block, WdQueryBlock)}
+            if names:
+                fields[field.name] = names
+    return fields
+
+
+def find_query(page_id, table):
+    '''
+    Query of the WdQueryBlock of a live public page with this table id, None if there is none.
+    Only the StreamFields with WdQueryBlocks are loaded, and their JSON is
+    read as it is stored, without converting the blocks.
+    '''
+    content_type_id = Page.objects.live().public().filter(pk=page_id).values_list('content_type_id', flat=True).first()
+    if content_type_id is None:
+        return None
+    model = ContentType.objects.get_for_id(content_type_id).model_class()
+    fields = query_block_fields(model) if model is not None else {}
+    if not fields:
+        return None
+
+    values = model.objects.filter(pk=page_id).values_list(*fields).first() or ()
+    for (name, block_names), stream in zip(fields.items(), values):
+        # Lazy StreamValues keep the stored JSON in stream_data
+        for child in stream.stream_data if stream.is_lazy else ():
+            if child['type'] in block_names:
+                query = child['value'].get('query_sparql', '')
+                if table_id(query) == table:
+                    return query
+    return None
+
+
+## DataTables server-side protocol
+
+def parse_int(value, default):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def parse_request(parameters, column_count):
+    '''
+    (start, length, search, [(column, value)], [(column, descending)])
+    from the parameters sent by DataTables
+    '''
+    start = max(parse_int(parameters.get('start'), 0), 0)
+    length = parse_int(parameters.get('length'), 10)
+    length = MAX_LENGTH if length < 0 else min(length, MAX_LENGTH)
+
+    column_searches = []
+    for column in range(column_count):
+        value = parameters.get('columns[%d][search][value]' % column, '')
+        if value and parameters.get('columns[%d][searchable]' % column, 'true') == 'true':
+            column_searches.append((column, value))
+
+    ordering = []
+    i = 0
+    while 'order[%d][column]' % i in parameters:
+        column = parse_int(parameters.get('order[%d][column]' % i), -1)
+        if 0 <= column < column_count and parameters.get('columns[%d][orderable]' % column, 'true') == 'true':
+            ordering.append((column, parameters.get('order[%d][dir]' % i) == 'desc'))
+        i += 1
+
+    return start, length, parameters.get('search[value]', ''), column_searches, ordering
+
+
+def get_page(table, parameters):
+    ''' Response of DataTables for a request '''
+    draw = parse_int(parameters.get('draw'), 0)
+    if table is None or table.error:
+        return {
+            'draw': draw, 'recordsTotal': 0, 'recordsFiltered': 0, 'data': [],
+            'error': 'The results of this query are being computed, please reload the page in a few seconds.'
+            if table is None else 'The results of this query are not available for now.',
+        }
+
+    start, length, search, column_searches, ordering = parse_request(parameters, len(table.columns))
+    selected = table.select(search, column_searches, ordering)
+    return {
+        'draw': draw,
+        'recordsTotal': len(table.rows),
+        'recordsFiltered': len(selected),
+        'data': [table.rows[i] for i in selected[start:start + length]],
+    }
+
+
+## Downloads
+
+class Echo:
+    ''' File-like object returning what is written, for csv.writer in a stream '''
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(table):
+    writer = csv.writer(Echo())
+    yield writer.writerow(table.columns)
+    for row in table.rows:
+        yield writer.writerow(row)
+
+
+def ndjson_lines(table):
+    for row in table.rows:
+        yield json.dumps(dict(zip(table.columns, row)), ensure_ascii=False, separators=(',', ':')) + '\n'
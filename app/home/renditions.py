@@ -0,0 +1,113 @@
+'''
+Renditions of the page images, generated before a visitor asks for them.
+
+The templates ask for a rendition of some image fields of the pages
+(RENDITION_SPECS). A missing rendition is generated inside the request that
+needs it, so the first visitor after an upload, or after a deploy on an empty
+media volume, waits for Pillow. Instead:
+- saving an image or publishing a page queues a "renditions" job (see
+  jobs.queue) generating the renditions of its images
+- the warm_renditions command generates all the missing renditions with a
+  pool of processes
+
+The feed images also have a 2x rendition, used by the srcset of the cards.
+'''
+
+from django.db import connection
+from django.db.models import FieldDoesNotExist, ForeignKey
+
+from wagtail.core.models import get_page_models
+from wagtail.images import get_image_model
+from wagtail.images.models import Filter
+
+from home.listings import FEED_RENDITION, scaled_spec
+from jobs.queue import enqueue
+
+## Filter specs used by the templates, per image field of the pages
+RENDITION_SPECS = {
+    'feed_image': [FEED_RENDITION, scaled_spec(FEED_RENDITION, 2)],
+    'intro_image': ['original'],
+    'icon_image': ['fill-32x32'],
+}
+
+## Fields of an image which change its renditions
+IMAGE_FIELDS = {'file', 'focal_point_x', 'focal_point_y', 'focal_point_width', 'focal_point_height'}
+
+
+def image_fields():
+    ''' (page model, field name, specs) of the image fields of the page models '''
+    for model in get_page_models():
+        for name, specs in RENDITION_SPECS.items():
+            try:
+                field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                continue
+            # Fields inherited from a parent model are listed with the parent
+            if isinstance(field, ForeignKey) and field.model is model:
+                yield model, name, specs
+
+
+def get_image_specs():
+    ''' Filter specs of all the images used by pages, as {image id: set of specs} '''
+    image_specs = {}
+    for model, name, specs in image_fields():
+        image_ids = model.objects.filter(**{'%s__isnull' % name: False}).values_list('%s_id' % name, flat=True)
+        for image_id in image_ids.distinct().iterator():
+            image_specs.setdefault(image_id, set()).update(specs)
+    return image_specs
+
+
+def get_specs(image_id):
+    ''' Filter specs of the renditions of an image used by pages '''
+    specs = set()
+    for model, name, field_specs in image_fields():
+        if model.objects.filter(**{'%s_id' % name: image_id}).exists():
+            specs.update(field_specs)
+    return specs
+
+
+def get_page_image_ids(page):
+    ''' Ids of the images of a page with renditions '''
+    image_ids = {getattr(page, '%s_id' % name, None) for name in RENDITION_SPECS}
+    return sorted(image_ids - {None})
+
+
+def get_missing_specs(image, specs):
+    ''' The specs without a rendition for the current file and focal point of the image '''
+    Rendition = get_image_model().get_rendition_model()
+    existing = set(Rendition.objects.filter(image=image, filter_spec__in=specs).values_list(
+        'filter_spec', 'focal_point_key'
+    ))
+    return [
+        spec for spec in sorted(specs)
+        if (spec, Filter(spec=spec).get_cache_key(image)) not in existing
+    ]
+
+
+def generate_renditions(image_id, specs=None):
+    '''
+    Generate the missing renditions of an image, by default those of the
+    page fields using it. Returns the generated specs.
+    '''
+    image = get_image_model().objects.filter(pk=image_id).first()
+    if image is None:
+        return []
+    missing = get_missing_specs(image, get_specs(image_id) if specs is None else specs)
+    for spec in missing:
+        image.get_rendition(spec)
+    return missing
+
+
+def enqueue_renditions(image_ids):
+    ''' Queue the generation of the renditions of these images, again if they were generated already '''
+    for image_id in image_ids:
+        enqueue('renditions', str(image_id), again=True)
+
+
+## Warmup, run by the pool of processes of the warm_renditions command
+
+def warm(image_id, specs):
+    try:
+        return len(generate_renditions(image_id, specs))
+    finally:
+        connection.close()
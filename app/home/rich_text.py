@@ -0,0 +1,124 @@
+'''
+Links and images of rich texts rendered from objects loaded in bulk.
+
+Wagtail's handlers load the page, document or image of each link and
+embedded image of a rich text, with one query each, plus one for the
+rendition of each image. Within "with prefetched(sources):", the objects
+the given rich texts refer to are loaded beforehand, one query per kind of
+object and per image format, and the handlers registered in
+home/wagtail_hooks.py use them. Outside of it they work as Wagtail's ones.
+'''
+
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.utils.html import escape
+
+from wagtail.core.models import Page
+from wagtail.core.rich_text import pages
+from wagtail.core.rich_text.rewriters import FIND_A_TAG, FIND_EMBED_TAG, extract_attrs
+from wagtail.documents import rich_text as documents
+from wagtail.documents.models import get_document_model
+from wagtail.images import get_image_model
+from wagtail.images import rich_text as images
+from wagtail.images.formats import FORMATS_BY_NAME, get_image_format, search_for_image_formats
+
+_prefetched = threading.local()
+
+
+def get_entities(source):
+    ''' Attributes of the links and embeds of a rich text, as stored in the database '''
+    tags = FIND_A_TAG.findall(source) + FIND_EMBED_TAG.findall(source)
+    return [extract_attrs(tag) for tag in tags]
+
+
+def get_references(source):
+    ''' (kind, pk) of the pages, documents and images a rich text refers to '''
+    references = []
+    for attrs in get_entities(source):
+        kind = attrs.get('linktype') or attrs.get('embedtype')
+        if kind in ('page', 'document', 'image') and attrs.get('id', '').isdigit():
+            references.append((kind, int(attrs['id'])))
+    return references
+
+
+def prefetch(sources):
+    ''' Objects the rich texts refer to, as a dict by (kind, id) and ('rendition', id, filter spec) '''
+    from home.listings import get_renditions
+
+    search_for_image_formats()
+    ids = defaultdict(set)
+    specs = defaultdict(set)
+    for source in sources:
+        for attrs in get_entities(source):
+            kind = attrs.get('linktype') or attrs.get('embedtype')
+            if kind not in ('page', 'document', 'image') or not attrs.get('id', '').isdigit():
+                continue
+            ids[kind].add(int(attrs['id']))
+            if kind == 'image' and attrs.get('format') in FORMATS_BY_NAME:
+                specs[FORMATS_BY_NAME[attrs['format']].filter_spec].add(int(attrs['id']))
+
+    objects = {}
+    querysets = {
+        'page': lambda: Page.objects.filter(id__in=ids['page']).specific(),
+        'document': lambda: get_document_model().objects.filter(id__in=ids['document']),
+        'image': lambda: get_image_model().objects.filter(id__in=ids['image']),
+    }
+    for kind, queryset in querysets.items():
+        if ids[kind]:
+            objects.update({(kind, str(instance.pk)): instance for instance in queryset()})
+
+    for spec, image_ids in specs.items():
+        spec_images = [objects[key] for key in (('image', str(pk)) for pk in image_ids) if key in objects]
+        for pk, rendition in get_renditions(spec_images, spec).items():
+            objects['rendition', str(pk), spec] = rendition
+    return objects
+
+
+@contextmanager
+def prefetched(sources):
+    previous = getattr(_prefetched, 'objects', {})
+    _prefetched.objects = prefetch(sources)
+    try:
+        yield
+    finally:
+        _prefetched.objects = previous
+
+
+def get_prefetched(*key):
+    return getattr(_prefetched, 'objects', {}).get(key)
+
+
+## Handlers
+
+class PrefetchedMixin:
+
+    @classmethod
+    def get_instance(cls, attrs):
+        instance = get_prefetched(cls.identifier, attrs.get('id'))
+        return instance if instance is not None else super().get_instance(attrs)
+
+
+class PageLinkHandler(PrefetchedMixin, pages.PageLinkHandler):
+    pass
+
+
+class DocumentLinkHandler(PrefetchedMixin, documents.DocumentLinkHandler):
+    pass
+
+
+class ImageEmbedHandler(PrefetchedMixin, images.ImageEmbedHandler):
+
+    @classmethod
+    def expand_db_attributes(cls, attrs):
+        image_format = get_image_format(attrs.get('format'))
+        rendition = get_prefetched('rendition', attrs.get('id'), image_format.filter_spec)
+        if rendition is None:
+            return super().expand_db_attributes(attrs)
+
+        # As Format.image_to_html, with the prefetched rendition
+        extra_attributes = {'alt': escape(attrs.get('alt', ''))}
+        if image_format.classnames:
+            extra_attributes['class'] = escape(image_format.classnames)
+        return rendition.img_tag(extra_attributes)
@@ -0,0 +1,130 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from wagtail.core.models import Page, PageViewRestriction
+from wagtail.core.signals import page_published, page_unpublished
+from wagtail.documents.models import get_document_model
+from wagtail.images import get_image_model
+
+from home import block_cache, item_routes, materialize, page_cache, renditions
+from project import export
+from home.models import ArticlePage, ArticlePageTag, ItemPage, RemovedPage, WikidataClass, WikidataClassTable
+from home.tags import update_tag_counts
+
+
+## Cache invalidation
+
+@receiver(page_published)
+@receiver(page_unpublished)
+def invalidate_page_cache(sender, instance, **kwargs):
+    page_cache.invalidate(instance)
+
+
+## Qid routes of ItemPages, kept by each process (see home/item_routes.py)
+
+@receiver(post_save, sender=ItemPage)
+@receiver(post_delete, sender=ItemPage)
+@receiver(post_save, sender=WikidataClass)
+@receiver(post_delete, sender=WikidataClass)
+def invalidate_item_routes(sender, instance, **kwargs):
+    transaction.on_commit(item_routes.invalidate)
+
+
+## Blocks showing an image or a document, pages are covered by their generation
+
+@receiver(post_save, sender=get_image_model())
+@receiver(post_delete, sender=get_image_model())
+def invalidate_image_blocks(sender, instance, **kwargs):
+    block_cache.invalidate('image', instance.pk)
+
+
+@receiver(post_save, sender=get_document_model())
+@receiver(post_delete, sender=get_document_model())
+def invalidate_document_blocks(sender, instance, **kwargs):
+    block_cache.invalidate('document', instance.pk)
+
+
+## Tag counts
+## The tags of an article before it is saved are kept on the instance, so
+## that the counts of the tags removed from it are updated too.
+
+def get_tag_ids(page):
+    return set(ArticlePageTag.objects.filter(content_object_id=page.pk).values_list('tag_id', flat=True))
+
+
+@receiver(pre_save, sender=ArticlePage)
+@receiver(pre_delete, sender=ArticlePage)
+def remember_tags(sender, instance, **kwargs):
+    if instance.pk is not None:
+        instance._previous_tag_ids = get_tag_ids(instance)
+
+
+@receiver(page_published, sender=ArticlePage)
+@receiver(page_unpublished, sender=ArticlePage)
+def update_article_tag_counts(sender, instance, **kwargs):
+    update_tag_counts(get_tag_ids(instance) | getattr(instance, '_previous_tag_ids', set()))
+
+
+@receiver(post_delete, sender=ArticlePage)
+def update_deleted_article_tag_counts(sender, instance, **kwargs):
+    update_tag_counts(getattr(instance, '_previous_tag_ids', set()))
+
+
+## Tables of WikidataClass pages
+## Rebuilt when their class or featured Pids change, the schedule refreshes the others.
+
+@receiver(page_published, sender=WikidataClass)
+def build_class_table(sender, instance, **kwargs):
+    table = WikidataClassTable.objects.defer('data').filter(page=instance).first()
+    if table is None or table.built_at is None or not table.matches(instance):
+        materialize.build_in_background(instance)
+
+
+## Renditions
+## Generated by the job queue once the image or the page is committed
+
+@receiver(post_save, sender=get_image_model())
+def queue_image_renditions(sender, instance, update_fields=None, **kwargs):
+    # Saves of other fields, like the file size, do not change the renditions
+    if update_fields is not None and not set(update_fields) & renditions.IMAGE_FIELDS:
+        return
+    transaction.on_commit(lambda: renditions.enqueue_renditions([instance.pk]))
+
+
+@receiver(page_published)
+def queue_page_renditions(sender, instance, **kwargs):
+    image_ids = renditions.get_page_image_ids(instance)
+    if image_ids:
+        transaction.on_commit(lambda: renditions.enqueue_renditions(image_ids))
+
+
+## Pages removed from or sent again by the exports for the mirrors (see project/export.py)
+
+@receiver(page_unpublished)
+def remember_unpublished_page(sender, instance, **kwargs):
+    export.remember_removed_pages([instance])
+
+
+@receiver(post_delete, sender=Page)
+def remember_deleted_page(sender, instance, **kwargs):
+    export.remember_removed_pages([instance])
+
+
+@receiver(post_save, sender=PageViewRestriction)
+def remember_private_pages(sender, instance, created, **kwargs):
+    if created:
+        export.remember_removed_pages(list(instance.page.get_descendants(inclusive=True)))
+
+
+@receiver(post_delete, sender=PageViewRestriction)
+def remember_public_pages(sender, instance, **kwargs):
+    # The restriction is deleted with its page too
+    page = Page.objects.filter(pk=instance.page_id).first()
+    if page is not None:
+        export.remember_changed_pages(page.get_descendants(inclusive=True).live().public().values_list('pk', flat=True))
+
+
+@receiver(page_published)
+def forget_published_page(sender, instance, **kwargs):
+    RemovedPage.objects.filter(page_id=instance.pk).delete()
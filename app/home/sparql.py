@@ -0,0 +1,155 @@
+'''
+Wikidata SPARQL queries, run server side and shared through the Django cache.
+
+A WdQueryBlock used to be rendered on every request of every uWSGI worker.
+Results are now cached:
+- the cache key is a hash of the normalized query, so whitespace or comment
+  changes in the admin do not create new entries
+- results are fresh for WDQUERY_CACHE_TTL seconds
+- then they are served stale for WDQUERY_STALE_TTL seconds while one
+  background refresh runs
+- a lock stored in the cache makes sure only one worker queries the endpoint
+  for a given query at a time (single flight)
+'''
+
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from urllib.error import URLError
+from urllib.parse import urlencode, quote
+from urllib.request import Request, urlopen
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+class SparqlError(Exception):
+    pass
+
+
+## Queries
+
+def normalize_query(query):
+    '''
+    Drop comment lines and collapse whitespace.
+    Inline "#" are kept as they are used in IRIs and strings.
+    '''
+    lines = [line for line in query.splitlines() if not line.strip().startswith('#')]
+    return re.sub(r'\s+', ' ', ' '.join(lines)).strip()
+
+
+def query_key(query):
+    digest = hashlib.sha256(normalize_query(query).encode('utf-8')).hexdigest()
+    return 'wdquery:%s' % digest
+
+
+def query_service_url(query):
+    ''' Link to the query on query.wikidata.org '''
+    return 'https://query.wikidata.org/#' + quote(query)
+
+
+def fetch(query, endpoint=None, timeout=None):
+    '''
+    Run a query against the SPARQL endpoint.
+    Returns a dict with the column names and the rows as lists of strings.
+    '''
+    endpoint = endpoint or settings.WIKIDATA_SPARQL_ENDPOINT
+    timeout = timeout or settings.WDQUERY_TIMEOUT
+    request = Request(
+        endpoint,
+        data=urlencode({'query': query}).encode('utf-8'),
+        headers={
+            'Accept': 'application/sparql-results+json',
+            'User-Agent': settings.WIKIDATA_USER_AGENT,
+        },
+    )
+    try:
+        with urlopen(request, timeout=timeout) as response:
+            data = json.loads(response.read().decode('utf-8'))
+    except (URLError, OSError, ValueError) as e:
+        raise SparqlError(str(e))
+
+    try:
+        columns = data['head']['vars']
+        bindings = data['results']['bindings']
+    except (KeyError, TypeError):
+        raise SparqlError('Unexpected response from %s' % endpoint)
+
+    rows = [
+        [binding.get(column, {}).get('value', '') for column in columns]
+        for binding in bindings
+    ]
+    return {'columns': columns, 'rows': rows}
+
+
+## Cache
+
+def _lock_key(key):
+    return key + ':lock'
+
+
+def _store(query, key):
+    '''
+    Fetch the query and store the result. Must be called with the lock held.
+    Errors are cached for a short time so a failing endpoint is not hammered,
+    but they never overwrite a stale result.
+    '''
+    try:
+        try:
+            entry = fetch(query)
+            entry['error'] = None
+            timeout = settings.WDQUERY_CACHE_TTL + settings.WDQUERY_STALE_TTL
+        except SparqlError as e:
+            logger.warning('SPARQL query %s failed: %s', key, e)
+            stale = cache.get(key)
+            if stale is not None and not stale['error']:
+                # Keep serving it, and retry after WDQUERY_ERROR_TTL only
+                stale['fetched_at'] = time.time() - settings.WDQUERY_CACHE_TTL + settings.WDQUERY_ERROR_TTL
+                cache.set(key, stale, settings.WDQUERY_STALE_TTL)
+                return stale
+            entry = {'columns': [], 'rows': [], 'error': str(e)}
+            timeout = settings.WDQUERY_ERROR_TTL
+
+        entry['fetched_at'] = time.time()
+        cache.set(key, entry, timeout)
+        return entry
+    finally:
+        cache.delete(_lock_key(key))
+
+
+def _is_fresh(entry):
+    ttl = settings.WDQUERY_ERROR_TTL if entry['error'] else settings.WDQUERY_CACHE_TTL
+    return time.time() - entry['fetched_at'] < ttl
+
+
+def get_results(query):
+    '''
+    Get the results of a query from the cache, or run it.
+    Returns None if another worker is computing it and it was not ready in time.
+    '''
+    key = query_key(query)
+    lock_key = _lock_key(key)
+    entry = cache.get(key)
+
+    # Stale while revalidate
+    if entry is not None:
+        if not _is_fresh(entry) and cache.add(lock_key, 1, settings.WDQUERY_TIMEOUT):
+            threading.Thread(target=_store, args=(query, key), daemon=True).start()
+        return entry
+
+    # Cold cache: only one worker runs the query, the others wait for it
+    if cache.add(lock_key, 1, settings.WDQUERY_TIMEOUT):
+        return _store(query, key)
+
+    deadline = time.time() + settings.WDQUERY_WAIT
+    while time.time() < deadline:
+        time.sleep(0.2)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry
+    return None
@@ -0,0 +1,84 @@
+'''
+Tag browsing for ArticleTagIndexPage.
+
+- Articles can be filtered by several tags, all of them (and) or any (or)
+- The tag cloud is read from ArticleTagCount, the number of live articles
+  per tag, which is updated by home.signals when articles are published,
+  unpublished or deleted.
+'''
+
+from django.db import transaction
+from django.db.models import Count
+
+MAX_TAGS = 10
+
+CLOUD_SIZE = 50
+CLOUD_LEVELS = 5
+
+
+def parse_tags(request):
+    '''
+    Tags from the query string, as ?tag=a&tag=b or ?tag=a,b
+    '''
+    tags = []
+    for value in request.GET.getlist('tag'):
+        for tag in value.split(','):
+            tag = tag.strip()
+            if tag and tag not in tags:
+                tags.append(tag)
+    return tags[:MAX_TAGS]
+
+
+def filter_by_tags(articlepages, tags, operator='and'):
+    if operator == 'or':
+        return articlepages.filter(tags__name__in=tags).distinct()
+    # One join per tag, each one using the tag index
+    for tag in tags:
+        articlepages = articlepages.filter(tags__name=tag)
+    return articlepages
+
+
+def update_tag_counts(tag_ids):
+    ''' Count the live articles of the given tags again '''
+    from home.models import ArticlePageTag, ArticleTagCount
+
+    tag_ids = set(tag_ids)
+    if not tag_ids:
+        return
+
+    counts = dict(
+        ArticlePageTag.objects
+        .filter(tag_id__in=tag_ids, content_object__live=True)
+        .values('tag_id')
+        .annotate(count=Count('content_object_id', distinct=True))
+        .values_list('tag_id', 'count')
+    )
+
+    with transaction.atomic():
+        ArticleTagCount.objects.filter(tag_id__in=tag_ids - set(counts)).delete()
+        for tag_id, count in counts.items():
+            ArticleTagCount.objects.update_or_create(tag_id=tag_id, defaults={'count': count})
+
+
+def rebuild_tag_counts():
+    from home.models import ArticlePageTag, ArticleTagCount
+
+    ArticleTagCount.objects.all().delete()
+    update_tag_counts(ArticlePageTag.objects.values_list('tag_id', flat=True).distinct())
+
+
+def tag_cloud(size=CLOUD_SIZE):
+    '''
+    Most used tags, sorted by name, with a level from 1 to CLOUD_LEVELS
+    to size them in the template.
+    '''
+    from home.models import ArticleTagCount
+
+    counts = list(ArticleTagCount.objects.select_related('tag').order_by('-count')[:size])
+    if not counts:
+        return []
+
+    highest = counts[0].count
+    for tag_count in counts:
+        tag_count.level = 1 + (CLOUD_LEVELS - 1) * tag_count.count // highest
+    return sorted(counts, key=lambda tag_count: tag_count.tag.name.lower())
@@ -0,0 +1,104 @@
+'''
+Jobs run by jobs.queue:
+- the parts of ItemPages loaded by the page once ready, nearby items being
+  read from the graph of the stored items when it has the item (see
+  home/graph.py)
+- the renditions of the page images (see home/renditions.py)
+'''
+
+from django.conf import settings
+
+from home import graph, sparql
+from home.renditions import generate_renditions
+from jobs.queue import register
+
+SCHOLARLY_ARTICLES_LIMIT = 50
+NEARBY_ITEMS_LIMIT = 50
+## Incoming links are limited, some items are linked from millions of others
+NEARBY_INCOMING_LIMIT = 2000
+NEARBY_LEVELS = 5
+
+
+def entity_id(url):
+    return url.rsplit('/', 1)[-1]
+
+
+@register('scholarly_articles', public=True)
+def scholarly_articles(qid):
+    ''' The most recent articles whose main subject is the item '''
+    result = sparql.fetch('''SELECT ?article ?articleLabel ?date ?doi WHERE {
+  ?article wdt:P921 wd:%(qid)s .
+  OPTIONAL { ?article wdt:P577 ?date . }
+  OPTIONAL { ?article wdt:P356 ?doi . }
+  SERVICE wikibase:label { bd:serviceParam wikibase:language "%(language)s". }
+}
+ORDER BY DESC(?date)
+LIMIT %(limit)d''' % {
+        'qid': qid,
+        'language': settings.WIKIDATA_LANGUAGE,
+        'limit': SCHOLARLY_ARTICLES_LIMIT,
+    }, timeout=settings.WIKIDATA_JOB_TIMEOUT)
+
+    articles = []
+    for article, label, date, doi in result['rows']:
+        articles.append({
+            'qid': entity_id(article),
+            'title': label,
+            'date': date[:10],
+            'doi': doi,
+        })
+    return articles
+
+
+def set_levels(items, key):
+    ''' Level from 1 to NEARBY_LEVELS to size the items in a tag cloud, sorted by label '''
+    if items:
+        highest = max(item[key] for item in items)
+        for item in items:
+            item['level'] = 1 + int((NEARBY_LEVELS - 1) * item[key] // highest)
+    return sorted(items, key=lambda item: item['label'].lower())
+
+
+@register('nearby_items', public=True)
+def nearby_items(qid):
+    '''
+    Items linked to or from the item by a statement, the most linked first,
+    with a level from 1 to NEARBY_LEVELS to size them in a tag cloud.
+    '''
+    nearby = graph.nearby(qid, limit=NEARBY_ITEMS_LIMIT) if graph.is_available() else None
+    if nearby is not None and len(nearby['nodes']) > 1:
+        items = [
+            {'qid': node['qid'], 'label': node['label'], 'links': node['links'], 'score': node['score']}
+            for node in nearby['nodes'][1:]
+        ]
+        return set_levels(items, 'score')
+
+    result = sparql.fetch('''SELECT ?item ?itemLabel (COUNT(?p) AS ?links) WHERE {
+  { wd:%(qid)s ?p ?item . }
+  UNION
+  { SELECT ?item ?p WHERE { ?item ?p wd:%(qid)s . } LIMIT %(incoming)d }
+  ?property wikibase:directClaim ?p .
+  FILTER(?item != wd:%(qid)s)
+  SERVICE wikibase:label { bd:serviceParam wikibase:language "%(language)s". }
+}
+GROUP BY ?item ?itemLabel
+ORDER BY DESC(?links)
+LIMIT %(limit)d''' % {
+        'qid': qid,
+        'incoming': NEARBY_INCOMING_LIMIT,
+        'language': settings.WIKIDATA_LANGUAGE,
+        'limit': NEARBY_ITEMS_LIMIT,
+    }, timeout=settings.WIKIDATA_JOB_TIMEOUT)
+
+    items = [
+        {'qid': entity_id(item), 'label': label, 'links': int(links)}
+        for item, label, links in result['rows']
+        if entity_id(item).startswith('Q')
+    ]
+    return set_levels(items, 'links')
+
+
+@register('renditions')
+def renditions(image_id):
+    ''' The renditions of an image used by pages '''
+    return generate_renditions(int(image_id))
@@ -0,0 +1,11 @@
+from django import template
+
+from home.block_cache import render_stream
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def include_cached_stream(context, value):
+    ''' {% include_block %} of a StreamField, with its blocks cached (see home/block_cache.py) '''
+    return render_stream(value, context.flatten())
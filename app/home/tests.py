@@ -0,0 +1,735 @@
+import datetime
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.images import ImageFile
+from django.core.management import call_command
+from django.utils import timezone
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from PIL import Image as PILImage
+from wagtail.core.models import Page, PageViewRestriction, Site
+from wagtail.images import get_image_model
+
+from home import listings, materialize, page_cache, query_tables, sparql, wikidata
+from home.models import ArticleCategory, ArticlePage, HomePage, ItemPage, WikidataClass, WikidataEntity
+from jobs.models import Job
+from project import metrics
+
+LOCAL_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests'},
+    'template_fragments': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-fragments'},
+}
+
+## Pages are rendered without running collectstatic
+STATIC_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
+
+## Pages are indexed in memory, without Elasticsearch (see search/backends.py)
+SEARCH_BACKENDS = {
+    'default': {'BACKEND': 'search.backends', 'INDEX': 'tests', 'AUTO_UPDATE': False},
+}
+
+
+class StubServer:
+    '''
+    Local HTTP server answering every request with the current response,
+    recording the requests.
+    '''
+
+    def __init__(self, respond):
+        stub = self
+        self.respond = respond
+        self.requests = []
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def handle_request(self, body):
+                stub.requests.append((self.path, body))
+                status, data = stub.respond(self.path, body)
+                content = json.dumps(data).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def do_GET(self):
+                self.handle_request('')
+
+            def do_POST(self):
+                self.handle_request(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d/' % self.server.server_port
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def make_home_page():
+    ''' A HomePage served as the default site '''
+    home = Page.get_first_root_node().add_child(instance=HomePage(title='Home', slug='tests-home'))
+    Site.objects.all().delete()
+    Site.objects.create(hostname='testserver', root_page=home, is_default_site=True)
+    return home
+
+
+def make_image(title):
+    content = io.BytesIO()
+    PILImage.new('RGB', (1000, 800), (200, 40, 40)).save(content, 'JPEG')
+    return get_image_model().objects.create(title=title, file=ImageFile(content, name=title + '.jpg'))
+
+
+## SPARQL queries
+
+QUERY = '''# Humans
+SELECT ?item ?itemLabel WHERE { ?item wdt:P31 wd:Q5 } LIMIT 2'''
+
+
+def sparql_results(rows):
+    return {
+        'head': {'vars': ['item', 'itemLabel']},
+        'results': {'bindings': [
+            {'item': {'type': 'uri', 'value': item}, 'itemLabel': {'type': 'literal', 'value': label}}
+            for item, label in rows
+        ]},
+    }
+
+
+@override_settings(CACHES=LOCAL_CACHES, WDQUERY_CACHE_TTL=60, WDQUERY_STALE_TTL=600, WDQUERY_ERROR_TTL=30, WDQUERY_WAIT=1)
+class SparqlCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.status = 200
+        self.rows = [['http://www.wikidata.org/entity/Q1', 'one']]
+        self.endpoint = StubServer(lambda path, body: (self.status, sparql_results(self.rows)))
+        self.addCleanup(self.endpoint.close)
+        endpoint_settings = override_settings(WIKIDATA_SPARQL_ENDPOINT=self.endpoint.url)
+        endpoint_settings.enable()
+        self.addCleanup(endpoint_settings.disable)
+
+    def make_stale(self):
+        key = sparql.query_key(QUERY)
+        entry = cache.get(key)
+        entry['fetched_at'] -= 61
+        cache.set(key, entry, None)
+
+    def wait_for(self, condition, timeout=5):
+        deadline = time.time() + timeout
+        while not condition():
+            if time.time() > deadline:
+                self.fail('Timed out')
+            time.sleep(0.05)
+
+    def test_cache_hit(self):
+        first = sparql.get_results(QUERY)
+        # Comments and whitespace do not change the key
+        second = sparql.get_results('SELECT ?item ?itemLabel\n WHERE { ?item wdt:P31 wd:Q5 }   LIMIT 2')
+
+        self.assertEqual(first['rows'], self.rows)
+        self.assertEqual(second['rows'], self.rows)
+        self.assertIsNone(second['error'])
+        self.assertEqual(len(self.endpoint.requests), 1)
+        self.assertEqual(parse_qs(self.endpoint.requests[0][1])['query'], [QUERY])
+
+    def test_stale_while_revalidate(self):
+        sparql.get_results(QUERY)
+        self.make_stale()
+        old_rows = self.rows
+        self.rows = [['http://www.wikidata.org/entity/Q2', 'two']]
+
+        # The stale result is served while one background refresh runs
+        self.assertEqual(sparql.get_results(QUERY)['rows'], old_rows)
+        self.wait_for(lambda: cache.get(sparql.query_key(QUERY))['rows'] == self.rows)
+        self.wait_for(lambda: cache.get(sparql.query_key(QUERY) + ':lock') is None)
+        self.assertEqual(len(self.endpoint.requests), 2)
+        self.assertEqual(sparql.get_results(QUERY)['rows'], self.rows)
+
+    def test_waits_for_the_lock_holder(self):
+        key = sparql.query_key(QUERY)
+        cache.add(key + ':lock', 1)
+        entry = {'columns': ['item'], 'rows': [['Q3']], 'error': None, 'fetched_at': time.time()}
+        threading.Timer(0.3, lambda: cache.set(key, entry)).start()
+
+        self.assertEqual(sparql.get_results(QUERY)['rows'], [['Q3']])
+        self.assertEqual(self.endpoint.requests, [])
+
+    def test_gives_up_waiting(self):
+        cache.add(sparql.query_key(QUERY) + ':lock', 1)
+
+        self.assertIsNone(sparql.get_results(QUERY))
+        self.assertEqual(self.endpoint.requests, [])
+
+    def test_error_entry(self):
+        self.status = 500
+
+        entry = sparql.get_results(QUERY)
+        self.assertTrue(entry['error'])
+        self.assertEqual(entry['rows'], [])
+        # The error is remembered, the endpoint is not queried again
+        self.assertTrue(sparql.get_results(QUERY)['error'])
+        self.assertEqual(len(self.endpoint.requests), 1)
+
+    def test_error_keeps_the_stale_result(self):
+        sparql.get_results(QUERY)
+        self.make_stale()
+        self.status = 500
+
+        entry = sparql._store(QUERY, sparql.query_key(QUERY))
+        self.assertIsNone(entry['error'])
+        self.assertEqual(entry['rows'], self.rows)
+        self.assertEqual(cache.get(sparql.query_key(QUERY))['rows'], self.rows)
+
+
+## Query tables
+
+@override_settings(CACHES=LOCAL_CACHES, STATICFILES_STORAGE=STATIC_STORAGE, WDQUERY_WAIT=0, JOBS_QUEUE='worker')
+class QueryTableTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        # Tables kept by the process from the other tests
+        query_tables._tables.clear()
+        body = [
+            {'type': 'paragraph', 'value': '<p>Intro</p>'},
+            {'type': 'wikidata_query', 'value': {'query_intro': '', 'query_sparql': QUERY}},
+        ]
+        self.article = make_home_page().add_child(instance=ArticlePage(
+            title='Query', slug='query', date=datetime.date(2019, 1, 1), body=json.dumps(body)
+        ))
+        self.table = query_tables.table_id(QUERY)
+
+    def test_find_query(self):
+        # The page, its view restrictions and its StreamField
+        with self.assertNumQueries(3):
+            self.assertEqual(query_tables.find_query(self.article.pk, self.table), QUERY)
+        self.assertIsNone(query_tables.find_query(self.article.pk, '0' * 12))
+        self.assertIsNone(query_tables.find_query(self.article.get_parent().pk, self.table))
+
+    def test_private_page(self):
+        PageViewRestriction.objects.create(page=self.article, restriction_type=PageViewRestriction.LOGIN)
+        self.assertIsNone(query_tables.find_query(self.article.pk, self.table))
+
+    def test_rows(self):
+        cache.set(sparql.query_key(QUERY), {
+            'columns': ['item', 'itemLabel'], 'rows': [['Q2', 'two'], ['Q1', 'one']], 'error': None, 'fetched_at': time.time(),
+        })
+        response = self.client.get('/wdquery/%d/%s/' % (self.article.pk, self.table), {
+            'draw': 3, 'start': 0, 'length': 10, 'order[0][column]': 1, 'order[0][dir]': 'asc',
+        })
+        self.assertEqual(response.json(), {'draw': 3, 'recordsTotal': 2, 'recordsFiltered': 2, 'data': [['Q1', 'one'], ['Q2', 'two']]})
+
+
+class SortOrderTests(SimpleTestCase):
+
+    def test_query_table_nan_is_text(self):
+        table = query_tables.Table({
+            'columns': ['value'], 'rows': [['2'], ['nan'], ['1'], ['inf'], ['10']], 'error': None, 'fetched_at': time.time(),
+        })
+        self.assertEqual([table.rows[i][0] for i in table.order(0)], ['1', '10', '2', 'inf', 'nan'])
+
+        table.rows = [['2'], [''], ['1'], ['10']]
+        table._orders = {}
+        self.assertEqual([table.rows[i][0] for i in table.order(0)], ['', '1', '2', '10'])
+
+    def test_class_table_nan_is_text(self):
+        table = materialize.LoadedTable([materialize.LABEL], {
+            materialize.ITEM: ['Q1', 'Q2', 'Q3', 'Q4'], materialize.LABEL: ['nan', '10', 'b', '9'],
+        })
+        self.assertEqual(table.rows(table.order(materialize.LABEL)), [['9'], ['10'], ['b'], ['nan']])
+
+
+## Wikidata entities
+
+## wbgetentities responses recorded from www.wikidata.org
+RECORDED = os.path.join(os.path.dirname(__file__), 'test_data', 'wbgetentities')
+
+
+def recorded_response(props):
+    name = props if props in ('info', 'labels') else 'entities'
+    with open(os.path.join(RECORDED, name + '.json'), encoding='utf-8') as f:
+        return json.load(f)
+
+
+@override_settings(CACHES=LOCAL_CACHES, WIKIDATA_LANGUAGE='en', WIKIDATA_ENTITY_TTL=60)
+class WikidataTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.error = None
+        self.api = StubServer(self.respond)
+        self.addCleanup(self.api.close)
+        api_settings = override_settings(WIKIDATA_API_ENDPOINT=self.api.url)
+        api_settings.enable()
+        self.addCleanup(api_settings.disable)
+        intro = mock.patch.object(wikidata, 'get_wikipedia_intro', return_value='Douglas Adams was an English author.')
+        self.intro = intro.start()
+        self.addCleanup(intro.stop)
+
+    def respond(self, path, body):
+        ''' The recorded entities asked for, the others are missing '''
+        if self.error:
+            return 200, {'error': {'code': 'maxlag', 'info': self.error}}
+        params = {name: values[0] for name, values in parse_qs(urlparse(path).query).items()}
+        recorded = recorded_response(params['props'])['entities']
+        return 200, {
+            'entities': {
+                entity_id: recorded.get(entity_id, {'id': entity_id, 'missing': ''})
+                for entity_id in params['ids'].split('|')
+            },
+            'success': 1,
+        }
+
+    def requests(self):
+        ''' (props, ids) of the requests sent to the API '''
+        params = [parse_qs(urlparse(path).query) for path, body in self.api.requests]
+        return [(p['props'][0], p['ids'][0].split('|')) for p in params]
+
+    def test_batches(self):
+        ids = ['Q%d' % i for i in range(1, 121)] + ['P31']
+
+        labels = wikidata.get_labels(ids)
+        self.assertEqual([len(ids) for props, ids in self.requests()], [50, 50, 21])
+        # Missing entities are left out
+        self.assertEqual(labels, {'Q5': 'human', 'Q42': 'Douglas Adams', 'P31': 'instance of'})
+
+    def test_fetch_and_store(self):
+        entity = wikidata.get_entity('Q42')
+
+        stored = WikidataEntity.objects.get(pk='Q42')
+        self.assertEqual(entity, stored)
+        self.assertEqual(stored.revision_id, 1016284425)
+        self.assertEqual(stored.label, 'Douglas Adams')
+        self.assertEqual(stored.description, 'English writer and humorist')
+        self.assertEqual(stored.aliases, ['Douglas Noël Adams', 'Douglas Noel Adams'])
+        self.assertEqual(stored.class_qids, ['Q5'])
+
+        claims = {claim['property']: claim['values'] for claim in stored.data['claims']}
+        # The deprecated birth name is left out
+        self.assertEqual(list(claims), ['P31', 'P569', 'P2048', 'P856'])
+        self.assertEqual(claims['P31'][0]['value'], 'Q5')
+        self.assertEqual(claims['P569'][0]['value'], '1952-03-11')
+        self.assertEqual(claims['P2048'][0]['unit'], 'Q11573')
+        self.assertEqual(claims['P2048'][0]['qualifiers'], [
+            {'property': 'P585', 'values': [{'type': 'text', 'value': 'unknown'}]},
+        ])
+        self.assertEqual(claims['P856'][0], {'type': 'url', 'value': 'http://douglasadams.com/', 'qualifiers': []})
+
+        # Labels of the references, fetched in one batch
+        self.assertEqual(stored.data['labels'], {
+            'Q5': 'human', 'Q11573': 'metre', 'P31': 'instance of', 'P569': 'date of birth',
+            'P585': 'point in time', 'P856': 'official website', 'P1477': 'birth name', 'P2048': 'height',
+        })
+        self.assertEqual(stored.data['wikipedia']['url'], 'https://en.wikipedia.org/wiki/Douglas_Adams')
+        self.assertEqual(stored.data['wikipedia']['intro'], 'Douglas Adams was an English author.')
+        self.assertEqual([props for props, ids in self.requests()], ['info|labels|descriptions|aliases|claims|sitelinks', 'labels'])
+
+        # Stored entities are read locally
+        self.assertEqual(wikidata.get_entity('Q42'), stored)
+        self.assertEqual(len(self.api.requests), 2)
+
+    def test_refresh_compares_revisions(self):
+        wikidata.refresh_entities(['Q42', 'Q5'], check_revisions=False)
+        WikidataEntity.objects.filter(pk='Q5').update(revision_id=1, label='old')
+        self.api.requests.clear()
+
+        wikidata.refresh_entities(['Q42', 'Q5'])
+        requests = self.requests()
+        self.assertEqual(requests[0][0], 'info')
+        self.assertEqual(sorted(requests[0][1]), ['Q42', 'Q5'])
+        # Only the entity whose revision changed is downloaded again
+        self.assertEqual(requests[1], ('info|labels|descriptions|aliases|claims|sitelinks', ['Q5']))
+        self.assertEqual(WikidataEntity.objects.get(pk='Q5').label, 'human')
+
+    def test_stale_entity_is_refreshed_in_background(self):
+        wikidata.refresh_entities(['Q5'], check_revisions=False)
+        WikidataEntity.objects.filter(pk='Q5').update(fetched_at=timezone.now() - datetime.timedelta(seconds=61))
+
+        with mock.patch.object(wikidata, '_refresh_in_background') as refresh:
+            self.assertEqual(wikidata.get_entity('Q5').label, 'human')
+        refresh.assert_called_once_with('Q5')
+
+    def test_missing_entity(self):
+        self.assertIsNone(wikidata.get_entity('Q999999999'))
+        self.assertFalse(WikidataEntity.objects.exists())
+
+    def test_api_error(self):
+        self.error = 'Waiting for all: 5.2 seconds lagged.'
+
+        self.assertIsNone(wikidata.get_entity('Q42'))
+        with self.assertRaisesMessage(wikidata.WikidataError, self.error):
+            wikidata.refresh_entities(['Q42'])
+
+
+## Page cache
+
+@override_settings(CACHES=LOCAL_CACHES, STATICFILES_STORAGE=STATIC_STORAGE, WDQUERY_WAIT=0, JOBS_QUEUE='worker',
+                   SEARCH_INDEX_QUEUE='inline', WAGTAILSEARCH_BACKENDS=SEARCH_BACKENDS)
+class PageCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        body = [{'type': 'wikidata_query', 'value': {'query_intro': '', 'query_sparql': QUERY}}]
+        self.home = make_home_page()
+        self.article = self.home.add_child(instance=ArticlePage(
+            title='Query', slug='query', date=datetime.date(2019, 1, 1), body=json.dumps(body)
+        ))
+
+    def test_results_being_computed_are_not_cached(self):
+        # Another worker runs the query
+        key = sparql.query_key(QUERY)
+        cache.add(key + ':lock', 1)
+        response = self.client.get(self.article.url)
+        self.assertContains(response, 'being computed')
+        # Nor by nginx
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        cache.set(key, {'columns': ['item'], 'rows': [['Q1']], 'error': None, 'fetched_at': time.time()})
+        cache.delete(key + ':lock')
+        response = self.client.get(self.article.url)
+        self.assertNotContains(response, 'being computed')
+        self.assertContains(response, 'query_table_')
+        self.assertFalse(response.has_header('Cache-Control'))
+
+    def test_class_table_being_built(self):
+        page = self.home.add_child(instance=WikidataClass(
+            title='Class', slug='class', class_Qid='Q5', featured_Pids=['P17']
+        ))
+
+        response = self.client.get(page.url)
+        self.assertContains(response, 'being built')
+        self.assertIn('no-cache', response['Cache-Control'])
+
+    def test_previews_do_not_cache_their_fragments(self):
+        article = self.home.add_child(instance=ArticlePage(
+            title='Tagged', slug='tagged', date=datetime.date(2019, 1, 1), body='[]'
+        ))
+        article.tags.add('published-tag')
+        article.save_revision().publish()
+
+        draft = ArticlePage.objects.get(pk=article.pk)
+        draft.tags.set('draft-tag')
+        request = RequestFactory().get(draft.url)
+        request.user = get_user_model().objects.create_superuser('editor', 'editor@example.com', 'password')
+        request.site = Site.objects.get(is_default_site=True)
+        preview = draft.serve_preview(request, 'default')
+        preview.render()
+        self.assertContains(preview, 'draft-tag')
+
+        response = self.client.get(article.url)
+        self.assertContains(response, 'published-tag')
+        self.assertNotContains(response, 'draft-tag')
+
+    def test_unknown_parameters_share_the_response(self):
+        empty = self.home.add_child(instance=ArticlePage(
+            title='Empty', slug='empty', date=datetime.date(2019, 1, 1), body='[]'
+        ))
+        request = RequestFactory().get(empty.url + '?utm_source=feed&page=2')
+        self.assertEqual(
+            page_cache.response_key(empty, request),
+            page_cache.response_key(empty, RequestFactory().get(empty.url))
+        )
+        self.assertNotEqual(
+            page_cache.response_key(self.home, request),
+            page_cache.response_key(self.home, RequestFactory().get(self.home.url))
+        )
+
+
+## Listings
+
+@override_settings(CACHES=LOCAL_CACHES, STATICFILES_STORAGE=STATIC_STORAGE, JOBS_QUEUE='worker',
+                   SEARCH_INDEX_QUEUE='inline', WAGTAILSEARCH_BACKENDS=SEARCH_BACKENDS)
+class ListingQueriesTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_settings.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.media_settings.disable()
+        shutil.rmtree(cls.media_root)
+
+    def setUp(self):
+        self.home = make_home_page()
+        # Outside of the listing
+        self.category = Page.get_first_root_node().add_child(instance=ArticleCategory(title='Category', slug='category'))
+        self.count = 0
+
+    def add_articles(self, count):
+        for i in range(self.count, self.count + count):
+            image = make_image('feed %d' % i)
+            article = ArticlePage(
+                title='Article %d' % i, slug='article-%d' % i, date=datetime.date(2019, 1, 1),
+                feed_image=image, intro_image=image,
+            )
+            article.categories = [self.category]
+            self.home.add_child(instance=article).save_revision().publish()
+            # Renditions are generated ahead of the requests
+            for spec in (listings.FEED_RENDITION, listings.scaled_spec(listings.FEED_RENDITION, 2)):
+                image.get_rendition(spec)
+        self.count += count
+
+    def count_queries(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.home.url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_home_page_queries_do_not_depend_on_the_articles(self):
+        self.add_articles(2)
+        queries = self.count_queries()
+
+        self.add_articles(listings.PER_PAGE - 2)
+        self.assertEqual(self.count_queries(), queries)
+        # More than a page of them
+        self.add_articles(5)
+        self.assertEqual(self.count_queries(), queries)
+
+    def test_missing_2x_renditions_are_left_out(self):
+        image = make_image('feed')
+        self.home.add_child(instance=ArticlePage(
+            title='Article', slug='article', date=datetime.date(2019, 1, 1), feed_image=image
+        ))
+        image.get_rendition(listings.FEED_RENDITION)
+        Job.objects.all().delete()
+
+        pages = list(ArticlePage.objects.all())
+        with self.assertNumQueries(3):
+            page, = listings.attach_feed_images(pages)
+        self.assertEqual(page.feed_srcset, '%s 1x' % page.feed_rendition.url)
+        # Requests do not queue them either
+        self.assertFalse(Job.objects.exists())
+
+    def test_cursor_listing_pages_through_unpublished_pages(self):
+        published_at = timezone.now()
+        articles = []
+        for i in range(5):
+            article = ArticlePage(title='Article %d' % i, slug='article-%d' % i, date=datetime.date(2019, 1, 1))
+            # Articles added by code have no first_published_at
+            if i % 2:
+                article.first_published_at = published_at - datetime.timedelta(days=i)
+            articles.append(self.home.add_child(instance=article))
+
+        listed = []
+        cursor = ''
+        while cursor is not None:
+            listing = listings.get_cursor_listing(
+                ArticlePage.objects.live(), RequestFactory().get('/', {'after': cursor}), per_page=2
+            )
+            listed += [page.pk for page in listing]
+            cursor = listing.next_cursor
+
+        published = [articles[1], articles[3]]
+        unpublished = [articles[4], articles[2], articles[0]]
+        self.assertEqual(listed, [page.pk for page in published + unpublished])
+
+
+## Jobs
+
+@override_settings(CACHES=LOCAL_CACHES, STATICFILES_STORAGE=STATIC_STORAGE, JOBS_QUEUE='worker')
+class JobStatusTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def get_status(self, qid):
+        return self.client.get('/jobs/scholarly_articles/%s/' % qid)
+
+    def test_unknown_item(self):
+        self.assertEqual(self.get_status('Q123').status_code, 404)
+        self.assertFalse(Job.objects.exists())
+
+    def test_stored_item(self):
+        WikidataEntity.objects.create(entity_id='Q123', label='Item', fetched_at=timezone.now())
+
+        response = self.get_status('Q123')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], Job.PENDING)
+        self.assertTrue(Job.objects.filter(kind='scholarly_articles', key='Q123').exists())
+
+    def test_item_page(self):
+        make_home_page().add_child(instance=ItemPage(title='Item', slug='item', item_Qid='Q123'))
+
+        self.assertEqual(self.get_status('Q123').status_code, 200)
+
+    def test_existing_job(self):
+        Job.objects.create(kind='scholarly_articles', key='Q123', status=Job.DONE, result=[], finished_at=timezone.now())
+
+        response = self.get_status('Q123')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], Job.DONE)
+
+    def test_internal_jobs_are_not_served(self):
+        WikidataEntity.objects.create(entity_id='Q123', label='Item', fetched_at=timezone.now())
+        Job.objects.create(kind='renditions', key='123', status=Job.DONE, result=[], finished_at=timezone.now())
+
+        self.assertEqual(self.client.get('/jobs/renditions/Q123/').status_code, 404)
+        self.assertEqual(Job.objects.filter(kind='renditions').count(), 1)
+
+
+## Export
+
+@override_settings(CACHES=LOCAL_CACHES, STATICFILES_STORAGE=STATIC_STORAGE, JOBS_QUEUE='worker',
+                   SEARCH_INDEX_QUEUE='inline', WAGTAILSEARCH_BACKENDS=SEARCH_BACKENDS, EXPORT_TOKEN='secret')
+class ExportTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.home = make_home_page()
+        self.articles = []
+        for i in range(4):
+            article = ArticlePage(title='Article %d' % i, slug='article-%d' % i, date=datetime.date(2019, 1, 1))
+            self.home.add_child(instance=article).save_revision().publish()
+            self.articles.append(ArticlePage.objects.get(pk=article.pk))
+
+    def export(self, **params):
+        return self.client.get('/api/export/', params, HTTP_AUTHORIZATION='Bearer secret')
+
+    def read(self, response):
+        self.assertEqual(response.status_code, 200)
+        return [json.loads(line) for line in b''.join(response.streaming_content).decode('utf-8').splitlines()]
+
+    def test_token(self):
+        self.assertEqual(self.client.get('/api/export/').status_code, 401)
+        self.assertEqual(self.client.get('/api/export/', HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+        with self.settings(EXPORT_TOKEN=''):
+            self.assertEqual(self.export().status_code, 404)
+
+    def test_removed_pages(self):
+        since = self.export()['X-Export-Started-At']
+        unpublished, deleted, private, republished = self.articles
+        unpublished.unpublish()
+        deleted.delete()
+        PageViewRestriction.objects.create(page=private, restriction_type=PageViewRestriction.LOGIN)
+        republished.unpublish()
+        republished.save_revision().publish()
+
+        records = self.read(self.export(since=since))
+        removed = [record['id'] for record in records if record.get('removed')]
+        self.assertEqual(sorted(removed), sorted([unpublished.pk, deleted.pk, private.pk]))
+        # Removed pages come first
+        self.assertEqual([record['id'] for record in records[len(removed):]], [republished.pk])
+
+        # A full export only has the live public pages
+        self.assertEqual([record['id'] for record in self.read(self.export())], [republished.pk])
+
+    def test_moved_and_public_again_pages(self):
+        moved, private = self.articles[:2]
+        restriction = PageViewRestriction.objects.create(page=private, restriction_type=PageViewRestriction.LOGIN)
+        section = self.home.add_child(instance=Page(title='Section', slug='section'))
+        since = self.export()['X-Export-Started-At']
+
+        self.client.force_login(get_user_model().objects.create_superuser('editor', 'editor@example.com', 'password'))
+        self.client.post(reverse('wagtailadmin_pages:move_confirm', args=(moved.pk, section.pk)))
+        self.client.logout()
+        restriction.delete()
+
+        records = self.read(self.export(since=since))
+        self.assertEqual(sorted(record['id'] for record in records), sorted([moved.pk, private.pk]))
+        self.assertFalse([record for record in records if record.get('removed')])
+        self.assertEqual(
+            [record['url_path'] for record in records if record['id'] == moved.pk],
+            [section.url_path + 'article-0/']
+        )
+
+
+## Metrics
+
+@override_settings(CACHES=LOCAL_CACHES, STATICFILES_STORAGE=STATIC_STORAGE, METRICS_ENABLED=True, METRICS_TOKEN='secret')
+class MetricsTests(TestCase):
+
+    def test_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+        with mock.patch.object(metrics, 'read_totals', return_value={}):
+            response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '# TYPE django_request_duration_seconds histogram')
+
+        # Never served without a token
+        with self.settings(METRICS_TOKEN=''):
+            self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+
+## Import of items
+
+@override_settings(CACHES=LOCAL_CACHES, SEARCH_INDEX_QUEUE='inline', WAGTAILSEARCH_BACKENDS=SEARCH_BACKENDS)
+class ImportItemsTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        home = make_home_page()
+        self.parent = home.add_child(instance=Page(title='Items', slug='items'))
+        self.other_parent = home.add_child(instance=Page(title='Other items', slug='other-items'))
+        self.existing = self.other_parent.add_child(instance=ItemPage(title='Old label', slug='q2', item_Qid='Q2'))
+
+    def import_items(self, *items):
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as dump:
+            dump.write(''.join(json.dumps({'qid': qid, 'label': label}) + '\n' for qid, label in items))
+            dump.flush()
+            call_command('import_items', str(self.parent.pk), '--file', dump.name, stdout=io.StringIO())
+
+    def count_queries(self, *items):
+        # The command resets the query log after each chunk
+        queries = []
+
+        def count(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count):
+            self.import_items(*items)
+        return len(queries)
+
+    def test_items_with_a_page_elsewhere_are_updated(self):
+        self.import_items(('Q1', 'One'), ('Q2', 'Two'))
+
+        self.assertEqual(ItemPage.objects.get(item_Qid='Q1').get_parent().pk, self.parent.pk)
+        # The page of Q2 stays where it is
+        existing = ItemPage.objects.get(item_Qid='Q2')
+        self.assertEqual(existing.pk, self.existing.pk)
+        self.assertEqual(existing.title, 'Two')
+        self.assertEqual(ItemPage.objects.count(), 2)
+
+        # Importing again changes nothing
+        self.import_items(('Q1', 'One'), ('Q2', 'Two'))
+        self.assertEqual(ItemPage.objects.count(), 2)
+
+    def test_chunks_are_inserted_in_bulk(self):
+        few = self.count_queries(*[('Q%d' % i, 'Item %d' % i) for i in range(10, 13)])
+        many = self.count_queries(*[('Q%d' % i, 'Item %d' % i) for i in range(20, 60)])
+        self.assertEqual(many, few)
+
+        # Properties are not items, Qids are normalized
+        self.import_items(('P31', 'instance of'), (' q7 ', 'Seven'))
+        self.assertFalse(ItemPage.objects.filter(item_Qid='P31').exists())
+
+        page = ItemPage.objects.get(item_Qid='Q7')
+        self.assertEqual(page.get_parent().pk, self.parent.pk)
+        self.assertEqual(page.url_path, self.parent.url_path + 'seven-q7/')
+        self.assertEqual(Page.objects.get(pk=self.parent.pk).numchild, 44)
+        self.assertEqual(Page.objects.get(pk=page.pk).specific, page)
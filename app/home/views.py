@@ -0,0 +1,80 @@
+from django.conf import settings
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import require_GET
+
+from home import graph, query_tables
+
+
+def int_parameter(request, name, default, maximum):
+    try:
+        return max(1, min(int(request.GET.get(name, default)), maximum))
+    except ValueError:
+        return default
+
+
+@require_GET
+def graph_nearby(request, qid):
+    '''
+    The items closest to an item and the links between them, for a graph visualisation:
+    ?hops=2 (at most GRAPH_MAX_HOPS), ?limit=50 nodes (at most GRAPH_MAX_NODES)
+    '''
+    if not graph.is_available():
+        raise Http404
+    nearby = graph.nearby(
+        qid,
+        hops=int_parameter(request, 'hops', 2, settings.GRAPH_MAX_HOPS),
+        limit=int_parameter(request, 'limit', 50, settings.GRAPH_MAX_NODES),
+    )
+    if nearby is None:
+        raise Http404
+    response = JsonResponse(nearby)
+    patch_cache_control(response, public=True, max_age=60 * 60)
+    return response
+
+
+@require_GET
+def graph_path(request, source, target):
+    ''' A shortest path between two items, {"path": []} if they are not linked within GRAPH_MAX_PATH_LENGTH '''
+    if not graph.is_available():
+        raise Http404
+    path = graph.shortest_path(source, target)
+    if path is None:
+        raise Http404
+    response = JsonResponse({'path': path})
+    patch_cache_control(response, public=True, max_age=60 * 60)
+    return response
+
+
+def get_query_table(page_id, table_id):
+    query = query_tables.find_query(page_id, table_id)
+    if query is None:
+        raise Http404
+    return query_tables.get_table(query)
+
+
+@require_GET
+def wdquery_rows(request, page_id, table_id):
+    ''' Rows of a WdQueryBlock for DataTables, in its server-side processing format '''
+    table = get_query_table(page_id, table_id)
+    response = JsonResponse(query_tables.get_page(table, request.GET))
+    if table is None or table.error:
+        patch_cache_control(response, no_cache=True, no_store=True)
+    else:
+        patch_cache_control(response, public=True, max_age=60)
+    return response
+
+
+@require_GET
+def wdquery_download(request, page_id, table_id, format):
+    ''' All the rows of a WdQueryBlock as CSV or NDJSON '''
+    table = get_query_table(page_id, table_id)
+    if table is None or table.error:
+        raise Http404
+    if format == 'csv':
+        response = StreamingHttpResponse(query_tables.csv_lines(table), content_type='text/csv; charset=utf-8')
+    else:
+        response = StreamingHttpResponse(query_tables.ndjson_lines(table), content_type='application/x-ndjson')
+    response['Content-Disposition'] = 'attachment; filename="query-%s.%s"' % (table_id, format)
+    patch_cache_control(response, public=True, max_age=60)
+    return response
@@ -0,0 +1,45 @@
+from wagtail.core import hooks
+from wagtail.core.models import Page
+
+from home import page_cache
+from home.rich_text import DocumentLinkHandler, ImageEmbedHandler, PageLinkHandler
+from project import export, metrics
+
+
+## Rich text handlers using the objects prefetched for the block cache (see home/block_cache.py),
+## registered after Wagtail's ones to replace them
+
+@hooks.register('register_rich_text_features', order=100)
+def register_prefetched_handlers(features):
+    features.register_link_type(PageLinkHandler)
+    features.register_link_type(DocumentLinkHandler)
+    features.register_embed_type(ImageEmbedHandler)
+
+
+## Requests serving a page are labelled with its model in the metrics
+
+@hooks.register('before_serve_page')
+def label_page_metrics(page, request, serve_args, serve_kwargs):
+    metrics.set_page_type(request, page)
+
+
+## Moved pages: Wagtail 2.5 has no signal for moves. The URLs of the page
+## and its descendants change, the listings of both parents change, and the
+## mirrors get them again (see project/export.py).
+
+@hooks.register('before_move_page')
+def remember_moved_page(request, page, destination):
+    if request.method == 'POST':
+        request.moved_page_ids = [p.pk for p in page_cache.affected_pages(page)]
+        request.moved_page_urls = page_cache.get_cached_urls(
+            page_cache.affected_pages(page)[1:] + list(page.get_descendants(inclusive=True).live())
+        )
+
+
+@hooks.register('after_move_page')
+def invalidate_moved_page(request, page):
+    page = Page.objects.get(pk=page.pk).specific
+    pages = page_cache.affected_pages(page)
+    page_cache.bump_generations(set(getattr(request, 'moved_page_ids', [])) | {p.pk for p in pages})
+    page_cache.purge_urls(getattr(request, 'moved_page_urls', []) + page_cache.get_cached_urls(pages))
+    export.remember_changed_pages(page.get_descendants(inclusive=True).live().values_list('pk', flat=True))
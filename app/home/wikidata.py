@@ -0,0 +1,309 @@
+'''
+Wikidata entities rendered by ItemPages.
+
+Entities are fetched with the wbgetentities API, 50 ids per call, together
+with the labels of the properties and items they reference, and the intro of
+their Wikipedia article. The result is stored in WikidataEntity, so that
+rendering an ItemPage takes one local read when the entity is known:
+- unknown entities are fetched during the request
+- entities older than WIKIDATA_ENTITY_TTL are served as they are and
+  refreshed in a background thread, one refresh at a time per entity
+- a refresh first compares revision ids, so unchanged entities are not
+  downloaded again
+'''
+
+import json
+import logging
+import re
+from datetime import timedelta
+from urllib.error import URLError
+from urllib.parse import urlencode, quote
+from urllib.request import Request, urlopen
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from project import db
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 50
+
+ENTITY_ID = re.compile(r'^[QP][1-9][0-9]*$')
+
+
+class WikidataError(Exception):
+    pass
+
+
+def is_entity_id(value):
+    return bool(value) and bool(ENTITY_ID.match(value))
+
+
+def is_item_id(value):
+    ''' Qids of items, not Pids of properties '''
+    return is_entity_id(value) and value.startswith('Q')
+
+
+def entity_url(entity_id):
+    return 'https://www.wikidata.org/wiki/%s%s' % ('Property:' if entity_id.startswith('P') else '', entity_id)
+
+
+def batches(ids, size=BATCH_SIZE):
+    ids = list(ids)
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+
+## API
+
+def get_json(url, params):
+    request = Request(
+        url + '?' + urlencode(params),
+        headers={'User-Agent': settings.WIKIDATA_USER_AGENT},
+    )
+    try:
+        with urlopen(request, timeout=settings.WIKIDATA_API_TIMEOUT) as response:
+            data = json.loads(response.read().decode('utf-8'))
+    except (URLError, OSError, ValueError) as e:
+        raise WikidataError(str(e))
+    if 'error' in data:
+        raise WikidataError(data['error'].get('info', data['error']))
+    return data
+
+
+def get_entities(ids, props):
+    '''
+    Raw wbgetentities results for any number of ids, by batches of 50.
+    Missing entities are left out.
+    '''
+    entities = {}
+    for batch in batches(ids):
+        data = get_json(settings.WIKIDATA_API_ENDPOINT, {
+            'action': 'wbgetentities',
+            'ids': '|'.join(batch),
+            'props': props,
+            'languages': settings.WIKIDATA_LANGUAGE,
+            'languagefallback': 1,
+            'format': 'json',
+            'maxlag': 5,
+        })
+        for entity_id, entity in data.get('entities', {}).items():
+            if 'missing' not in entity:
+                entities[entity_id] = entity
+    return entities
+
+
+def get_labels(ids):
+    labels = {}
+    for entity_id, entity in get_entities(ids, 'labels').items():
+        labels[entity_id] = get_text(entity.get('labels'), entity_id)
+    return labels
+
+
+def get_revisions(ids):
+    return {
+        entity_id: entity.get('lastrevid', 0)
+        for entity_id, entity in get_entities(ids, 'info').items()
+    }
+
+
+def get_wikipedia_intro(title):
+    ''' Plain text intro of a Wikipedia article '''
+    data = get_json('https://%s.wikipedia.org/w/api.php' % settings.WIKIDATA_LANGUAGE, {
+        'action': 'query',
+        'prop': 'extracts',
+        'exintro': 1,
+        'explaintext': 1,
+        'redirects': 1,
+        'titles': title,
+        'format': 'json',
+    })
+    for page in data.get('query', {}).get('pages', {}).values():
+        return page.get('extract', '')
+    return ''
+
+
+## Parsing
+
+def get_text(values, default=''):
+    ''' The text of a labels / descriptions dict, in the site language '''
+    value = (values or {}).get(settings.WIKIDATA_LANGUAGE)
+    return value['value'] if value else default
+
+
+def parse_value(snak, references):
+    '''
+    A snak value as a dict with a "type" and a display "value".
+    Referenced entity ids are added to references, to fetch their labels.
+    '''
+    if snak.get('snaktype') != 'value':
+        return {'type': 'text', 'value': 'unknown' if snak.get('snaktype') == 'somevalue' else 'none'}
+
+    datavalue = snak['datavalue']
+    value = datavalue['value']
+    kind = datavalue['type']
+
+    if kind == 'wikibase-entityid':
+        entity_id = value.get('id') or 'Q%d' % value['numeric-id']
+        references.add(entity_id)
+        return {'type': 'entity', 'id': entity_id, 'value': entity_id}
+    if kind == 'time':
+        # Precision 9 is a year, 10 a month, 11 a day
+        time = value['time'].lstrip('+')
+        length = {9: 4, 10: 7}.get(value.get('precision'), 10)
+        return {'type': 'text', 'value': time[:length]}
+    if kind == 'quantity':
+        amount = value['amount'].lstrip('+')
+        unit = value.get('unit', '1').rsplit('/', 1)[-1]
+        if is_entity_id(unit):
+            references.add(unit)
+            return {'type': 'quantity', 'value': amount, 'unit': unit}
+        return {'type': 'text', 'value': amount}
+    if kind == 'monolingualtext':
+        return {'type': 'text', 'value': value['text']}
+    if kind == 'globecoordinate':
+        return {'type': 'text', 'value': '%s, %s' % (value['latitude'], value['longitude'])}
+    if snak.get('datatype') == 'url':
+        return {'type': 'url', 'value': value}
+    return {'type': 'text', 'value': str(value)}
+
+
+def parse_claims(claims, references):
+    '''
+    Statements as a list of properties, keeping the Wikidata order:
+    [{'property': 'P31', 'values': [{..., 'qualifiers': [{'property': .., 'values': [..]}]}]}]
+    Deprecated statements are left out.
+    '''
+    properties = []
+    for property_id, statements in claims.items():
+        references.add(property_id)
+        values = []
+        for statement in statements:
+            if statement.get('rank') == 'deprecated':
+                continue
+            value = parse_value(statement['mainsnak'], references)
+            value['qualifiers'] = []
+            for qualifier_id in statement.get('qualifiers-order', []):
+                references.add(qualifier_id)
+                value['qualifiers'].append({
+                    'property': qualifier_id,
+                    'values': [parse_value(snak, references) for snak in statement['qualifiers'][qualifier_id]],
+                })
+            values.append(value)
+        if values:
+            properties.append({'property': property_id, 'values': values})
+    return properties
+
+
+def parse_entity(entity):
+    ''' The fields of a WikidataEntity, from a wbgetentities result '''
+    references = set()
+    claims = parse_claims(entity.get('claims', {}), references)
+    references.discard(entity['id'])
+
+    sitelink = entity.get('sitelinks', {}).get('%swiki' % settings.WIKIDATA_LANGUAGE)
+    wikipedia = None
+    if sitelink:
+        wikipedia = {
+            'title': sitelink['title'],
+            'url': 'https://%s.wikipedia.org/wiki/%s' % (settings.WIKIDATA_LANGUAGE, quote(sitelink['title'].replace(' ', '_'))),
+        }
+
+    return {
+        'revision_id': entity.get('lastrevid', 0),
+        'label': get_text(entity.get('labels'), entity['id'])[:255],
+        'description': get_text(entity.get('descriptions')),
+        'aliases': [alias['value'][:255] for alias in entity.get('aliases', {}).get(settings.WIKIDATA_LANGUAGE, [])],
+        'data': {
+            'claims': claims,
+            'wikipedia': wikipedia,
+        },
+        'references': references,
+    }
+
+
+## Store
+
+def refresh_entities(ids, check_revisions=True):
+    '''
+    Fetch entities and save them in the store. Returns the saved entities.
+    With check_revisions, the ones whose revision did not change are only
+    marked as fetched now.
+    '''
+    from home.models import WikidataEntity
+
+    ids = [entity_id for entity_id in set(ids) if is_entity_id(entity_id)]
+    now = timezone.now()
+
+    if check_revisions:
+        stored = dict(WikidataEntity.objects.filter(pk__in=ids).values_list('pk', 'revision_id'))
+        revisions = get_revisions(stored) if stored else {}
+        unchanged = [entity_id for entity_id, revision_id in revisions.items() if revision_id == stored[entity_id]]
+        WikidataEntity.objects.filter(pk__in=unchanged).update(fetched_at=now)
+        ids = [entity_id for entity_id in ids if entity_id not in unchanged]
+
+    parsed = {
+        entity_id: parse_entity(entity)
+        for entity_id, entity in get_entities(ids, 'info|labels|descriptions|aliases|claims|sitelinks').items()
+    }
+
+    # Labels of all the referenced properties and items, in batches of 50
+    labels = get_labels(set().union(*[fields['references'] for fields in parsed.values()]))
+
+    saved = []
+    for entity_id, fields in parsed.items():
+        references = fields.pop('references')
+        fields['data']['labels'] = {ref: labels[ref] for ref in references if ref in labels}
+        wikipedia = fields['data']['wikipedia']
+        if wikipedia:
+            try:
+                wikipedia['intro'] = get_wikipedia_intro(wikipedia['title'])
+            except WikidataError as e:
+                logger.warning('Wikipedia intro of %s not available: %s', entity_id, e)
+                wikipedia['intro'] = ''
+        fields['fetched_at'] = now
+        entity, created = WikidataEntity.objects.update_or_create(entity_id=entity_id, defaults=fields)
+        saved.append(entity)
+    return saved
+
+
+def _refresh_in_background(entity_id):
+    lock_key = 'wdentity-refresh:%s' % entity_id
+    if not cache.add(lock_key, 1, settings.WIKIDATA_API_TIMEOUT * 4):
+        return
+
+    def refresh():
+        try:
+            refresh_entities([entity_id])
+        except WikidataError as e:
+            logger.warning('Refresh of %s failed: %s', entity_id, e)
+        finally:
+            cache.delete(lock_key)
+
+    db.run_in_background(refresh)
+
+
+def get_entity(entity_id):
+    '''
+    The stored entity, fetched first if it is unknown.
+    Returns None if it does not exist or Wikidata is not reachable.
+    '''
+    from home.models import WikidataEntity
+
+    if not is_entity_id(entity_id):
+        return None
+
+    entity = WikidataEntity.objects.filter(pk=entity_id).first()
+    if entity is None:
+        try:
+            entities = refresh_entities([entity_id], check_revisions=False)
+        except WikidataError as e:
+            logger.warning('Fetch of %s failed: %s', entity_id, e)
+            return None
+        return entities[0] if entities else None
+
+    if entity.fetched_at < timezone.now() - timedelta(seconds=settings.WIKIDATA_ENTITY_TTL):
+        _refresh_in_background(entity_id)
+    return entity
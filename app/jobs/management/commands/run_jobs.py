@@ -0,0 +1,31 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from jobs.queue import claim, run
+
+
+class Command(BaseCommand):
+    help = 'Run the queued jobs, waiting for new ones unless --once is given.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true', dest='once',
+            help="Exit when there are no pending jobs left")
+
+    def handle(self, **options):
+        while True:
+            job = claim()
+            if job is None:
+                if options['once']:
+                    break
+                # Do not keep a connection open while idle
+                close_old_connections()
+                time.sleep(settings.JOBS_POLL_INTERVAL)
+                continue
+
+            start = time.time()
+            run(job)
+            self.stdout.write('%s %s: %s in %.1fs' % (job.kind, job.key, job.status, time.time() - start))
@@ -0,0 +1,58 @@
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+
+def next_run(minute, hour, now):
+    ''' Next time after now matching minute and hour, hour None meaning every hour '''
+    run = now.replace(minute=minute, second=0, microsecond=0)
+    if hour is None:
+        return run if run > now else run + timedelta(hours=1)
+    run = run.replace(hour=hour)
+    return run if run > now else run + timedelta(days=1)
+
+
+class Command(BaseCommand):
+    help = 'Run the commands of settings.SCHEDULE at their time, in this process, instead of cron.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--list', action='store_true', dest='list',
+            help="Print the next run of each command and exit")
+
+    def handle(self, **options):
+        now = datetime.now()
+        runs = [
+            [next_run(minute, hour, now), minute, hour, command, arguments]
+            for minute, hour, command, arguments in settings.SCHEDULE
+        ]
+        for run in sorted(runs):
+            self.stdout.write('%s: %s %s' % (run[0].strftime('%Y-%m-%d %H:%M'), run[3], ' '.join(run[4])))
+        if options['list']:
+            return
+
+        while True:
+            run = min(runs)
+            delay = (run[0] - datetime.now()).total_seconds()
+            if delay > 0:
+                # Do not keep a connection open while waiting
+                close_old_connections()
+                time.sleep(min(delay, 60))
+                continue
+
+            when, minute, hour, command, arguments = run
+            start = time.time()
+            try:
+                call_command(command, *arguments)
+                self.stdout.write('%s %s done in %.1fs' % (command, ' '.join(arguments), time.time() - start))
+            except Exception:
+                self.stderr.write('%s %s failed after %.1fs\n%s' % (
+                    command, ' '.join(arguments), time.time() - start, traceback.format_exc()
+                ))
+            # A late run is not repeated for the times missed meanwhile
+            run[0] = next_run(minute, hour, datetime.now())
@@ -0,0 +1,24 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0001_initial'),
+    ]
+
+    operations = [
+        # Jobs are not only about Wikidata items: image renditions are keyed by image id
+        migrations.RenameField(
+            model_name='job',
+            old_name='qid',
+            new_name='key',
+        ),
+        migrations.AlterField(
+            model_name='job',
+            name='key',
+            field=models.CharField(max_length=64),
+        ),
+    ]
@@ -0,0 +1,53 @@
+from django.contrib.postgres.fields import JSONField
+from django.db import models
+from django.utils import timezone
+
+
+class Job(models.Model):
+
+    '''
+    A slow computation run by a worker (see jobs.queue), about the object
+    identified by key: the Qid of a Wikidata item for the jobs of ItemPages,
+    the id of an image for its renditions.
+    There is one job per (kind, key): asking again for a job returns the
+    existing one, and its result is kept to answer the next requests.
+    '''
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    kind = models.CharField(max_length=64)
+    key = models.CharField(max_length=64)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    result = JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    queued_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('kind', 'key')
+        indexes = [
+            models.Index(fields=['status', 'queued_at']),
+        ]
+
+    def __str__(self):
+        return '%s %s (%s)' % (self.kind, self.key, self.status)
+
+    def as_json(self):
+        return {
+            'kind': self.kind,
+            'key': self.key,
+            'status': self.status,
+            'result': self.result,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
@@ -0,0 +1,169 @@
+'''
+Queue of slow jobs, stored in the database.
+
+Some parts of an ItemPage take longer than a request should (the scholarly
+articles, the nearby items). The page asks for them with the job_status view
+and polls it until the result is there, while a worker runs the job:
+- a job kind is a function of a key (a Qid, an image id) returning JSON,
+  registered with @register('kind') in the tasks.py module of an app. Only
+  the kinds registered with public=True, about Wikidata items, can be asked
+  for by the job_status view
+- jobs are unique per (kind, key), so a job asked by many visitors runs once
+- results are kept for JOBS_RESULT_TTL seconds, failures for JOBS_ERROR_TTL;
+  then asking for the job queues it again, the old result is still served
+  meanwhile
+- workers claim jobs with SELECT ... FOR UPDATE SKIP LOCKED, so several of
+  them can run at once
+
+JOBS_QUEUE selects who runs the jobs:
+- 'worker': the run_jobs management command, in its own container
+- 'thread': a background thread of the web process, to run without a worker
+'''
+
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+_public = set()
+_drain_lock = threading.Lock()
+
+
+def register(kind, public=False):
+    '''
+    Decorator registering a job function: function(key) -> JSON serializable result.
+    The public ones take a Qid, and can be queued by anonymous visitors.
+    '''
+    def decorator(function):
+        _registry[kind] = function
+        if public:
+            _public.add(kind)
+        return function
+    return decorator
+
+
+def is_public(kind):
+    return kind in _public
+
+
+## Queue
+
+def is_expired(job, now):
+    if job.status == job.DONE:
+        return job.finished_at < now - timedelta(seconds=settings.JOBS_RESULT_TTL)
+    if job.status == job.FAILED:
+        return job.finished_at < now - timedelta(seconds=settings.JOBS_ERROR_TTL)
+    return False
+
+
+def enqueue(kind, key, again=False):
+    '''
+    The job of this kind for this key, queued if it does not exist yet or
+    if its result expired. With again=True, a finished job is queued again
+    even if its result is still valid: its input changed.
+    '''
+    from jobs.models import Job
+
+    job, created = Job.objects.get_or_create(kind=kind, key=key)
+    now = timezone.now()
+    if not created and (is_expired(job, now) or (again and job.status in (Job.DONE, Job.FAILED))):
+        # Only one of the concurrent requests queues it again
+        requeued = Job.objects.filter(pk=job.pk, status=job.status, finished_at=job.finished_at).update(
+            status=Job.PENDING, attempts=0, queued_at=now
+        )
+        if requeued:
+            job.status = Job.PENDING
+
+    if job.status == Job.PENDING and settings.JOBS_QUEUE == 'thread':
+        _drain_in_background()
+    return job
+
+
+def claim():
+    '''
+    Mark the oldest pending job as running and return it, or None.
+    Running jobs older than JOBS_TIMEOUT are from a dead worker and claimed again.
+    '''
+    from jobs.models import Job
+
+    now = timezone.now()
+    abandoned = now - timedelta(seconds=settings.JOBS_TIMEOUT)
+    with transaction.atomic():
+        job = (
+            Job.objects
+            .select_for_update(skip_locked=True)
+            .filter(Q(status=Job.PENDING, queued_at__lte=now) | Q(status=Job.RUNNING, started_at__lt=abandoned))
+            .order_by('queued_at')
+            .first()
+        )
+        if job is None:
+            return None
+        # The status check makes claims safe on databases without row locks too
+        claimed = Job.objects.filter(pk=job.pk, status=job.status, started_at=job.started_at).update(
+            status=Job.RUNNING, started_at=now, attempts=job.attempts + 1
+        )
+    if not claimed:
+        return claim()
+    job.status = Job.RUNNING
+    job.started_at = now
+    job.attempts += 1
+    return job
+
+
+def run(job):
+    ''' Run a claimed job and store its result '''
+    from jobs.models import Job
+
+    function = _registry.get(job.kind)
+    try:
+        if function is None:
+            raise LookupError('Unknown job kind %s' % job.kind)
+        job.result = function(job.key)
+        job.status = Job.DONE
+        job.error = ''
+    except Exception as e:
+        logger.exception('Job %s failed', job)
+        job.error = str(e)
+        # Failed jobs keep their previous result, if any, and are retried later
+        if job.attempts < settings.JOBS_MAX_ATTEMPTS:
+            job.status = Job.PENDING
+            job.queued_at = timezone.now() + timedelta(seconds=settings.JOBS_RETRY_DELAY * job.attempts)
+        else:
+            job.status = Job.FAILED
+    job.finished_at = timezone.now()
+    job.save(update_fields=['result', 'status', 'error', 'queued_at', 'finished_at'])
+    return job
+
+
+def run_pending(limit=None):
+    ''' Run pending jobs until there are none left, or limit jobs were run '''
+    count = 0
+    while limit is None or count < limit:
+        job = claim()
+        if job is None:
+            break
+        run(job)
+        count += 1
+    return count
+
+
+def _drain_in_background():
+    ''' Run the pending jobs in a thread, one thread per process '''
+    if not _drain_lock.acquire(blocking=False):
+        return
+
+    def drain():
+        try:
+            run_pending()
+        finally:
+            _drain_lock.release()
+            connection.close()
+
+    threading.Thread(target=drain, daemon=True).start()
@@ -0,0 +1,38 @@
+from django.http import Http404, JsonResponse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import require_GET
+
+from home import item_routes
+from home.models import WikidataEntity
+from home.wikidata import is_entity_id
+from jobs.models import Job
+from jobs.queue import enqueue, is_public
+
+
+def is_known_item(qid):
+    '''
+    Items whose ItemPage was rendered (their entity is stored) or that have
+    an ItemPage of their own. Anonymous visitors cannot queue jobs about
+    any other Qid.
+    '''
+    return WikidataEntity.objects.filter(pk=qid).exists() or item_routes.get_item_page(qid) is not None
+
+
+@require_GET
+def job_status(request, kind, qid):
+    '''
+    State and result of a job, queued if needed.
+    Pages poll it until "status" is "done" or "failed".
+    '''
+    if not is_public(kind) or not is_entity_id(qid):
+        raise Http404
+    if not Job.objects.filter(kind=kind, key=qid).exists() and not is_known_item(qid):
+        raise Http404
+
+    job = enqueue(kind, qid)
+    response = JsonResponse(job.as_json())
+    if job.status == job.DONE:
+        patch_cache_control(response, public=True, max_age=60)
+    else:
+        patch_cache_control(response, no_cache=True, no_store=True)
+    return response
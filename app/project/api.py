@@ -1,8 +1,179 @@
+'''
+Wagtail API v2, with conditional GET and cached page payloads.
+
+The pages endpoint:
+- sends an ETag and a Last-Modified header, from the last_published_at and
+  the cache generation (see home/page_cache.py) of the returned pages
+- answers 304 Not Modified before serializing anything
+- caches the serialized payload of each page, per set of requested fields,
+  so listings only serialize the pages that changed. The generation of a page
+  is part of the key: publishing a page invalidates its payloads, and those
+  of the pages rendering it (its parent, the articles of a category)
+- loads the foreign keys and relations of the requested api_fields in bulk
+  for the pages it serializes
+'''
+
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from modelcluster.contrib.taggit import ClusterTaggableManager
+from modelcluster.fields import ParentalManyToManyField
+from rest_framework.response import Response
+
 from wagtail.api.v2.endpoints import PagesAPIEndpoint
 from wagtail.api.v2.router import WagtailAPIRouter
 from wagtail.images.api.v2.endpoints import ImagesAPIEndpoint
 from wagtail.documents.api.v2.endpoints import DocumentsAPIEndpoint
 
+from home import page_cache
+
+
+def get_related_fields(model, field_names):
+    '''
+    The requested fields of a model to load in bulk, as
+    (select_related names, prefetch_related names, ParentalManyToManyField names)
+    '''
+    select, prefetch, parental = [], [], []
+    for name in field_names:
+        try:
+            field = model._meta.get_field(name)
+        except models.FieldDoesNotExist:
+            continue
+        if isinstance(field, ClusterTaggableManager):
+            # Cluster tags are read from their tagged items, not from the tags relation
+            accessor = field.through._meta.get_field('content_object').remote_field.get_accessor_name()
+            prefetch.append('%s__tag' % accessor)
+        elif isinstance(field, ParentalManyToManyField):
+            parental.append(name)
+        elif field.many_to_one or field.one_to_one:
+            select.append(name)
+        elif field.many_to_many or field.one_to_many:
+            prefetch.append(name)
+    return select, prefetch, parental
+
+
+def prefetch_parental_m2m(pages, name):
+    '''
+    prefetch_related for a ParentalManyToManyField, which does not support it:
+    the related objects of all the pages are loaded in one query and stored
+    where the many to many manager looks for prefetched objects.
+    '''
+    field = type(pages[0])._meta.get_field(name)
+    source, target = field.m2m_field_name(), field.m2m_reverse_field_name()
+    links = field.remote_field.through.objects.filter(**{
+        '%s_id__in' % source: [page.pk for page in pages]
+    }).select_related(target)
+
+    related = {}
+    for link in links:
+        related.setdefault(getattr(link, '%s_id' % source), []).append(getattr(link, target))
+
+    for page in pages:
+        queryset = field.related_model._default_manager.all()
+        queryset._result_cache = related.get(page.pk, [])
+        queryset._prefetch_done = True
+        page.__dict__.setdefault('_prefetched_objects_cache', {})[name] = queryset
+
+
+class CachedPagesAPIEndpoint(PagesAPIEndpoint):
+
+    def payload_key(self, page, generation):
+        ''' Cache key of the payload of a page, for the current request '''
+        variant = '|'.join([
+            self.action,
+            self.request.get_host(),
+            self.request.GET.get('type', ''),
+            self.request.GET.get('fields', ''),
+            str(page.last_published_at),
+        ])
+        return 'api-page:%d:%d:%s' % (page.pk, generation, hashlib.md5(variant.encode('utf-8')).hexdigest())
+
+    def get_validators(self, pages, generations, extra=''):
+        ''' ETag and Last-Modified timestamp of a response returning these pages '''
+        etag = hashlib.md5('|'.join(
+            [self.request.get_full_path(), self.request.get_host(), self.request.accepted_renderer.format, extra]
+            + ['%d:%d:%s' % (page.pk, generations[page.pk], page.last_published_at) for page in pages]
+        ).encode('utf-8')).hexdigest()
+        published = [page.last_published_at for page in pages if page.last_published_at]
+        last_modified = int(max(published).timestamp()) if published else None
+        return '"%s"' % etag, last_modified
+
+    def conditional_response(self, etag, last_modified, build):
+        response = get_conditional_response(self.request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = build()
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified)
+        # Clients may keep the response but have to check it is still current
+        patch_cache_control(response, public=True, max_age=0, must_revalidate=True)
+        return response
+
+    def get_payloads(self, pages, generations, serialize):
+        '''
+        Payloads of pages from the cache, serializing the missing ones with
+        serialize(pages) -> list of payloads.
+        '''
+        keys = {page.pk: self.payload_key(page, generations[page.pk]) for page in pages}
+        cached = cache.get_many(keys.values())
+        missing = [page for page in pages if keys[page.pk] not in cached]
+        if missing:
+            payloads = dict(zip([keys[page.pk] for page in missing], serialize(missing)))
+            cache.set_many(payloads, settings.WAGTAILAPI_CACHE_TIMEOUT)
+            cached.update(payloads)
+        return [cached[keys[page.pk]] for page in pages]
+
+    def listing_view(self, request):
+        queryset = self.get_queryset()
+        self.check_query_parameters(queryset)
+        queryset = self.filter_queryset(queryset)
+        pages = list(self.paginate_queryset(queryset))
+
+        generations = page_cache.get_generations([page.pk for page in pages])
+        etag, last_modified = self.get_validators(pages, generations, extra=str(self.paginator.total_count))
+
+        def serialize(missing):
+            model = type(missing[0])
+            select, prefetch, parental = get_related_fields(model, self.get_fields_names(model))
+            objects = model.objects.filter(pk__in=[page.pk for page in missing])
+            objects = objects.select_related(*select).prefetch_related(*prefetch).in_bulk()
+            for name in parental:
+                prefetch_parental_m2m(list(objects.values()), name)
+            return self.get_serializer([objects[page.pk] for page in missing], many=True).data
+
+        return self.conditional_response(
+            etag, last_modified,
+            lambda: self.get_paginated_response(self.get_payloads(pages, generations, serialize)),
+        )
+
+    def detail_view(self, request, pk):
+        page = self.get_object()
+        generations = page_cache.get_generations([page.pk])
+        etag, last_modified = self.get_validators([page], generations)
+
+        def serialize(missing):
+            return [self.get_serializer(page).data]
+
+        return self.conditional_response(
+            etag, last_modified,
+            lambda: Response(self.get_payloads([page], generations, serialize)[0]),
+        )
+
+    def get_fields_names(self, model):
+        ''' Names of the fields asked with ?fields=, "*" being all the api_fields of the model '''
+        names = {
+            name.strip().lstrip('-').split('(')[0]
+            for name in self.request.GET.get('fields', '').split(',')
+        }
+        if '*' in names:
+            names |= {getattr(field, 'name', field) for field in getattr(model, 'api_fields', [])}
+        return names - {'', '*'}
+
+
 # Create the router. "wagtailapi" is the URL namespace
 api_router = WagtailAPIRouter('wagtailapi')
 
@@ -10,6 +181,6 @@ api_router = WagtailAPIRouter('wagtailapi')
 # The first parameter is the name of the endpoint (eg. pages, images). This
 # is used in the URL of the endpoint
 # The second parameter is the endpoint class that handles the requests
-api_router.register_endpoint('pages', PagesAPIEndpoint)
+api_router.register_endpoint('pages', CachedPagesAPIEndpoint)
 api_router.register_endpoint('images', ImagesAPIEndpoint)
-api_router.register_endpoint('documents', DocumentsAPIEndpoint)
\ No newline at end of file
+api_router.register_endpoint('documents', DocumentsAPIEndpoint)
@@ -0,0 +1,335 @@
+'''
+Backups of the database as compressed NDJSON, with a daily / weekly / monthly
+rotation configured in config/dj_backup.config.
+
+A backup is a directory named like "2019-06-01-monthly" with:
+- one <app_label>/<model_name>.ndjson.gz file per table, one JSON array of
+  column values per line, ordered by primary key
+- a manifest.json listing the files with their columns, row count and
+  content hash, written last: a directory without manifest is incomplete
+
+Tables are read in one read only REPEATABLE READ transaction, so the backup
+is a consistent snapshot of the database, with server-side cursors
+(QuerySet.iterator), and written uncompressed while hashing them. Behind
+pgbouncer, server-side cursors are disabled and iterator() would load whole
+tables in memory: backups use the "direct" database, Postgres itself. Tables whose hash did not change since the
+previous backup are hard linked from it, the others are compressed by a pool
+of processes while the next tables are read.
+
+restore() loads a backup, or some apps and models of it, from the manifest.
+'''
+
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from types import SimpleNamespace
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.color import no_style
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, connections, router, transaction, DEFAULT_DB_ALIAS
+from django.utils.encoding import is_protected_type
+
+MANIFEST = 'manifest.json'
+IN_PROGRESS = '.in_progress'
+
+DAILY = 'daily'
+WEEKLY = 'weekly'
+MONTHLY = 'monthly'
+
+## Tables left out of "safe" restores, they are filled by migrate
+SAFE_EXCLUDE = ['auth.permission', 'contenttypes.contenttype']
+
+BACKUP_NAME = re.compile(r'^(\d{4}-\d{2}-\d{2})-(daily|weekly|monthly)$')
+
+ITERATOR_CHUNK_SIZE = 2000
+RESTORE_BATCH_SIZE = 1000
+
+
+## Config
+
+def read_config(path=None):
+    ''' KEY=VALUE lines of the shell config file, as a dict '''
+    path = path or os.path.join(settings.BASE_DIR, 'config', 'dj_backup.config')
+    config = {}
+    with open(path) as config_file:
+        for line in config_file:
+            line = line.strip()
+            if line and not line.startswith('#') and '=' in line:
+                key, value = line.split('=', 1)
+                config[key.strip()] = value.strip().strip('"\'')
+    return config
+
+
+def backup_kind(config, today):
+    ''' The kind of backup to take today, as the cron job used to, or None '''
+    if today.day == 1:
+        return MONTHLY
+    if today.isoweekday() == int(config.get('DAY_OF_WEEK_TO_KEEP', 1)):
+        return WEEKLY
+    if config.get('ENABLE_DAILY_BACKUPS', 'yes') == 'yes':
+        return DAILY
+    return None
+
+
+## Backup
+
+def backup_database():
+    ''' Alias of the database backups read, bypassing pgbouncer '''
+    return 'direct' if 'direct' in settings.DATABASES else DEFAULT_DB_ALIAS
+
+
+def backup_models():
+    ''' Models with a table, including the automatic many to many tables '''
+    for model in apps.get_models(include_auto_created=True):
+        options = model._meta
+        if options.managed and not options.proxy and router.allow_migrate_model(DEFAULT_DB_ALIAS, model):
+            yield model
+
+
+def label(model):
+    return model._meta.label_lower
+
+
+def encode(field, value):
+    '''
+    A column value as JSON, like the Django serializers do: field types
+    without a JSON equivalent (StreamField, ArrayField...) become strings
+    that Field.to_python reads back.
+    '''
+    if isinstance(value, str) or is_protected_type(value):
+        return value
+    return field.value_to_string(SimpleNamespace(**{field.attname: value}))
+
+
+def dump_table(model, path, using=DEFAULT_DB_ALIAS):
+    '''
+    Write the rows of a table in a NDJSON file.
+    Only the columns of the table itself are written: the parent tables of
+    multi-table inheritance and the many to many tables are dumped on their own.
+    Returns (columns, row count, sha256 of the file).
+    '''
+    fields = model._meta.local_concrete_fields
+    columns = [field.attname for field in fields]
+    rows = model._base_manager.using(using).order_by('pk').values_list(*columns).iterator(chunk_size=ITERATOR_CHUNK_SIZE)
+
+    digest = hashlib.sha256()
+    count = 0
+    with open(path, 'wb') as output:
+        for row in rows:
+            row = [encode(field, value) for field, value in zip(fields, row)]
+            line = (json.dumps(row, cls=DjangoJSONEncoder, separators=(',', ':')) + '\n').encode('utf-8')
+            digest.update(line)
+            output.write(line)
+            count += 1
+    return columns, count, digest.hexdigest()
+
+
+def compress(path):
+    ''' Gzip a file next to itself and remove it. Run in the process pool. '''
+    with open(path, 'rb') as source, gzip.open(path + '.gz', 'wb', compresslevel=6) as target:
+        shutil.copyfileobj(source, target, 1024 * 1024)
+    os.remove(path)
+    return os.path.getsize(path + '.gz')
+
+
+def link_or_copy(source, target):
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def list_backups(backup_dir):
+    ''' Complete backups as (date, kind, path), the most recent first '''
+    backups = []
+    for name in os.listdir(backup_dir) if os.path.isdir(backup_dir) else []:
+        match = BACKUP_NAME.match(name)
+        path = os.path.join(backup_dir, name)
+        if match and os.path.exists(os.path.join(path, MANIFEST)):
+            backups.append((datetime.strptime(match.group(1), '%Y-%m-%d').date(), match.group(2), path))
+    return sorted(backups, reverse=True)
+
+
+def read_manifest(path):
+    with open(os.path.join(path, MANIFEST)) as manifest:
+        return json.load(manifest)
+
+
+def backup(backup_dir, kind, today=None, workers=None, log=print):
+    '''
+    Back up every table in a new directory of backup_dir.
+    Returns the path of the backup.
+    '''
+    today = today or date.today()
+    name = '%s-%s' % (today.isoformat(), kind)
+    path = os.path.join(backup_dir, name)
+    temporary = path + IN_PROGRESS
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.makedirs(temporary)
+
+    # Unchanged tables are linked from the most recent backup
+    previous_path, previous = None, {}
+    backups = [b for b in list_backups(backup_dir) if b[2] != path]
+    if backups:
+        previous_path = backups[0][2]
+        previous = {table['model']: table for table in read_manifest(previous_path)['tables']}
+
+    using = backup_database()
+    tables = []
+    compressions = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        with transaction.atomic(using=using):
+            if connections[using].vendor == 'postgresql':
+                # Every table as of the first query
+                with connections[using].cursor() as cursor:
+                    cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+
+            for model in backup_models():
+                options = model._meta
+                file_name = os.path.join(options.app_label, '%s.ndjson.gz' % options.model_name)
+                os.makedirs(os.path.join(temporary, options.app_label), exist_ok=True)
+                ndjson = os.path.join(temporary, file_name[:-len('.gz')])
+
+                columns, rows, sha256 = dump_table(model, ndjson, using)
+                table = {
+                    'model': label(model),
+                    'file': file_name,
+                    'columns': columns,
+                    'rows': rows,
+                    'sha256': sha256,
+                }
+                old = previous.get(label(model))
+                if old and old['sha256'] == sha256 and old['columns'] == columns:
+                    os.remove(ndjson)
+                    link_or_copy(os.path.join(previous_path, old['file']), os.path.join(temporary, file_name))
+                    table['bytes'] = old['bytes']
+                    table['reused'] = True
+                else:
+                    compressions.append((table, pool.submit(compress, ndjson)))
+                    table['reused'] = False
+                tables.append(table)
+
+        for table, compression in compressions:
+            table['bytes'] = compression.result()
+
+    with open(os.path.join(temporary, MANIFEST), 'w') as manifest:
+        json.dump({
+            'created_at': datetime.now().isoformat(),
+            'kind': kind,
+            'vendor': connections[using].vendor,
+            'tables': tables,
+        }, manifest, indent=1)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.rename(temporary, path)
+    log('%s: %d tables, %d rows, %d reused' % (
+        name, len(tables), sum(t['rows'] for t in tables), sum(t['reused'] for t in tables)
+    ))
+    return path
+
+
+def rotate(backup_dir, config, today=None, log=print):
+    '''
+    Delete the expired backups:
+    - daily ones older than DAYS_TO_KEEP days
+    - weekly ones older than WEEKS_TO_KEEP weeks
+    - monthly ones beyond the MONTHS_TO_KEEP most recent
+    '''
+    today = today or date.today()
+    days_to_keep = {
+        DAILY: int(config.get('DAYS_TO_KEEP', 7)),
+        WEEKLY: int(config.get('WEEKS_TO_KEEP', 10)) * 7,
+    }
+    months_to_keep = int(config.get('MONTHS_TO_KEEP', 1))
+
+    monthly = 0
+    for backup_date, kind, path in list_backups(backup_dir):
+        if kind == MONTHLY:
+            monthly += 1
+            expired = monthly > months_to_keep
+        else:
+            expired = (today - backup_date).days > days_to_keep[kind]
+        if expired:
+            log('Deleting %s' % os.path.basename(path))
+            shutil.rmtree(path)
+
+
+## Restore
+
+def select_tables(tables, only=None, exclude=None):
+    ''' Tables of a manifest matching "app_label" or "app_label.model_name" patterns '''
+    def matches(table, patterns):
+        return any(table['model'] == p or table['model'].split('.')[0] == p for p in patterns)
+
+    return [
+        table for table in tables
+        if (not only or matches(table, only)) and not (exclude and matches(table, exclude))
+    ]
+
+
+def read_rows(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as rows:
+        for line in rows:
+            yield json.loads(line)
+
+
+def restore_table(model, path, columns):
+    '''
+    Load a table file into its emptied table. Rows are inserted in batches,
+    or one by one for multi-table inheritance, which bulk_create does not support.
+    '''
+    fields = {field.attname: field for field in model._meta.local_concrete_fields}
+    fields = [fields[column] for column in columns]
+    bulk = not model._meta.parents
+
+    batch = []
+    count = 0
+    for row in read_rows(path):
+        instance = model(**{
+            field.attname: field.to_python(value) if value is not None else None
+            for field, value in zip(fields, row)
+        })
+        count += 1
+        if bulk:
+            batch.append(instance)
+            if len(batch) >= RESTORE_BATCH_SIZE:
+                model._base_manager.bulk_create(batch)
+                batch = []
+        else:
+            # raw saves only write the table of the model, not its parents
+            instance.save_base(raw=True, force_insert=True)
+    if batch:
+        model._base_manager.bulk_create(batch)
+    return count
+
+
+def restore(path, only=None, exclude=None, log=print):
+    '''
+    Replace the content of the selected tables with the backup, in one
+    transaction. Foreign keys are checked at the end, so tables can be
+    emptied and loaded in any order.
+    '''
+    tables = select_tables(read_manifest(path)['tables'], only, exclude)
+    models = [apps.get_model(table['model']) for table in tables]
+    with transaction.atomic():
+        with connection.constraint_checks_disabled():
+            with connection.cursor() as cursor:
+                for model in models:
+                    cursor.execute('DELETE FROM %s' % connection.ops.quote_name(model._meta.db_table))
+            for model, table in zip(models, tables):
+                count = restore_table(model, os.path.join(path, table['file']), table['columns'])
+                log('%s: %d rows' % (table['model'], count))
+        connection.check_constraints(table_names=[model._meta.db_table for model in models])
+
+        # New rows must not reuse the restored ids
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), models):
+                cursor.execute(sql)
+    return models
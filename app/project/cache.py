@@ -0,0 +1,93 @@
+'''
+Redis cache backend that falls back to local memory when Redis is down.
+
+django-redis either raises or silently misses when the server is not
+reachable. Here the calls are sent to a per-process LocMemCache instead,
+and Redis is retried after RETRY_AFTER seconds, so a Redis outage degrades
+to the previous per-worker caching instead of breaking pages.
+
+Reads are counted in the metrics of the request (see project/metrics.py).
+'''
+
+import logging
+import socket
+import time
+
+from django.core.cache.backends.locmem import LocMemCache
+from django_redis.cache import RedisCache
+from redis.exceptions import ConnectionError, TimeoutError
+
+from project.metrics import record_cache
+
+logger = logging.getLogger(__name__)
+
+REDIS_ERRORS = (ConnectionError, TimeoutError, socket.timeout)
+
+
+class FallbackRedisCache(RedisCache):
+
+    def __init__(self, server, params):
+        super().__init__(server, params)
+        options = params.get('OPTIONS', {})
+        self._retry_after = options.get('RETRY_AFTER', 30)
+        self._down_until = 0
+        self._fallback = LocMemCache('fallback-%s' % server, {
+            'TIMEOUT': params.get('TIMEOUT', 300),
+            'KEY_PREFIX': params.get('KEY_PREFIX', ''),
+            'VERSION': params.get('VERSION', 1),
+        })
+
+    def _call(self, name, *args, **kwargs):
+        if time.time() >= self._down_until:
+            try:
+                return getattr(super(), name)(*args, **kwargs)
+            except REDIS_ERRORS as e:
+                logger.warning('Redis unavailable, using local memory cache for %ss: %s', self._retry_after, e)
+                self._down_until = time.time() + self._retry_after
+        return getattr(self._fallback, name)(*args, **kwargs)
+
+    @property
+    def is_down(self):
+        return time.time() < self._down_until
+
+    def get(self, key, default=None, *args, **kwargs):
+        value = self._call('get', key, default, *args, **kwargs)
+        record_cache(hits=int(value is not default), misses=int(value is default))
+        return value
+
+    def set(self, *args, **kwargs):
+        return self._call('set', *args, **kwargs)
+
+    def add(self, *args, **kwargs):
+        return self._call('add', *args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self._call('delete', *args, **kwargs)
+
+    def get_many(self, keys, *args, **kwargs):
+        keys = list(keys)
+        values = self._call('get_many', keys, *args, **kwargs)
+        record_cache(hits=len(values), misses=len(keys) - len(values))
+        return values
+
+    def set_many(self, *args, **kwargs):
+        return self._call('set_many', *args, **kwargs)
+
+    def delete_many(self, *args, **kwargs):
+        return self._call('delete_many', *args, **kwargs)
+
+    def has_key(self, *args, **kwargs):
+        return self._call('has_key', *args, **kwargs)
+
+    def incr(self, *args, **kwargs):
+        return self._call('incr', *args, **kwargs)
+
+    def decr(self, *args, **kwargs):
+        return self._call('decr', *args, **kwargs)
+
+    def touch(self, *args, **kwargs):
+        return self._call('touch', *args, **kwargs)
+
+    def clear(self):
+        self._fallback.clear()
+        return self._call('clear')
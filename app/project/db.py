@@ -0,0 +1,127 @@
+'''
+Persistent database connections and their budget.
+
+Connections are kept by each uWSGI thread for CONN_MAX_AGE seconds instead
+of being opened for every request (see DATABASES in the settings). A kept
+connection may have been closed by Postgres, pgbouncer or the network
+meanwhile, so with DATABASE_HEALTH_CHECKS, ConnectionCheckMiddleware checks
+it at the start of each request and replaces it if it is not usable, before
+the view gets an error.
+
+Every thread of every process holds its own connection, plus the
+background threads of the process using the database (see
+get_background_threads). get_connection_budget() counts them from the uWSGI
+config and the settings, so that start.sh can refuse to start more workers
+than Postgres accepts connections (check_connection_budget command).
+'''
+
+import configparser
+import os
+import threading
+
+from django.conf import settings
+from django.db import connection, connections
+
+## Threads started on demand by run_in_background using the database at once, per process
+ON_DEMAND_THREADS = 2
+
+## Processes with one connection outside of uWSGI: the worker and the scheduler
+OTHER_PROCESSES = 2
+
+_on_demand = threading.BoundedSemaphore(ON_DEMAND_THREADS)
+
+
+## Health checks
+
+def check_connections():
+    ''' Close the persistent connections which are no longer usable '''
+    for conn in connections.all():
+        if conn.connection is not None and not conn.in_atomic_block and not conn.is_usable():
+            conn.close()
+
+
+class ConnectionCheckMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        check_connections()
+        return self.get_response(request)
+
+
+## Background threads
+
+def run_in_background(function):
+    '''
+    Run a function in a thread with its own connection, closed at the end.
+    At most ON_DEMAND_THREADS of them run at once in a process, the others
+    wait for their turn, so they fit in the connection budget.
+    '''
+    def run():
+        with _on_demand:
+            try:
+                function()
+            finally:
+                connection.close()
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def get_background_threads():
+    '''
+    Threads of a web process with their own connection, besides the uWSGI threads:
+    - the search index worker, with SEARCH_INDEX_QUEUE = 'thread' (search/indexing.py)
+    - the search hits flusher, with SEARCH_HITS_FLUSH_INTERVAL (search/hits.py)
+    - the drain of the job queue, with JOBS_QUEUE = 'thread' (jobs/queue.py)
+    - the ON_DEMAND_THREADS of run_in_background: refreshes of Wikidata
+      entities and builds of class tables
+    The threads of the metrics, of the profiler, of the SPARQL results and of
+    the frontend cache only use Redis or HTTP.
+    '''
+    return sum([
+        settings.SEARCH_INDEX_QUEUE == 'thread',
+        settings.SEARCH_HITS_FLUSH_INTERVAL > 0,
+        settings.JOBS_QUEUE == 'thread',
+    ]) + ON_DEMAND_THREADS
+
+
+## Budget
+
+def read_uwsgi_option(value, cpu_count):
+    ''' A number of the uWSGI config, like "%(%k * 2)": products of numbers and %k, the number of CPUs '''
+    value = value.strip()
+    if value.startswith('%(') and value.endswith(')'):
+        value = value[2:-1]
+    product = 1
+    for factor in value.replace('%k', str(cpu_count)).split('*'):
+        product *= int(factor)
+    return product
+
+
+def get_connection_budget(uwsgi_ini=None, cpu_count=None):
+    '''
+    Connections the app may open at once, as a dict with the number of
+    processes, threads per process and the total.
+    '''
+    uwsgi_ini = uwsgi_ini or os.path.join(settings.BASE_DIR, 'config', 'django-uwsgi.ini')
+    cpu_count = cpu_count or os.cpu_count()
+    config = configparser.ConfigParser(interpolation=None, strict=False)
+    config.read(uwsgi_ini)
+    processes = read_uwsgi_option(config.get('uwsgi', 'processes', fallback='1'), cpu_count)
+    threads = read_uwsgi_option(config.get('uwsgi', 'threads', fallback='1'), cpu_count)
+    return {
+        'processes': processes,
+        'threads': threads,
+        'total': processes * (threads + get_background_threads()) + OTHER_PROCESSES,
+    }
+
+
+def get_max_connections(connection):
+    ''' Connections Postgres accepts from non superusers '''
+    with connection.cursor() as cursor:
+        cursor.execute('SHOW max_connections')
+        max_connections = int(cursor.fetchone()[0])
+        cursor.execute('SHOW superuser_reserved_connections')
+        reserved = int(cursor.fetchone()[0])
+    return max_connections - reserved
@@ -0,0 +1,229 @@
+'''
+Bulk export of pages as NDJSON, one page per line, for mirrors of the site.
+
+/api/export/?type=home.ArticlePage,home.ItemPage&since=2019-06-01T00:00:00Z
+
+The export walks the page tree in path order by keyset batches
+("path > last path" queries), so it never uses OFFSET and only one batch is
+in memory at a time, whatever the number of pages. The pages of a batch are
+loaded with their specific fields and relations in a constant number of
+queries, and the response is streamed while the next batches are read.
+
+- since: only the pages published since this ISO 8601 timestamp, or moved
+  or made public again since then (see home.models.ChangedPage). The
+  X-Export-Started-At header of a response is the "since" of the next sync.
+  The pages unpublished, deleted or made private since then come first, as
+  {"id": .., "removed": true, ...} lines (see home.models.RemovedPage).
+- after: a page path, to resume an interrupted export after it, the removed
+  pages were sent already
+
+The mirrors send EXPORT_TOKEN as a bearer token, the export is disabled
+without it.
+'''
+
+import json
+import operator
+from functools import reduce
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.http import require_GET
+
+from modelcluster.contrib.taggit import ClusterTaggableManager
+from modelcluster.fields import ParentalManyToManyField
+from wagtail.api.v2.utils import page_models_from_string
+from wagtail.core.fields import StreamField
+from wagtail.core.models import Page
+
+from project.api import get_related_fields, prefetch_parental_m2m
+
+DEFAULT_TYPES = 'home.ArticlePage,home.WikidataClass,home.ItemPage'
+
+BATCH_SIZE = 500
+
+
+def get_pages(page_models, since=None, after=None):
+    ''' Live and public pages of the given models, in tree order '''
+    from home.models import ChangedPage
+
+    pages = Page.objects.live().public()
+    pages = pages.filter(reduce(operator.or_, [pages.type_q(model) for model in page_models])).order_by('path')
+    if since is not None:
+        changed = ChangedPage.objects.filter(changed_at__gte=since).values('page_id')
+        pages = pages.filter(models.Q(last_published_at__gte=since) | models.Q(pk__in=changed))
+    if after:
+        pages = pages.filter(path__gt=after)
+    return pages
+
+
+def get_removed_pages(page_models, since):
+    ''' Pages of the given models removed from the export since a datetime '''
+    from home.models import RemovedPage
+
+    content_types = ContentType.objects.get_for_models(*page_models).values()
+    return RemovedPage.objects.filter(content_type__in=content_types, removed_at__gte=since).order_by('removed_at')
+
+
+def remember_removed_pages(pages):
+    ''' Record pages unpublished, deleted or made private, replacing their previous records '''
+    from home.models import RemovedPage
+
+    now = timezone.now()
+    RemovedPage.objects.filter(page_id__in=[page.pk for page in pages]).delete()
+    RemovedPage.objects.bulk_create([
+        RemovedPage(page_id=page.pk, content_type_id=page.content_type_id, path=page.path,
+                    url_path=page.url_path, removed_at=now)
+        for page in pages
+    ])
+
+
+def remember_changed_pages(page_ids):
+    ''' Record live pages changed without being published: moved, or made public again '''
+    from home.models import ChangedPage, RemovedPage
+
+    now = timezone.now()
+    page_ids = list(page_ids)
+    ChangedPage.objects.filter(page_id__in=page_ids).delete()
+    ChangedPage.objects.bulk_create([ChangedPage(page_id=page_id, changed_at=now) for page_id in page_ids])
+    # They are no longer removed, if they were
+    RemovedPage.objects.filter(page_id__in=page_ids).delete()
+
+
+def keyset_batches(pages, batch_size=BATCH_SIZE):
+    ''' Lists of (pk, path, content type id) of the pages, batch after batch '''
+    last_path = None
+    while True:
+        batch = pages if last_path is None else pages.filter(path__gt=last_path)
+        batch = list(batch.values_list('pk', 'path', 'content_type_id')[:batch_size])
+        if not batch:
+            break
+        yield batch
+        last_path = batch[-1][1]
+
+
+def get_export_fields(model):
+    ''' Fields of a model in its api_fields '''
+    names = [getattr(field, 'name', field) for field in getattr(model, 'api_fields', [])]
+    fields = []
+    for name in names:
+        try:
+            fields.append(model._meta.get_field(name))
+        except models.FieldDoesNotExist:
+            # Properties and other non model fields are not exported
+            continue
+    return fields
+
+
+def export_value(page, field):
+    if isinstance(field, ClusterTaggableManager):
+        return sorted(tag.name for tag in getattr(page, field.name).all())
+    if isinstance(field, ParentalManyToManyField) or field.many_to_many:
+        return [related.pk for related in getattr(page, field.name).all()]
+    if field.many_to_one or field.one_to_one:
+        return getattr(page, field.attname)
+    value = field.value_from_object(page)
+    if isinstance(field, StreamField):
+        return field.stream_block.get_prep_value(value)
+    return value
+
+
+def load_specific(batch):
+    ''' Specific pages of a batch in path order, with their relations '''
+    by_model = {}
+    for pk, path, content_type_id in batch:
+        by_model.setdefault(content_type_id, []).append(pk)
+
+    pages = {}
+    for content_type_id, pks in by_model.items():
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        fields = get_export_fields(model)
+        select, prefetch, parental = get_related_fields(model, [field.name for field in fields])
+        objects = model.objects.filter(pk__in=pks).select_related(*select).prefetch_related(*prefetch).in_bulk()
+        for name in parental:
+            prefetch_parental_m2m(list(objects.values()), name)
+        pages.update(objects)
+    return [pages[pk] for pk, path, content_type_id in batch if pk in pages]
+
+
+def export_record(page):
+    model = type(page)
+    return {
+        'id': page.pk,
+        'type': '%s.%s' % (model._meta.app_label, model.__name__),
+        'path': page.path,
+        'url_path': page.url_path,
+        'title': page.title,
+        'slug': page.slug,
+        'first_published_at': page.first_published_at,
+        'last_published_at': page.last_published_at,
+        'fields': {field.name: export_value(page, field) for field in get_export_fields(model)},
+    }
+
+
+def removed_record(removed):
+    model = removed.content_type.model_class()
+    return {
+        'id': removed.page_id,
+        'type': '%s.%s' % (model._meta.app_label, model.__name__),
+        'path': removed.path,
+        'url_path': removed.url_path,
+        'removed': True,
+        'removed_at': removed.removed_at,
+    }
+
+
+def export_lines(pages, batch_size=BATCH_SIZE, removed_pages=()):
+    ''' NDJSON lines of the removed pages, then of the pages batch after batch '''
+    for removed in removed_pages.iterator() if removed_pages else ():
+        yield json.dumps(removed_record(removed), cls=DjangoJSONEncoder, separators=(',', ':')) + '\n'
+    for batch in keyset_batches(pages, batch_size):
+        for page in load_specific(batch):
+            yield json.dumps(export_record(page), cls=DjangoJSONEncoder, separators=(',', ':')) + '\n'
+
+
+def parse_export_parameters(types, since):
+    '''
+    Returns (page models, since datetime).
+    Raises ValueError for unknown types or invalid timestamps.
+    '''
+    try:
+        page_models = page_models_from_string(types or DEFAULT_TYPES)
+    except LookupError as e:
+        raise ValueError('type: %s' % e)
+    if since:
+        since_datetime = parse_datetime(since)
+        if since_datetime is None:
+            raise ValueError('since must be an ISO 8601 timestamp')
+        if timezone.is_naive(since_datetime):
+            since_datetime = timezone.make_aware(since_datetime, timezone.utc)
+        return page_models, since_datetime
+    return page_models, None
+
+
+@require_GET
+def export(request):
+    if not settings.EXPORT_TOKEN:
+        raise Http404
+    if not constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), 'Bearer %s' % settings.EXPORT_TOKEN):
+        return HttpResponse(status=401)
+
+    started_at = timezone.now()
+    try:
+        page_models, since = parse_export_parameters(request.GET.get('type'), request.GET.get('since'))
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+    after = request.GET.get('after')
+    pages = get_pages(page_models, since, after)
+    removed_pages = get_removed_pages(page_models, since) if since is not None and not after else None
+    response = StreamingHttpResponse(
+        export_lines(pages, removed_pages=removed_pages), content_type='application/x-ndjson'
+    )
+    response['X-Export-Started-At'] = started_at.isoformat()
+    return response
@@ -0,0 +1,60 @@
+'''
+Purge of the pages cached by nginx, as a Wagtail frontend cache backend.
+
+nginx caches the pages of anonymous visitors (see server/nginx.tmpl). Open
+source nginx has no PURGE method and its cache files belong to its own user,
+so the backend refreshes the entries instead: it requests each URL from the
+internal server of nginx (LOCATION, not exposed by traefik), which skips the
+cached copy and stores the new response in its place. A page unpublished or
+moved away gets its 404 cached instead.
+
+The requests are sent by a background thread, so publishing does not wait
+for the pages to render. The URLs are chosen by home.page_cache: the pages
+and the listings showing them.
+'''
+
+import logging
+import threading
+from urllib.error import HTTPError, URLError
+from urllib.parse import quote, urlparse, urlunparse
+from urllib.request import Request, urlopen
+
+from wagtail.contrib.frontend_cache.backends import BaseBackend
+
+logger = logging.getLogger(__name__)
+
+
+class NginxRefreshBackend(BaseBackend):
+
+    def __init__(self, params):
+        location = urlparse(params.pop('LOCATION'))
+        self.scheme = location.scheme
+        self.netloc = location.netloc
+        self.timeout = params.pop('TIMEOUT', 30)
+
+    def purge(self, url):
+        self.purge_batch([url])
+
+    def purge_batch(self, urls):
+        threading.Thread(target=self.refresh_all, args=(list(urls),), name='frontend-cache', daemon=True).start()
+
+    def refresh_all(self, urls):
+        for url in urls:
+            self.refresh(url)
+
+    def refresh(self, url):
+        parsed = urlparse(url)
+        # Encoded like the paths browsers send, nginx caches by the raw path
+        path = quote(parsed.path or '/', safe="/%:@!$&'()*+,;=~")
+        request = Request(
+            urlunparse((self.scheme, self.netloc, path, parsed.params, parsed.query, '')),
+            headers={'Host': parsed.netloc},
+        )
+        try:
+            urlopen(request, timeout=self.timeout).close()
+        except HTTPError as e:
+            # The 404 of a page that is gone replaces it too
+            if e.code != 404:
+                logger.warning('Refreshing %s in the frontend cache returned %s', url, e.code)
+        except (URLError, OSError) as e:
+            logger.warning('Could not refresh %s in the frontend cache: %s', url, e)
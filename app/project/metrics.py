@@ -0,0 +1,253 @@
+'''
+Request metrics, aggregated across the uWSGI workers in Redis.
+
+With METRICS_ENABLED, MetricsMiddleware records for each request, by URL
+pattern and Wagtail page type:
+- its duration, counted in the buckets of a histogram
+- the number and the time of its SQL queries
+- the hits and misses of its cache reads (see project/cache.py)
+- the time spent rendering its templates (TemplateResponses, which covers
+  Wagtail pages)
+
+Each process adds them up in memory and a background thread adds them to
+Redis every METRICS_FLUSH_INTERVAL seconds, so a request costs no Redis
+call. When Redis is down they are kept until the next flush. The totals of
+all the workers are served at /metrics in the Prometheus text format, to the
+scrapers sending METRICS_TOKEN as a bearer token: the routes and timings of
+the site are not public, /metrics is disabled without a token.
+
+Slow requests can also be profiled, see project/profiler.py.
+'''
+
+import json
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connection
+from django.http import Http404, HttpResponse
+from django.utils.crypto import constant_time_compare
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+from project import profiler, shutdown
+
+logger = logging.getLogger(__name__)
+
+## Upper bounds of the buckets of the duration histogram, in seconds
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+SERIES_KEY = 'metrics:series'
+
+COUNTERS = (
+    ('sql_queries', 'django_sql_queries_total', 'SQL queries run by the requests'),
+    ('sql_seconds', 'django_sql_seconds_total', 'Time spent in SQL queries by the requests'),
+    ('cache_hits', 'django_cache_hits_total', 'Cache reads of the requests that found a value'),
+    ('cache_misses', 'django_cache_misses_total', 'Cache reads of the requests that found nothing'),
+    ('template_seconds', 'django_template_render_seconds_total', 'Time spent rendering the templates of the requests'),
+)
+
+_current = threading.local()
+_totals = defaultdict(Counter)
+_totals_lock = threading.Lock()
+_flusher = None
+
+
+## Recording
+
+def record_cache(hits, misses):
+    ''' Count cache reads, called by the cache backend, in requests only '''
+    stats = getattr(_current, 'stats', None)
+    if stats is not None:
+        stats['cache_hits'] += hits
+        stats['cache_misses'] += misses
+
+
+def set_page_type(request, page):
+    ''' Label the metrics of a request serving a Wagtail page with its model '''
+    request.metrics_page_type = type(page).__name__
+
+
+def time_query(execute, sql, params, many, context):
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        _current.stats['sql_queries'] += 1
+        _current.stats['sql_seconds'] += time.perf_counter() - start
+
+
+def get_bucket(duration):
+    for bound in BUCKETS:
+        if duration <= bound:
+            return str(bound)
+    return '+Inf'
+
+
+def add_request(labels, duration, stats):
+    stats = Counter(stats)
+    stats['count'] = 1
+    stats['duration'] = duration
+    stats['bucket:' + get_bucket(duration)] = 1
+    with _totals_lock:
+        _totals[labels].update(stats)
+    _start_flusher()
+
+
+class MetricsMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _current.stats = Counter()
+        profiling = profiler.start()
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(time_query):
+                response = self.get_response(request)
+        finally:
+            duration = time.perf_counter() - start
+            stacks = profiler.stop() if profiling else None
+            stats, _current.stats = _current.stats, None
+
+        match = request.resolver_match
+        labels = (match.route if match is not None else '', getattr(request, 'metrics_page_type', ''))
+        add_request(labels, duration, stats)
+        if stacks is not None and duration * 1000 >= settings.METRICS_PROFILE_THRESHOLD:
+            profiler.dump(stacks, request, duration)
+        return response
+
+    def process_template_response(self, request, response):
+        stats = _current.stats
+        start = time.perf_counter()
+
+        def add_render_time(response):
+            stats['template_seconds'] += time.perf_counter() - start
+
+        response.add_post_render_callback(add_render_time)
+        return response
+
+
+## Aggregation in Redis
+
+def series_key(labels):
+    return 'metrics:%s' % json.dumps(labels)
+
+
+def _start_flusher():
+    global _flusher
+    with _totals_lock:
+        if _flusher is None or not _flusher.is_alive():
+            _flusher = threading.Thread(target=_flush_periodically, name='metrics', daemon=True)
+            _flusher.start()
+
+
+def _flush_periodically():
+    stop = threading.Event()
+    while not stop.wait(settings.METRICS_FLUSH_INTERVAL):
+        try:
+            flush()
+        except RedisError as e:
+            logger.warning('Metrics kept in memory, Redis unavailable: %s', e)
+        except Exception:
+            logger.exception('Failed to write the metrics')
+
+
+@shutdown.register
+def flush():
+    ''' Add the totals of this process to Redis, or put them back if it fails '''
+    with _totals_lock:
+        totals = dict(_totals)
+        _totals.clear()
+    if not totals:
+        return
+    try:
+        write_totals(totals)
+    except Exception:
+        with _totals_lock:
+            for labels, stats in totals.items():
+                _totals[labels].update(stats)
+        raise
+
+
+def write_totals(totals):
+    redis = get_redis_connection('default')
+    pipeline = redis.pipeline(transaction=False)
+    for labels, stats in totals.items():
+        pipeline.sadd(SERIES_KEY, json.dumps(labels))
+        for field, value in stats.items():
+            if isinstance(value, float):
+                pipeline.hincrbyfloat(series_key(labels), field, value)
+            else:
+                pipeline.hincrby(series_key(labels), field, value)
+    pipeline.execute()
+
+
+def read_totals():
+    ''' Totals of all the processes, as {(route, page type): {field: value}} '''
+    redis = get_redis_connection('default')
+    series = [tuple(json.loads(labels)) for labels in redis.smembers(SERIES_KEY)]
+    pipeline = redis.pipeline(transaction=False)
+    for labels in series:
+        pipeline.hgetall(series_key(labels))
+    return {
+        labels: {field.decode(): float(value) for field, value in stats.items()}
+        for labels, stats in zip(series, pipeline.execute())
+    }
+
+
+## Prometheus endpoint
+
+def format_labels(labels, **extra):
+    pairs = list(zip(('route', 'page_type'), labels)) + list(extra.items())
+    escaped = [
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    ]
+    return '{%s}' % ','.join('%s="%s"' % pair for pair in escaped)
+
+
+def format_number(value):
+    return '%d' % value if value == int(value) else repr(value)
+
+
+def format_metrics(totals):
+    ''' Totals in the Prometheus text exposition format '''
+    series = sorted(totals.items())
+    lines = [
+        '# HELP django_request_duration_seconds Duration of the requests',
+        '# TYPE django_request_duration_seconds histogram',
+    ]
+    for labels, stats in series:
+        cumulated = 0
+        for bound in [str(bound) for bound in BUCKETS] + ['+Inf']:
+            cumulated += stats.get('bucket:' + bound, 0)
+            lines.append('django_request_duration_seconds_bucket%s %s' % (
+                format_labels(labels, le=bound), format_number(cumulated)
+            ))
+        lines.append('django_request_duration_seconds_sum%s %s' % (
+            format_labels(labels), format_number(stats.get('duration', 0))
+        ))
+        lines.append('django_request_duration_seconds_count%s %s' % (
+            format_labels(labels), format_number(stats.get('count', 0))
+        ))
+
+    for field, name, description in COUNTERS:
+        lines.append('# HELP %s %s' % (name, description))
+        lines.append('# TYPE %s counter' % name)
+        for labels, stats in series:
+            lines.append('%s%s %s' % (name, format_labels(labels), format_number(stats.get(field, 0))))
+    return '\n'.join(lines) + '\n'
+
+
+def metrics(request):
+    if not settings.METRICS_ENABLED or not settings.METRICS_TOKEN:
+        raise Http404
+    if not constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), 'Bearer %s' % settings.METRICS_TOKEN):
+        return HttpResponse(status=401)
+
+    flush()
+    return HttpResponse(format_metrics(read_totals()), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,88 @@
+'''
+Sampling profiler of the slow requests.
+
+With METRICS_PROFILE_THRESHOLD (milliseconds), one thread per process
+samples the stacks of the threads serving a request every
+METRICS_PROFILE_INTERVAL milliseconds. The requests slower than the
+threshold get their samples written to METRICS_PROFILE_DIR, one file per
+request, in the collapsed stack format ("frame;frame;frame count") read by
+flamegraph.pl and speedscope:
+
+    flamegraph.pl 20190101-120000-search-1520ms.folded > search.svg
+
+The others are dropped. The requests themselves are not slowed down: the
+stacks are read from sys._current_frames() by the sampling thread.
+'''
+
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+
+_requests = {}
+_requests_lock = threading.Lock()
+_sampler = None
+
+
+def start():
+    ''' Sample the current thread until stop(), if profiling is enabled '''
+    if not settings.METRICS_PROFILE_THRESHOLD:
+        return False
+    with _requests_lock:
+        _requests[threading.get_ident()] = Counter()
+    _start_sampler()
+    return True
+
+
+def stop():
+    ''' Collapsed stacks sampled since start(), with their number of samples '''
+    with _requests_lock:
+        return _requests.pop(threading.get_ident(), Counter())
+
+
+def _start_sampler():
+    global _sampler
+    with _requests_lock:
+        if _sampler is None or not _sampler.is_alive():
+            _sampler = threading.Thread(target=_sample_periodically, name='profiler', daemon=True)
+            _sampler.start()
+
+
+def _sample_periodically():
+    interval = settings.METRICS_PROFILE_INTERVAL / 1000
+    while True:
+        time.sleep(interval)
+        frames = sys._current_frames()
+        with _requests_lock:
+            for thread_id, stacks in _requests.items():
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    stacks[collapse(frame)] += 1
+
+
+def collapse(frame):
+    ''' Stack of a frame as "outermost;...;innermost", each frame as "function (file)" '''
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        filename = code.co_filename.rsplit('site-packages/', 1)[-1]
+        names.append('%s (%s)' % (code.co_name, filename))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def dump(stacks, request, duration):
+    ''' Write the samples of a slow request, returns the path of the file '''
+    os.makedirs(settings.METRICS_PROFILE_DIR, exist_ok=True)
+    name = re.sub(r'[^\w-]+', '-', request.path).strip('-') or 'root'
+    path = os.path.join(settings.METRICS_PROFILE_DIR, '%s-%s-%dms.folded' % (
+        time.strftime('%Y%m%d-%H%M%S'), name[:80], duration * 1000
+    ))
+    with open(path, 'w') as output:
+        for stack, count in stacks.most_common():
+            output.write('%s %d\n' % (stack, count))
+    return path
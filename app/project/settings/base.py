@@ -38,6 +38,7 @@ ALLOWED_HOSTS = os.getenv('ALLOWED_HOSTS', 'localhost').split(',')
 INSTALLED_APPS = [
     'home',
     'search',
+    'jobs',
 
     'wagtail.contrib.forms',
     'wagtail.contrib.redirects',
@@ -76,6 +77,8 @@ MIDDLEWARE = [
 
     'wagtail.core.middleware.SiteMiddleware',
     'wagtail.contrib.redirects.middleware.RedirectMiddleware',
+
+    'home.page_cache.UncacheableResponseMiddleware',
 ]
 
 ROOT_URLCONF = 'project.urls'
@@ -113,9 +116,96 @@ DATABASES = {
         'PASSWORD': os.environ.get('POSTGRES_PASSWORD', 'password'),
         'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
         'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+        # Seconds a thread keeps its connection, 0 to close it after each request
+        'CONN_MAX_AGE': int(os.getenv('DATABASE_CONN_MAX_AGE', 60)),
+    }
+}
+
+# Check the kept connections at the start of each request (see project/db.py)
+DATABASE_HEALTH_CHECKS = os.getenv('DATABASE_HEALTH_CHECKS', 'true') == 'true'
+
+if DATABASE_HEALTH_CHECKS:
+    MIDDLEWARE.insert(0, 'project.db.ConnectionCheckMiddleware')
+
+# DATABASE_POOL=pgbouncer connects through the pgbouncer container of
+# docker-compose, in transaction pooling mode: Postgres gets at most
+# PGBOUNCER_POOL_SIZE connections whatever the number of workers
+DATABASE_POOL = os.getenv('DATABASE_POOL', '')
+PGBOUNCER_POOL_SIZE = int(os.getenv('PGBOUNCER_POOL_SIZE', 20))
+PGBOUNCER_MAX_CLIENT_CONN = int(os.getenv('PGBOUNCER_MAX_CLIENT_CONN', 1000))
+
+if DATABASE_POOL == 'pgbouncer':
+    # Backups read every table in one transaction with server side cursors,
+    # they connect to Postgres directly (see project/backup.py)
+    DATABASES['direct'] = dict(DATABASES['default'], CONN_MAX_AGE=0, TEST={'MIRROR': 'default'})
+    DATABASES['default'].update({
+        'HOST': os.getenv('PGBOUNCER_HOST', 'pgbouncer'),
+        'PORT': os.getenv('PGBOUNCER_PORT', '6432'),
+        # Server side cursors (QuerySet.iterator) do not survive transaction pooling
+        'DISABLE_SERVER_SIDE_CURSORS': True,
+    })
+
+
+# Cache
+# Redis is shared by all uWSGI workers. When it is down, every worker falls
+# back to its own local memory cache (see project/cache.py).
+
+REDIS_URL = '{}:{}'.format(os.getenv('CACHE_URL', 'redis://localhost'), os.getenv('REDIS_PORT', '6379'))
+
+def redis_cache(db, prefix, timeout):
+    return {
+        'BACKEND': 'project.cache.FallbackRedisCache',
+        'LOCATION': '{}/{}'.format(REDIS_URL, db),
+        'KEY_PREFIX': prefix,
+        'TIMEOUT': timeout,
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            # One pool per worker process, shared by its threads
+            'CONNECTION_POOL_KWARGS': {
+                'max_connections': int(os.getenv('REDIS_MAX_CONNECTIONS', 50)),
+                'retry_on_timeout': True,
+            },
+            # Fail fast so that a Redis outage does not hold workers
+            'SOCKET_CONNECT_TIMEOUT': 1,
+            'SOCKET_TIMEOUT': 1,
+            'RETRY_AFTER': 30,
+        },
     }
+
+CACHES = {
+    'default': redis_cache(0, 'default', 300),
+    # Used by the {% cache %} template tag
+    'template_fragments': redis_cache(0, 'fragments', 3600),
 }
 
+# Sessions are read from Redis and written through to Postgres,
+# so a Redis outage does not log users out
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+# Full responses of HomePage, ArticlePage & ArticleCategory for anonymous users
+PAGE_CACHE_TIMEOUT = int(os.getenv('PAGE_CACHE_TIMEOUT', 10 * 60))
+
+# Pages of anonymous visitors cached by nginx (see server/nginx.tmpl), refreshed
+# on publish / unpublish / move through its internal server (see project/frontend_cache.py)
+FRONTEND_CACHE_LOCATION = os.getenv('FRONTEND_CACHE_LOCATION', '')
+if FRONTEND_CACHE_LOCATION:
+    WAGTAILFRONTENDCACHE = {
+        'nginx': {
+            'BACKEND': 'project.frontend_cache.NginxRefreshBackend',
+            'LOCATION': FRONTEND_CACHE_LOCATION,
+        },
+    }
+
+# Serialized pages of the API, invalidated on publish (see project/api.py)
+WAGTAILAPI_CACHE_TIMEOUT = int(os.getenv('WAGTAILAPI_CACHE_TIMEOUT', 24 * 60 * 60))
+
+# Bearer token of the mirrors reading /api/export/, which is disabled when it
+# is empty (see project/export.py)
+EXPORT_TOKEN = os.getenv('EXPORT_TOKEN', '')
+
+# Rendered blocks of ArticlePage.body & ItemPage.notes (see home/block_cache.py)
+BLOCK_CACHE_TIMEOUT = int(os.getenv('BLOCK_CACHE_TIMEOUT', 24 * 60 * 60))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -165,9 +255,12 @@ STATICFILES_DIRS = [
 # ManifestStaticFilesStorage is recommended in production, to prevent outdated
 # Javascript / CSS assets being served from cache (e.g. after a Wagtail upgrade).
 # See https://docs.djangoproject.com/en/2.2/ref/contrib/staticfiles/#manifeststaticfilesstorage
-STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.ManifestStaticFilesStorage'
+# The compressed copies of the files are served by nginx (see project/storage.py)
+STATICFILES_STORAGE = 'project.storage.CompressedManifestStaticFilesStorage'
 
-STATIC_ROOT = os.path.join(os.path.dirname(BASE_DIR), 'static')
+# The image collects the static files at build time in another STATIC_ROOT,
+# copied to the static-files volume when they changed (see config/start.sh)
+STATIC_ROOT = os.getenv('STATIC_ROOT', os.path.join(os.path.dirname(BASE_DIR), 'static'))
 STATIC_URL = '/static/'
 
 MEDIA_ROOT = os.path.join(os.path.dirname(BASE_DIR), 'media')
@@ -182,3 +275,133 @@ WAGTAIL_SITE_NAME = "project"
 # e.g. in notification emails. Don't include '/admin' or a trailing slash
 # MODIFIED
 BASE_URL = os.getenv('BASE_URL', 'http://example.com')
+
+
+# Wikidata settings
+
+WIKIDATA_SPARQL_ENDPOINT = os.getenv('WIKIDATA_SPARQL_ENDPOINT', 'https://query.wikidata.org/sparql')
+
+# Wikimedia asks for a descriptive User-Agent with a contact
+WIKIDATA_USER_AGENT = os.getenv('WIKIDATA_USER_AGENT', 'explore.ac/0.1 ({})'.format(BASE_URL))
+
+# SPARQL results of WdQueryBlock, in seconds :
+## Time before a result is refreshed
+WDQUERY_CACHE_TTL = int(os.getenv('WDQUERY_CACHE_TTL', 60 * 60))
+## Time a result is still served while it is refreshed in the background
+WDQUERY_STALE_TTL = int(os.getenv('WDQUERY_STALE_TTL', 24 * 60 * 60))
+## Time a failed query is remembered before it is retried
+WDQUERY_ERROR_TTL = int(os.getenv('WDQUERY_ERROR_TTL', 60))
+## Endpoint timeout, must stay below uWSGI harakiri
+WDQUERY_TIMEOUT = int(os.getenv('WDQUERY_TIMEOUT', 30))
+## Time a request waits for a query run by another worker
+WDQUERY_WAIT = int(os.getenv('WDQUERY_WAIT', 10))
+
+
+# Search settings
+
+# Elasticsearch is started by docker-compose. Use SEARCH_BACKEND=wagtail.search.backends.db
+# to run without it (slower, full scan of the database), or search.backends for
+# an in-memory index kept by each process, like in the tests (see search/backends.py).
+# AUTO_UPDATE is disabled because the index is updated in bulk, in the
+# background (see search/indexing.py)
+WAGTAILSEARCH_BACKENDS = {
+    'default': {
+        'BACKEND': os.getenv('SEARCH_BACKEND', 'wagtail.search.backends.elasticsearch2'),
+        'URLS': [os.getenv('ELASTICSEARCH_URL', 'http://elasticsearch:9200')],
+        'INDEX': os.getenv('ELASTICSEARCH_INDEX', 'wagtail'),
+        'TIMEOUT': 5,
+        'AUTO_UPDATE': False,
+    }
+}
+
+# 'thread' to update the index from a background thread, 'inline' to do it immediately
+SEARCH_INDEX_QUEUE = os.getenv('SEARCH_INDEX_QUEUE', 'thread')
+SEARCH_INDEX_BATCH_SIZE = 100
+## Seconds waited for more changes before a batch is sent
+SEARCH_INDEX_BATCH_DELAY = 2
+
+# Search hits are counted in memory and written every SEARCH_HITS_FLUSH_INTERVAL
+# seconds (see search/hits.py), 0 to write them immediately, or as soon as
+# SEARCH_HITS_FLUSH_SIZE hits are counted: the most a killed worker loses
+SEARCH_HITS_FLUSH_INTERVAL = int(os.getenv('SEARCH_HITS_FLUSH_INTERVAL', 30))
+SEARCH_HITS_FLUSH_SIZE = int(os.getenv('SEARCH_HITS_FLUSH_SIZE', 100))
+
+# Ids of the results of the searches, invalidated on publish (see search/results.py)
+SEARCH_CACHE_TIMEOUT = int(os.getenv('SEARCH_CACHE_TIMEOUT', 60 * 60))
+SEARCH_CACHE_MAX_RESULTS = 1000
+
+# Wikidata entities rendered by ItemPages (see home/wikidata.py)
+WIKIDATA_API_ENDPOINT = os.getenv('WIKIDATA_API_ENDPOINT', 'https://www.wikidata.org/w/api.php')
+WIKIDATA_LANGUAGE = os.getenv('WIKIDATA_LANGUAGE', 'en')
+WIKIDATA_API_TIMEOUT = int(os.getenv('WIKIDATA_API_TIMEOUT', 10))
+## Seconds before a stored entity is refreshed in the background
+WIKIDATA_ENTITY_TTL = int(os.getenv('WIKIDATA_ENTITY_TTL', 24 * 60 * 60))
+
+# Materialized tables of WikidataClass pages (see home/materialize.py)
+## Items fetched per SPARQL query
+WIKIDATA_CLASS_CHUNK_SIZE = int(os.getenv('WIKIDATA_CLASS_CHUNK_SIZE', 5000))
+WIKIDATA_CLASS_MAX_ROWS = int(os.getenv('WIKIDATA_CLASS_MAX_ROWS', 200000))
+## Timeout of one chunk query, they run outside of requests
+WIKIDATA_CLASS_TIMEOUT = int(os.getenv('WIKIDATA_CLASS_TIMEOUT', 60))
+## Seconds before a table is rebuilt by build_wikidata_class_tables --stale
+WIKIDATA_CLASS_TTL = int(os.getenv('WIKIDATA_CLASS_TTL', 24 * 60 * 60))
+WIKIDATA_CLASS_PER_PAGE = 50
+
+# Graph of the links between the stored items (see home/graph.py)
+GRAPH_DIR = os.getenv('GRAPH_DIR', '/srv/graph')
+## Nodes reached per hop from an item, the most strongly linked first
+GRAPH_MAX_FRONTIER = int(os.getenv('GRAPH_MAX_FRONTIER', 5000))
+GRAPH_MAX_HOPS = 3
+GRAPH_MAX_NODES = 100
+GRAPH_MAX_PATH_LENGTH = 6
+
+
+# Jobs settings (see jobs/queue.py)
+
+# 'worker' to run the jobs with the run_jobs command, 'thread' to run them in
+# a background thread of the web process, without a worker
+JOBS_QUEUE = os.getenv('JOBS_QUEUE', 'worker')
+## Seconds a result is served before the job is run again
+JOBS_RESULT_TTL = int(os.getenv('JOBS_RESULT_TTL', 7 * 24 * 60 * 60))
+## Seconds a failed job is remembered before it can be queued again
+JOBS_ERROR_TTL = int(os.getenv('JOBS_ERROR_TTL', 10 * 60))
+JOBS_MAX_ATTEMPTS = 3
+## Seconds before a failed attempt is retried, times the number of attempts
+JOBS_RETRY_DELAY = 30
+## Seconds after which a running job is considered abandoned by its worker
+JOBS_TIMEOUT = 10 * 60
+## Seconds an idle worker waits before looking for new jobs
+JOBS_POLL_INTERVAL = 1
+## Timeout of the SPARQL queries run by jobs
+WIKIDATA_JOB_TIMEOUT = int(os.getenv('WIKIDATA_JOB_TIMEOUT', 120))
+
+
+# Schedule settings
+
+# Commands run by "manage.py run_schedule" in the scheduler container, as
+# (minute, hour, command, arguments), hour None meaning every hour
+SCHEDULE = [
+    (0, 3, 'backup', []),
+    (30, None, 'build_wikidata_class_tables', ['--stale']),
+    (45, None, 'build_item_graph', []),
+]
+
+
+# Metrics settings (see project/metrics.py)
+
+# Records the latency, SQL queries, cache reads and template rendering of the
+# requests, served at /metrics for Prometheus with METRICS_TOKEN as a bearer
+# token. /metrics is disabled when the token is empty.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'false') == 'true'
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+METRICS_FLUSH_INTERVAL = int(os.getenv('METRICS_FLUSH_INTERVAL', 10))
+
+if METRICS_ENABLED:
+    MIDDLEWARE.insert(0, 'project.metrics.MetricsMiddleware')
+
+# Requests slower than METRICS_PROFILE_THRESHOLD milliseconds have their stacks,
+# sampled every METRICS_PROFILE_INTERVAL milliseconds, written to
+# METRICS_PROFILE_DIR (see project/profiler.py). 0 disables the profiler.
+METRICS_PROFILE_THRESHOLD = int(os.getenv('METRICS_PROFILE_THRESHOLD', 0)) if METRICS_ENABLED else 0
+METRICS_PROFILE_INTERVAL = int(os.getenv('METRICS_PROFILE_INTERVAL', 10))
+METRICS_PROFILE_DIR = os.getenv('METRICS_PROFILE_DIR', '/var/log/profiles')
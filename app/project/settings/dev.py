@@ -8,6 +8,9 @@ ALLOWED_HOSTS = ['*']
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
+# Run the jobs without a worker
+JOBS_QUEUE = os.getenv('JOBS_QUEUE', 'thread')
+
 
 try:
     from .local import *
@@ -0,0 +1,45 @@
+'''
+Functions run when the process exits, to write what it keeps in memory
+(search hits, search index queue, metrics).
+
+Python's atexit handlers are not run when uWSGI stops or recycles a
+worker: under uWSGI they are also run by the uwsgi.atexit hook. The
+functions have to be safe to run twice.
+'''
+
+import atexit
+import logging
+
+try:
+    import uwsgi
+except ImportError:
+    uwsgi = None
+
+logger = logging.getLogger(__name__)
+
+_functions = []
+
+
+def run():
+    for function in _functions:
+        try:
+            function()
+        except Exception:
+            logger.exception('Failed to run %s at exit', function.__qualname__)
+
+
+def register(function):
+    ''' Decorator registering a function run when the process exits '''
+    if not _functions:
+        atexit.register(run)
+        if uwsgi is not None:
+            previous = getattr(uwsgi, 'atexit', None)
+
+            def run_in_uwsgi():
+                run()
+                if previous is not None:
+                    previous()
+
+            uwsgi.atexit = run_in_uwsgi
+    _functions.append(function)
+    return function
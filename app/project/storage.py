@@ -0,0 +1,70 @@
+'''
+Static files storage writing compressed copies next to the files.
+
+collectstatic writes a .gz copy, and a .br copy when the brotli package is
+installed, of each text file (CSS, JavaScript, SVG, fonts without
+compression...), using a pool of processes. nginx serves them with
+gzip_static instead of compressing the same files in every response (see
+server/nginx.tmpl). Files that are already compressed (images, woff fonts,
+archives) and copies that would not be smaller are left out.
+'''
+
+import gzip
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSED_EXTENSIONS = {
+    '.gz', '.br', '.zip', '.bz2', '.xz', '.7z',
+    '.png', '.jpg', '.jpeg', '.gif', '.webp', '.ico',
+    '.woff', '.woff2', '.mp3', '.mp4', '.webm', '.ogg', '.pdf',
+}
+
+## Smaller files are not worth a compressed copy
+MIN_SIZE = 256
+
+
+def compress_file(path):
+    ''' Write the .gz and .br copies of a file, returns the number of copies written '''
+    with open(path, 'rb') as source:
+        content = source.read()
+
+    copies = {'.gz': gzip.compress(content, compresslevel=9)}
+    if brotli is not None:
+        copies['.br'] = brotli.compress(content, quality=11)
+
+    written = 0
+    for extension, compressed in copies.items():
+        if len(compressed) < len(content):
+            with open(path + extension, 'wb') as target:
+                target.write(compressed)
+            written += 1
+    return written
+
+
+def should_compress(path):
+    return (
+        os.path.splitext(path)[1].lower() not in COMPRESSED_EXTENSIONS
+        and os.path.getsize(path) >= MIN_SIZE
+    )
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+
+        # The original and hashed names of the files, and the manifest
+        names = set(paths) | set(self.hashed_files.values()) | {self.manifest_name}
+        files = [self.path(name) for name in sorted(names) if self.exists(name)]
+        files = [path for path in files if should_compress(path)]
+        with ProcessPoolExecutor() as pool:
+            list(pool.map(compress_file, files, chunksize=20))
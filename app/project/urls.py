@@ -6,9 +6,13 @@ from wagtail.admin import urls as wagtailadmin_urls
 from wagtail.core import urls as wagtail_urls
 from wagtail.documents import urls as wagtaildocs_urls
 
+from home import views as home_views
+from jobs import views as jobs_views
 from search import views as search_views
 
 from .api import api_router
+from .export import export
+from .metrics import metrics
 
 urlpatterns = [
     url(r'^django-admin/', admin.site.urls),
@@ -17,8 +21,21 @@ urlpatterns = [
     url(r'^documents/', include(wagtaildocs_urls)),
 
     url(r'^search/$', search_views.search, name='search'),
+    url(r'^search/autocomplete/$', search_views.suggestions, name='search_autocomplete'),
+    url(r'^search/facets/$', search_views.facets, name='search_facets'),
+
+    url(r'^jobs/(?P<kind>[a-z_]+)/(?P<qid>Q[0-9]+)/$', jobs_views.job_status, name='job_status'),
+
+    url(r'^graph/(?P<qid>Q[0-9]+)/$', home_views.graph_nearby, name='graph_nearby'),
+    url(r'^graph/(?P<source>Q[0-9]+)/path/(?P<target>Q[0-9]+)/$', home_views.graph_path, name='graph_path'),
+
+    url(r'^wdquery/(?P<page_id>[0-9]+)/(?P<table_id>[0-9a-f]{12})/$', home_views.wdquery_rows, name='wdquery_rows'),
+    url(r'^wdquery/(?P<page_id>[0-9]+)/(?P<table_id>[0-9a-f]{12})/(?P<format>csv|ndjson)/$', home_views.wdquery_download, name='wdquery_download'),
 
      url(r'^api/v2/', api_router.urls),
+    url(r'^api/export/$', export, name='export'),
+
+    url(r'^metrics$', metrics, name='metrics'),
 
     # For anything not caught by a more specific rule above, hand over to
     # Wagtail's page serving mechanism. This should be the last pattern in
@@ -0,0 +1,164 @@
+'''
+Autocomplete suggestions and facets of the searches, served as JSON.
+
+- suggestions for a prefix come from the autocomplete (edge ngram) fields of
+  the search backend for titles, and from the Qid columns for prefixes like
+  "Q42". Backends without autocomplete (the database one) match the start of
+  the titles instead
+- facets count the results of a query by page type, category and tag, from
+  the cached result ids (see search/results.py): one search, then a query per
+  facet on the database
+
+Both are cached per normalised prefix / query, with the generation of the
+search results: publishing a page invalidates them too.
+'''
+
+import hashlib
+import re
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db.models import Count
+
+from wagtail.core.models import Page
+from wagtail.search.backends import get_search_backend
+from wagtail.search.utils import normalise_query_string
+
+from search import results
+
+AUTOCOMPLETE_LIMIT = 10
+AUTOCOMPLETE_MIN_LENGTH = 2
+
+ENTITY_PREFIX = re.compile(r'^Q\d+$', re.IGNORECASE)
+
+
+def memoize_key(name, query_string):
+    query_string = hashlib.md5(query_string.encode('utf-8')).hexdigest()
+    return 'search-%s:%d:%s' % (name, results.get_generation(), query_string)
+
+
+def memoized(name, query_string, compute):
+    key = memoize_key(name, query_string)
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, settings.SEARCH_CACHE_TIMEOUT)
+    return value
+
+
+## Autocomplete
+
+def page_type(page):
+    model = page.specific_class or Page
+    return '%s.%s' % (model._meta.app_label, model.__name__)
+
+
+def complete_qids(prefix, limit):
+    '''
+    WikidataClass and ItemPage pages whose Qid starts with the prefix, found
+    with the varchar_pattern_ops indexes of the Qid columns
+    '''
+    from home.models import ItemPage, WikidataClass
+
+    prefix = prefix.upper()
+    pages = list(WikidataClass.objects.live().filter(class_Qid__startswith=prefix).order_by('class_Qid')[:limit])
+    pages += ItemPage.objects.live().filter(item_Qid__startswith=prefix).order_by('item_Qid')[:limit - len(pages)]
+    return pages
+
+
+def complete_titles(prefix, limit):
+    pages = Page.objects.live()
+    try:
+        return list(get_search_backend().autocomplete(prefix, pages)[:limit])
+    except NotImplementedError:
+        return list(pages.filter(title__istartswith=prefix).order_by('title')[:limit])
+
+
+def get_suggestions(prefix, request, limit=AUTOCOMPLETE_LIMIT):
+    '''
+    Pages completing a prefix, as JSON serializable dicts.
+    Returns an empty list for prefixes shorter than AUTOCOMPLETE_MIN_LENGTH.
+    '''
+    prefix = normalise_query_string(prefix)
+    if len(prefix) < AUTOCOMPLETE_MIN_LENGTH:
+        return []
+
+    def compute():
+        pages = complete_qids(prefix, limit) if ENTITY_PREFIX.match(prefix) else complete_titles(prefix, limit)
+        return [{
+            'id': page.pk,
+            'title': page.title,
+            'type': page_type(page),
+            'url': page.get_url(request),
+            'qid': getattr(page, 'class_Qid', None) or getattr(page, 'item_Qid', None),
+        } for page in pages]
+
+    # The urls depend on the site of the request
+    return memoized('autocomplete', '%s|%s|%d' % (request.get_host(), prefix, limit), compute)
+
+
+## Facets
+
+def count_types(page_ids):
+    # order_by() drops the tree ordering, which would split the groups
+    counts = Page.objects.filter(pk__in=page_ids).order_by().values_list('content_type').annotate(count=Count('pk'))
+    facet = []
+    for content_type_id, count in counts:
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        if model is not None:
+            facet.append({'type': '%s.%s' % (model._meta.app_label, model.__name__), 'count': count})
+    return facet
+
+
+def count_categories(page_ids):
+    from home.models import ArticlePage
+
+    counts = (
+        ArticlePage.categories.through.objects
+        .filter(articlepage_id__in=page_ids)
+        .order_by()
+        .values_list('articlecategory_id', 'articlecategory__title')
+        .annotate(count=Count('articlepage_id'))
+    )
+    return [{'id': pk, 'title': title, 'count': count} for pk, title, count in counts]
+
+
+def count_tags(page_ids):
+    from home.models import ArticlePageTag
+
+    counts = (
+        ArticlePageTag.objects
+        .filter(content_object_id__in=page_ids)
+        .order_by()
+        .values_list('tag__name', 'tag__slug')
+        .annotate(count=Count('content_object_id'))
+    )
+    return [{'name': name, 'slug': slug, 'count': count} for name, slug, count in counts]
+
+
+def get_facets(query_string):
+    '''
+    Counts of the results of a query per page type, category and tag.
+    Queries with more than SEARCH_CACHE_MAX_RESULTS results are counted on
+    their first SEARCH_CACHE_MAX_RESULTS results, and marked partial.
+    '''
+    query_string = normalise_query_string(query_string)
+
+    def compute():
+        page_ids = results.get_result_ids(query_string)
+        partial = page_ids is None
+        if partial:
+            page_ids = [
+                page.pk for page in Page.objects.live().search(query_string)[:settings.SEARCH_CACHE_MAX_RESULTS]
+            ]
+        return OrderedDict([
+            ('count', len(page_ids)),
+            ('partial', partial),
+            ('type', sorted(count_types(page_ids), key=lambda item: -item['count'])),
+            ('category', sorted(count_categories(page_ids), key=lambda item: -item['count'])),
+            ('tag', sorted(count_tags(page_ids), key=lambda item: -item['count'])),
+        ])
+
+    return memoized('facets', query_string, compute)
@@ -0,0 +1,123 @@
+'''
+In-memory search backend, a stand-in for Elasticsearch to run offline
+(tests, development without docker-compose): SEARCH_BACKEND=search.backends
+
+Like Elasticsearch, only the objects sent to the backend are found: pages
+are searchable once indexed by search/indexing.py or rebuild_search_index,
+and no longer once deleted from the index. The search itself is run by the
+database backend, restricted to the indexed objects.
+
+The indexes live in the memory of the process, by INDEX name. Each of them
+keeps the values of the filter fields of its documents, and the list of the
+requests it received, to check the batching of the indexer.
+'''
+
+from wagtail.search import index
+from wagtail.search.backends.db import DatabaseSearchBackend, DatabaseSearchResults
+
+_indexes = {}
+
+
+def get_index(name):
+    if name not in _indexes:
+        _indexes[name] = InMemoryIndex(name)
+    return _indexes[name]
+
+
+def get_model_root(model):
+    ''' Objects are indexed once, as their root model (e.g. Page) '''
+    parents = model._meta.get_parent_list()
+    return parents[-1] if parents else model
+
+
+class InMemoryIndex:
+
+    def __init__(self, name):
+        self.name = name
+        # (root model, pk): {filter field: value}
+        self.documents = {}
+        # (action, model, pks) in the order they were received
+        self.requests = []
+
+    def add_model(self, model):
+        pass
+
+    def refresh(self):
+        pass
+
+    def reset(self):
+        self.documents = {}
+        self.requests = []
+
+    def add_item(self, item):
+        self.add_items(type(item), [item])
+
+    def add_items(self, model, items):
+        self.requests.append(('add', model, [item.pk for item in items]))
+        filter_fields = [
+            field for field in model.get_search_fields()
+            if isinstance(field, index.FilterField)
+        ]
+        for item in items:
+            self.documents[(get_model_root(model), item.pk)] = {
+                field.field_name: field.get_value(item) for field in filter_fields
+            }
+
+    def delete_item(self, item):
+        self.requests.append(('delete', type(item), [item.pk]))
+        self.documents.pop((get_model_root(type(item)), item.pk), None)
+
+    def get_pks(self, model):
+        root = get_model_root(model)
+        return [pk for document_root, pk in self.documents if document_root is root]
+
+
+class InMemoryIndexRebuilder:
+    ''' Fills a new index, which replaces the current one once complete '''
+
+    def __init__(self, index):
+        self.index = InMemoryIndex(index.name)
+
+    def start(self):
+        return self.index
+
+    def finish(self):
+        _indexes[self.index.name] = self.index
+
+
+class InMemorySearchResults(DatabaseSearchResults):
+
+    def get_queryset(self):
+        # DatabaseSearchResults.get_queryset, on the indexed objects only
+        queryset = self.query_compiler.queryset
+        self.query_compiler._get_filters_from_queryset()
+        indexed = self.backend.get_index_for_model(queryset.model).get_pks(queryset.model)
+        q = self.query_compiler.build_database_filter()
+        return queryset.filter(pk__in=indexed).filter(q).distinct()[self.start:self.stop]
+
+
+class InMemorySearchBackend(DatabaseSearchBackend):
+    results_class = InMemorySearchResults
+    rebuilder_class = InMemoryIndexRebuilder
+
+    def __init__(self, params):
+        super().__init__(params)
+        self.index_name = params.get('INDEX', 'wagtail')
+
+    def get_index_for_model(self, model):
+        return get_index(self.index_name)
+
+    def reset_index(self):
+        self.get_index_for_model(None).reset()
+
+    def add(self, obj):
+        self.get_index_for_model(type(obj)).add_item(obj)
+
+    def add_bulk(self, model, obj_list):
+        self.get_index_for_model(model).add_items(model, obj_list)
+
+    def delete(self, obj):
+        self.get_index_for_model(type(obj)).delete_item(obj)
+
+
+SearchBackend = InMemorySearchBackend
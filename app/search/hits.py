@@ -0,0 +1,115 @@
+'''
+Search hits counted in memory and written in bulk.
+
+Query.get(query_string).add_hit() costs a get-or-create and an UPSERT on
+wagtailsearch_querydailyhits in every search request, and all the requests
+for a popular query update the same row. Instead, each process counts its
+hits by (query, day) and a background thread writes them every
+SEARCH_HITS_FLUSH_INTERVAL seconds, or as soon as SEARCH_HITS_FLUSH_SIZE hits
+are counted, in a few queries whatever their number. The remaining hits are
+written when the process exits (see project/shutdown.py), and at most
+SEARCH_HITS_FLUSH_SIZE hits are lost when a worker is killed.
+
+With SEARCH_HITS_FLUSH_INTERVAL = 0, hits are written immediately (tests,
+management commands).
+'''
+
+import logging
+import threading
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from wagtail.search.models import Query, QueryDailyHits
+from wagtail.search.utils import normalise_query_string
+
+from project import shutdown
+
+logger = logging.getLogger(__name__)
+
+_hits = Counter()
+_hits_lock = threading.Lock()
+_flusher = None
+## Set when enough hits are counted to write them before the end of the interval
+_flush_soon = threading.Event()
+
+
+def add_hit(query_string):
+    query_string = normalise_query_string(query_string)
+    if not query_string:
+        return
+    with _hits_lock:
+        _hits[query_string, timezone.now().date()] += 1
+        count = sum(_hits.values())
+
+    if settings.SEARCH_HITS_FLUSH_INTERVAL == 0:
+        flush()
+    else:
+        if count >= settings.SEARCH_HITS_FLUSH_SIZE:
+            _flush_soon.set()
+        _start_flusher()
+
+
+def _start_flusher():
+    global _flusher
+    with _hits_lock:
+        if _flusher is None or not _flusher.is_alive():
+            _flusher = threading.Thread(target=_flush_periodically, name='search-hits', daemon=True)
+            _flusher.start()
+
+
+def _flush_periodically():
+    while True:
+        _flush_soon.wait(settings.SEARCH_HITS_FLUSH_INTERVAL)
+        _flush_soon.clear()
+        try:
+            flush()
+        except Exception:
+            logger.exception('Failed to record the search hits')
+        finally:
+            # This thread has its own database connection
+            connection.close()
+
+
+@shutdown.register
+def flush():
+    ''' Write the counted hits, or put them back if the database fails '''
+    with _hits_lock:
+        hits = dict(_hits)
+        _hits.clear()
+    if not hits:
+        return
+    try:
+        write_hits(hits)
+    except Exception:
+        with _hits_lock:
+            _hits.update(hits)
+        raise
+
+
+@transaction.atomic
+def write_hits(hits):
+    '''
+    Add hits, as {(normalised query string, date): count}, to the daily hits
+    of the queries. Missing queries and daily hits rows are created first,
+    then the rows with the same count are updated by one query.
+    '''
+    query_strings = {query_string for query_string, date in hits}
+    Query.objects.bulk_create(
+        [Query(query_string=query_string) for query_string in query_strings], ignore_conflicts=True
+    )
+    query_ids = dict(Query.objects.filter(query_string__in=query_strings).values_list('query_string', 'id'))
+
+    QueryDailyHits.objects.bulk_create([
+        QueryDailyHits(query_id=query_ids[query_string], date=date, hits=0)
+        for query_string, date in hits
+    ], ignore_conflicts=True)
+
+    by_count = defaultdict(list)
+    for (query_string, date), count in hits.items():
+        by_count[date, count].append(query_ids[query_string])
+    for (date, count), ids in by_count.items():
+        QueryDailyHits.objects.filter(date=date, query_id__in=ids).update(hits=F('hits') + count)
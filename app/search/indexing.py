@@ -0,0 +1,138 @@
+'''
+Background updates of the search index.
+
+Wagtail's AUTO_UPDATE is disabled in the settings: it would index every saved
+object synchronously, in the request of the editor. Instead, pages are queued
+when they are published or unpublished, other indexed models (images,
+documents) when they are saved, and the queue is sent to the search backends
+in bulk.
+
+SEARCH_INDEX_QUEUE selects how the queue is processed:
+- 'thread': by a background thread of the current worker process (default)
+- 'inline': immediately, in the current thread (tests, management commands)
+'''
+
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection
+
+from wagtail.search import index
+from wagtail.search.backends import get_search_backends_with_name
+
+from project import shutdown
+
+logger = logging.getLogger(__name__)
+
+UPDATE = 'update'
+DELETE = 'delete'
+
+_queue = queue.Queue()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+## Queue
+
+def enqueue_update(instance):
+    instance = index.get_indexed_instance(instance, check_exists=False)
+    if instance is not None:
+        _put((UPDATE, type(instance), instance.pk))
+
+
+def enqueue_delete(instance):
+    # The object is no longer in the database, so the instance itself is queued
+    instance = index.get_indexed_instance(instance, check_exists=False)
+    if instance is not None:
+        _put((DELETE, type(instance), instance))
+
+
+def _put(item):
+    if settings.SEARCH_INDEX_QUEUE == 'inline':
+        process([item])
+        return
+    _queue.put(item)
+    _start_worker()
+
+
+def _start_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_work, name='search-index', daemon=True)
+            _worker.start()
+
+
+def _next_batch(block=True):
+    ''' Wait for an item, then gather the ones queued in the next few seconds '''
+    try:
+        items = [_queue.get(block=block)]
+    except queue.Empty:
+        return []
+    deadline = time.time() + settings.SEARCH_INDEX_BATCH_DELAY
+    while len(items) < settings.SEARCH_INDEX_BATCH_SIZE:
+        try:
+            items.append(_queue.get(timeout=max(deadline - time.time(), 0)))
+        except queue.Empty:
+            break
+    return items
+
+
+def _work():
+    while True:
+        items = _next_batch()
+        try:
+            process(items)
+        except Exception:
+            logger.exception('Failed to update the search index')
+        finally:
+            # This thread has its own database connection
+            connection.close()
+
+
+@shutdown.register
+def flush():
+    ''' Process what is left in the queue, e.g. when a worker is recycled '''
+    items = _next_batch(block=False)
+    while items:
+        process(items)
+        items = _next_batch(block=False)
+
+
+## Processing
+
+def process(items):
+    '''
+    Send a batch of queued changes to all the search backends.
+    Updated objects are read again from the database, in one query per model.
+    '''
+    updates = defaultdict(set)
+    deletes = []
+    for action, model, value in items:
+        if action == UPDATE:
+            updates[model].add(value)
+        else:
+            deletes.append(value)
+
+    backends = list(get_search_backends_with_name())
+
+    for model, pks in updates.items():
+        objects = list(model.get_indexed_objects().filter(pk__in=pks))
+        if not objects:
+            continue
+        for backend_name, backend in backends:
+            try:
+                backend.add_bulk(model, objects)
+            except Exception:
+                logger.exception("Failed to index %d %s in the '%s' search backend", len(objects), model.__name__, backend_name)
+
+    for obj in deletes:
+        for backend_name, backend in backends:
+            try:
+                backend.delete(obj)
+            except Exception:
+                logger.exception("Failed to delete %r from the '%s' search backend", obj, backend_name)
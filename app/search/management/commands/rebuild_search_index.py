@@ -0,0 +1,82 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import reset_queries
+
+from wagtail.search.backends import get_search_backend
+from wagtail.search.index import get_indexed_models
+from wagtail.search.management.commands.update_index import group_models_by_index
+
+DEFAULT_BATCH_SIZE = 500
+
+
+def keyset_batches(queryset, batch_size):
+    '''
+    Yield a queryset in lists of at most batch_size objects, ordered by pk.
+    Each batch is a "pk > last pk" query: no OFFSET scan, no long transaction
+    and only one batch in memory at a time.
+    '''
+    queryset = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        batch_queryset = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        batch = list(batch_queryset[:batch_size])
+        if not batch:
+            break
+        yield batch
+        last_pk = batch[-1].pk
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the search indexes, streaming the indexed objects in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--backend', action='store', dest='backend_name', default=None,
+            help="Specify a backend to rebuild")
+        parser.add_argument(
+            '--batch-size', action='store', dest='batch_size', type=int, default=DEFAULT_BATCH_SIZE,
+            help="Number of objects fetched and sent to the backend at once")
+
+    def handle(self, **options):
+        if options['backend_name']:
+            backend_names = [options['backend_name']]
+        else:
+            backend_names = settings.WAGTAILSEARCH_BACKENDS.keys()
+
+        for backend_name in backend_names:
+            self.rebuild_backend(backend_name, options['batch_size'])
+
+    def rebuild_backend(self, backend_name, batch_size):
+        backend = get_search_backend(backend_name)
+
+        if not backend.rebuilder_class:
+            self.stdout.write("Backend '%s' doesn't require rebuilding" % backend_name)
+            return
+
+        for index, models in group_models_by_index(backend, get_indexed_models()).items():
+            self.stdout.write('%s: rebuilding index %s' % (backend_name, index.name))
+            start = time.time()
+
+            rebuilder = backend.rebuilder_class(index)
+            index = rebuilder.start()
+
+            for model in models:
+                index.add_model(model)
+
+            object_count = 0
+            for model in models:
+                for batch in keyset_batches(model.get_indexed_objects(), batch_size):
+                    index.add_items(model, batch)
+                    object_count += len(batch)
+                    # Query logging would keep every batch in memory with DEBUG = True
+                    reset_queries()
+                self.stdout.write('%s: %s.%s done' % (backend_name, model._meta.app_label, model.__name__))
+
+            rebuilder.finish()
+
+            elapsed = time.time() - start
+            self.stdout.write(self.style.SUCCESS('%s: indexed %d objects in %.1fs (%.0f objects/s)' % (
+                backend_name, object_count, elapsed, object_count / elapsed if elapsed else 0
+            )))
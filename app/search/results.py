@@ -0,0 +1,60 @@
+'''
+Cache of search results, for the popular queries.
+
+The ids of the pages found for a query are cached, up to
+SEARCH_CACHE_MAX_RESULTS of them, so repeated searches only load the pages
+of the requested result page from the database instead of asking the search
+backend. The keys hold a generation number bumped whenever a page is
+published, unpublished or deleted, which invalidates all the cached results
+at once.
+'''
+
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+from wagtail.core.models import Page
+from wagtail.search.utils import normalise_query_string
+
+GENERATION_KEY = 'search-generation'
+
+
+def get_generation():
+    return cache.get(GENERATION_KEY, 0)
+
+
+def invalidate():
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        # The generation is not in the cache yet
+        cache.set(GENERATION_KEY, 1, None)
+
+
+def results_key(query_string):
+    query_string = hashlib.md5(normalise_query_string(query_string).encode('utf-8')).hexdigest()
+    return 'search-results:%d:%s' % (get_generation(), query_string)
+
+
+def get_result_ids(query_string):
+    '''
+    Ids of the live pages matching a query, in the order of relevance.
+    Returns None when there are more than SEARCH_CACHE_MAX_RESULTS results:
+    those are searched by the backend, page after page.
+    '''
+    key = results_key(query_string)
+    result_ids = cache.get(key)
+    if result_ids is None:
+        results = Page.objects.live().search(query_string)[:settings.SEARCH_CACHE_MAX_RESULTS + 1]
+        result_ids = [page.pk for page in results]
+        if len(result_ids) > settings.SEARCH_CACHE_MAX_RESULTS:
+            result_ids = False
+        cache.set(key, result_ids, settings.SEARCH_CACHE_TIMEOUT)
+    return None if result_ids is False else result_ids
+
+
+def get_pages(page_ids):
+    ''' Live pages in the order of the ids, without the pages unpublished since '''
+    pages = Page.objects.live().in_bulk(page_ids)
+    return [pages[pk] for pk in page_ids if pk in pages]
@@ -0,0 +1,44 @@
+from django.db.models.signals import post_delete, post_save
+
+from wagtail.core.models import Page
+from wagtail.core.signals import page_published, page_unpublished
+from wagtail.search.index import get_indexed_models
+
+from search import indexing, results
+
+
+## Search index updates
+
+def index_page(sender, instance, **kwargs):
+    indexing.enqueue_update(instance)
+
+
+def index_object(sender, instance, **kwargs):
+    indexing.enqueue_update(instance)
+
+
+def unindex_object(sender, instance, **kwargs):
+    indexing.enqueue_delete(instance)
+
+
+# Pages are indexed when they are published, not on every draft save
+page_published.connect(index_page)
+page_unpublished.connect(index_page)
+
+for model in get_indexed_models():
+    if not getattr(model, 'search_auto_update', True):
+        continue
+    if not issubclass(model, Page):
+        post_save.connect(index_object, sender=model)
+    post_delete.connect(unindex_object, sender=model)
+
+
+## Cached search results, see search/results.py
+
+def invalidate_results(sender, instance, **kwargs):
+    results.invalidate()
+
+
+page_published.connect(invalidate_results)
+page_unpublished.connect(invalidate_results)
+post_delete.connect(invalidate_results, sender=Page)
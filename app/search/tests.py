@@ -0,0 +1,112 @@
+import datetime
+import io
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from wagtail.core.models import Page
+from wagtail.search.models import QueryDailyHits
+
+from home.models import ArticlePage
+from home.tests import LOCAL_CACHES, SEARCH_BACKENDS, make_home_page
+from project import shutdown
+from search import backends, hits, indexing
+
+
+@override_settings(CACHES=LOCAL_CACHES, WAGTAILSEARCH_BACKENDS=SEARCH_BACKENDS, SEARCH_INDEX_BATCH_DELAY=0)
+class IndexingTests(TestCase):
+
+    def setUp(self):
+        self.index = backends.get_index('tests')
+        self.index.reset()
+        self.home = make_home_page()
+
+    def add_article(self, slug):
+        return self.home.add_child(instance=ArticlePage(
+            title='Indexed %s' % slug, slug=slug, date=datetime.date(2019, 1, 1), body='[]'
+        ))
+
+    def search(self, query):
+        return [page.pk for page in Page.objects.live().search(query)]
+
+    @override_settings(SEARCH_INDEX_QUEUE='thread')
+    def test_publish_burst_is_one_bulk_update(self):
+        articles = [self.add_article('burst-%d' % i) for i in range(3)]
+        # Nothing is indexed in the request, the queue is processed by the background thread
+        with mock.patch.object(indexing, '_start_worker'):
+            for article in articles:
+                article.save_revision().publish()
+        self.assertEqual(self.index.requests, [])
+
+        indexing.flush()
+        self.assertEqual(len(self.index.requests), 1)
+        action, model, pks = self.index.requests[0]
+        self.assertEqual((action, model), ('add', ArticlePage))
+        self.assertEqual(sorted(pks), sorted(article.pk for article in articles))
+        self.assertEqual(sorted(self.search('burst')), sorted(article.pk for article in articles))
+
+    @override_settings(SEARCH_INDEX_QUEUE='inline')
+    def test_unpublished_and_deleted_pages(self):
+        unpublished, deleted = self.add_article('unpublished'), self.add_article('deleted')
+        for article in (unpublished, deleted):
+            article.save_revision().publish()
+        self.assertEqual(sorted(self.search('indexed')), sorted([unpublished.pk, deleted.pk]))
+
+        unpublished.unpublish()
+        self.assertFalse(self.index.documents[(Page, unpublished.pk)]['live'])
+        deleted.delete()
+        self.assertNotIn((Page, deleted.pk), self.index.documents)
+        self.assertEqual(self.search('indexed'), [])
+
+    def test_rebuild_in_keyset_batches(self):
+        articles = [self.add_article('rebuilt-%d' % i) for i in range(5)]
+        # Not indexed yet, like pages created before the index
+        self.assertEqual(self.search('rebuilt'), [])
+
+        with CaptureQueriesContext(connection) as queries:
+            call_command('rebuild_search_index', batch_size=2, stdout=io.StringIO())
+
+        index = backends.get_index('tests')
+        self.assertIsNot(index, self.index)
+        batches = [pks for action, model, pks in index.requests if model is ArticlePage]
+        self.assertEqual(batches, [[articles[0].pk, articles[1].pk], [articles[2].pk, articles[3].pk], [articles[4].pk]])
+        self.assertFalse([query for query in queries.captured_queries if 'OFFSET' in query['sql']])
+        self.assertEqual(sorted(self.search('rebuilt')), sorted(article.pk for article in articles))
+
+
+@override_settings(SEARCH_HITS_FLUSH_INTERVAL=3600, SEARCH_HITS_FLUSH_SIZE=3)
+class HitsTests(TestCase):
+
+    def setUp(self):
+        hits._hits.clear()
+        hits._flush_soon.clear()
+        start_flusher = mock.patch.object(hits, '_start_flusher')
+        start_flusher.start()
+        self.addCleanup(start_flusher.stop)
+
+    def daily_hits(self):
+        return {(row.query.query_string, row.hits) for row in QueryDailyHits.objects.select_related('query')}
+
+    def test_written_once_enough_are_counted(self):
+        hits.add_hit('Cats')
+        hits.add_hit('dogs')
+        self.assertFalse(hits._flush_soon.is_set())
+        hits.add_hit('cats ')
+        self.assertTrue(hits._flush_soon.is_set())
+
+        hits.flush()
+        self.assertEqual(self.daily_hits(), {('cats', 2), ('dogs', 1)})
+        hits.add_hit('cats')
+        hits.flush()
+        self.assertEqual(self.daily_hits(), {('cats', 3), ('dogs', 1)})
+
+    def test_written_when_uwsgi_stops_the_worker(self):
+        uwsgi = mock.Mock(spec=['atexit'], atexit=None)
+        with mock.patch.object(shutdown, 'uwsgi', uwsgi), mock.patch.object(shutdown, '_functions', []), \
+                mock.patch.object(shutdown, 'atexit'):
+            shutdown.register(hits.flush)
+            hits.add_hit('cats')
+            uwsgi.atexit()
+        self.assertEqual(self.daily_hits(), {('cats', 1)})
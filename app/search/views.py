@@ -1,21 +1,25 @@
 from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
-from django.shortcuts import render
+from django.http import JsonResponse
+from django.template.response import TemplateResponse
+from django.views.decorators.http import require_GET
 
 from wagtail.core.models import Page
-from wagtail.search.models import Query
+
+from search import autocomplete, hits, results
 
 
 def search(request):
     search_query = request.GET.get('query', None)
     page = request.GET.get('page', 1)
+    result_ids = None
 
-    # Search
+    # Search, from the cached results of the query if it has not too many of them
     if search_query:
-        search_results = Page.objects.live().search(search_query)
-        query = Query.get(search_query)
+        result_ids = results.get_result_ids(search_query)
+        search_results = Page.objects.live().search(search_query) if result_ids is None else result_ids
 
-        # Record hit
-        query.add_hit()
+        # Record hit, written later in bulk
+        hits.add_hit(search_query)
     else:
         search_results = Page.objects.none()
 
@@ -28,7 +32,32 @@ def search(request):
     except EmptyPage:
         search_results = paginator.page(paginator.num_pages)
 
-    return render(request, 'search/search.html', {
+    if result_ids is not None:
+        search_results.object_list = results.get_pages(search_results.object_list)
+
+    return TemplateResponse(request, 'search/search.html', {
         'search_query': search_query,
         'search_results': search_results,
     })
+
+
+@require_GET
+def suggestions(request):
+    ''' Pages completing the "q" prefix, for the search boxes '''
+    prefix = request.GET.get('q', '')
+    return JsonResponse({
+        'query': prefix,
+        'results': autocomplete.get_suggestions(prefix, request),
+    })
+
+
+@require_GET
+def facets(request):
+    ''' Counts of the results of the "query" search by page type, category and tag '''
+    search_query = request.GET.get('query', '')
+    if not search_query:
+        return JsonResponse({'error': 'query is required'}, status=400)
+    return JsonResponse({
+        'query': search_query,
+        'facets': autocomplete.get_facets(search_query),
+    })